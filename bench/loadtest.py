@@ -0,0 +1,343 @@
+"""End-to-end load test: virtual users going through a whole purchase.
+
+    python -m bench.loadtest [--users 20] [--duration 60] [--cart-items 3]
+                             [--workers 2] [--worker-class uvicorn.workers.UvicornWorker]
+                             [--bank-latency 0.05] [--bank-error-rate 0.01]
+                             [--url http://127.0.0.1:8000] [--output results.json]
+
+Each virtual user repeats a new customer's journey until ``--duration`` is up:
+
+    reg -> register -> login -> addcart x N -> checkout_data
+        -> validate_checkout (contact, shipping) -> buy -> conf
+
+and every request is timed under the name of its view. A step that fails
+(unexpected status, wrong redirect, timeout) ends that journey.
+
+The bank is replaced by logic/fakebank.py on ``--bank-port`` with
+``--bank-latency`` and ``--bank-error-rate``, and Gmail by the SMTP sink
+from logic/fakesmtp.py on ``--smtp-port``. Unless ``--url`` points at an app
+that is already running (and configured to use those two), the app is started
+under gunicorn with ``--workers`` and ``--worker-class``, plus an outbox
+worker (``manage.py drain_outbox``) to send the order emails, with rate
+limits off since every virtual user comes from the same address. The
+database and Redis are the ones from the settings: use a disposable
+database, the run creates a user and an order per journey.
+
+Requests finishing in the first ``--warmup`` seconds are not counted. The
+results are printed as a table and written as JSON to ``--output``: per
+endpoint the request count, throughput, error rate and p50/p95/p99 latency,
+plus the journeys completed and what the bank and the SMTP sink saw, along
+with the git commit and the options, so runs of different releases and
+worker setups can be compared.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import secrets
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import httpx
+
+from logic.fakebank import FakeBank
+from logic.fakesmtp import SMTPSink
+
+
+ROOT = Path(__file__).resolve().parent.parent
+ENDPOINTS = ['reg', 'register', 'login', 'addcart', 'checkout_data', 'validate_checkout', 'buy', 'conf']
+PRODUCTS = ['headphones', 'mouse', 'keyboard', 'usb']
+XHR = {'X-Requested-With': 'XMLHttpRequest'}
+
+CUSTOMER = {
+    'first_name': 'Load',
+    'last_name': 'Tester',
+    'phone_number': '123456789',
+    'address': '1 Load Test St',
+    'city': 'Warsaw',
+    'state': 'Mazovia',
+    'zipcode': '00-000',
+    'country': 'Poland',
+}
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Stats:
+    """Latencies and outcomes per endpoint, ignoring the warm-up."""
+
+    def __init__(self, warmup):
+        self.counting_from = time.perf_counter() + warmup
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.statuses = defaultdict(Counter)
+        self.journeys = Counter()
+
+    def counting(self):
+        return time.perf_counter() >= self.counting_from
+
+    def add(self, endpoint, seconds, status, ok):
+        if not self.counting():
+            return
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][str(status)] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return None
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class VirtualUser:
+    def __init__(self, client, stats, args, name):
+        self.client = client
+        self.stats = stats
+        self.args = args
+        self.name = name
+
+    def csrf(self):
+        return {'X-CSRFToken': self.client.cookies.get('csrftoken', '')}
+
+    async def step(self, endpoint, method, path, expect=200, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.add(endpoint, time.perf_counter() - start, type(e).__name__, False)
+            raise StepFailed(endpoint)
+        ok = response.status_code == expect
+        if ok and expect == 302:
+            ok = response.headers['location'].startswith('/conf/')
+        self.stats.add(endpoint, time.perf_counter() - start, response.status_code, ok)
+        if not ok:
+            raise StepFailed(endpoint)
+        return response
+
+    async def journey(self, n):
+        username = f"{self.name}-{n}"
+        password = secrets.token_urlsafe(12)
+        credentials = {'username': username, 'password': password}
+
+        await self.step('reg', 'GET', '/reg')
+        await self.step('register', 'POST', '/register', json=credentials, headers={**XHR, **self.csrf()})
+        await self.step('login', 'POST', '/login', json=credentials, headers={**XHR, **self.csrf()})
+        for _ in range(self.args.cart_items):
+            await self.step('addcart', 'POST', '/api/addcart/',
+                            json={'product': random.choice(self.args.products)}, headers={**XHR, **self.csrf()})
+        await self.step('checkout_data', 'GET', '/api/checkout/', headers=XHR)
+
+        customer = {**CUSTOMER, 'email': f"{username}@example.com"}
+        for form_type in ('contact', 'shipping'):
+            await self.step('validate_checkout', 'POST', '/api/validate-checkout/',
+                            json={**customer, 'form_type': form_type}, headers={**XHR, **self.csrf()})
+
+        card = {'Card': '4' + ''.join(random.choices('0123456789', k=15)), 'HoldName': 'Load Tester', 'CVV': '123'}
+        response = await self.step('buy', 'POST', '/buy/', expect=302, data={**customer, **card})
+        await self.step('conf', 'GET', response.headers['location'])
+
+    async def run(self, deadline):
+        n = 0
+        while time.perf_counter() < deadline:
+            n += 1
+            self.client.cookies.clear()
+            try:
+                await self.journey(n)
+            except StepFailed:
+                outcome = 'failed'
+            else:
+                outcome = 'completed'
+            if self.stats.counting():
+                self.stats.journeys[outcome] += 1
+
+
+async def generate_load(args, stats):
+    run_id = secrets.token_hex(3)
+    deadline = time.perf_counter() + args.warmup + args.duration
+    clients = [
+        httpx.AsyncClient(base_url=args.url, timeout=args.timeout, follow_redirects=False)
+        for _ in range(args.users)
+    ]
+    try:
+        await asyncio.gather(*(
+            VirtualUser(client, stats, args, f"load{run_id}u{i}").run(deadline)
+            for i, client in enumerate(clients)
+        ))
+    finally:
+        for client in clients:
+            await client.aclose()
+
+
+def start_app(args, bank, sink):
+    env = {
+        **os.environ,
+        'BANK_URL': bank.url,
+        'EMAIL_HOST': sink.host,
+        'EMAIL_PORT': str(sink.port),
+        'EMAIL_USE_TLS': '0',
+        'EMAIL_HOST_USER': '',
+        'EMAIL_HOST_PASSWORD': '',
+        'RATELIMIT_ENABLED': '1' if args.rate_limits else '0',
+    }
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'settings.settings')
+    # The fake bank does not check the service token, but the client needs one.
+    env.setdefault('JWT_SECRET', secrets.token_hex(32))
+
+    application = 'settings.asgi:application' if 'uvicorn' in args.worker_class else 'settings.wsgi:application'
+    commands = [
+        [sys.executable, '-m', 'gunicorn', application, '-k', args.worker_class, '-w', str(args.workers),
+         '-b', f'127.0.0.1:{args.port}', '--log-level', 'warning'],
+        [sys.executable, 'manage.py', 'drain_outbox'],
+    ]
+    return [subprocess.Popen(command, cwd=ROOT, env=env) for command in commands]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/reg", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    sys.exit(f"The app did not answer on {url} within {timeout}s")
+
+
+def stop(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def report(args, stats, elapsed, bank, sink):
+    endpoints = {}
+    for name in ENDPOINTS:
+        latencies = sorted(stats.latencies.get(name, []))
+        if not latencies:
+            continue
+        endpoints[name] = {
+            'requests': len(latencies),
+            'errors': stats.errors[name],
+            'error_rate': round(stats.errors[name] / len(latencies), 4),
+            'rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': milliseconds(percentile(latencies, 50)),
+            'p95_ms': milliseconds(percentile(latencies, 95)),
+            'p99_ms': milliseconds(percentile(latencies, 99)),
+            'max_ms': milliseconds(latencies[-1]),
+            'statuses': dict(stats.statuses[name]),
+        }
+    requests = sum(e['requests'] for e in endpoints.values())
+    errors = sum(e['errors'] for e in endpoints.values())
+    return {
+        'commit': git_commit(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'options': vars(args),
+        'duration_s': round(elapsed, 1),
+        'requests': requests,
+        'errors': errors,
+        'error_rate': round(errors / requests, 4) if requests else None,
+        'rps': round(requests / elapsed, 2),
+        'journeys': {
+            'completed': stats.journeys['completed'],
+            'failed': stats.journeys['failed'],
+            'per_second': round(stats.journeys['completed'] / elapsed, 2),
+        },
+        'endpoints': endpoints,
+        'bank': {'requests': len(bank.requests), 'injected_errors': bank.errors},
+        'smtp': {'messages': sink.messages, 'connections': sink.connections},
+    }
+
+
+def print_table(result):
+    print(f"{'endpoint':<19}{'reqs':>8}{'rps':>9}{'err %':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    rows = [*result['endpoints'].items(), ('total', {
+        **result, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None,
+    })]
+    for name, row in rows:
+        error_rate = row['error_rate'] * 100 if row['error_rate'] is not None else 0
+        latencies = ''.join(f"{row[key] if row[key] is not None else '-':>9}" for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f"{name:<19}{row['requests']:>8}{row['rps']:>9.1f}{error_rate:>8.2f}{latencies}")
+    journeys = result['journeys']
+    print(f"journeys: {journeys['completed']} completed ({journeys['per_second']}/s), {journeys['failed']} failed; "
+          f"bank: {result['bank']['requests']} calls, {result['bank']['injected_errors']} injected errors; "
+          f"smtp: {result['smtp']['messages']} messages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='seconds measured, after the warm-up')
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--cart-items', type=int, default=3)
+    parser.add_argument('--products', type=lambda s: s.split(','), default=PRODUCTS, help='comma-separated SKUs')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--url', help='load an app that is already running instead of starting one')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-class', default='uvicorn.workers.UvicornWorker')
+    parser.add_argument('--rate-limits', action='store_true', help='keep rate limits on in the started app')
+    parser.add_argument('--bank-port', type=int, default=8001)
+    parser.add_argument('--bank-latency', type=float, default=0.0)
+    parser.add_argument('--bank-error-rate', type=float, default=0.0)
+    parser.add_argument('--smtp-port', type=int, default=1025)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    bank = FakeBank(port=args.bank_port, balance=1e12, latency=args.bank_latency,
+                    error_rate=args.bank_error_rate).start()
+    sink = SMTPSink(port=args.smtp_port).start()
+    processes = []
+    try:
+        if not args.url:
+            args.url = f"http://127.0.0.1:{args.port}"
+            processes = start_app(args, bank, sink)
+        wait_until_up(args.url)
+
+        stats = Stats(args.warmup)
+        asyncio.run(generate_load(args, stats))
+        elapsed = time.perf_counter() - stats.counting_from
+        if processes:
+            # Give the outbox worker a moment to send the last emails.
+            time.sleep(2)
+        result = report(args, stats, elapsed, bank, sink)
+    finally:
+        stop(processes)
+        sink.stop()
+        bank.stop()
+
+    print_table(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2) + '\n')
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
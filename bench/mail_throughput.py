@@ -0,0 +1,57 @@
+"""Order email throughput: send_mail per message vs the shared dispatcher.
+
+    python -m bench.mail_throughput [--messages 500] [--port 2525]
+
+Starts the local SMTP sink (logic/fakesmtp.py, needs aiosmtpd) and sends the
+same messages once with Django's ``send_mail`` (one SMTP session each) and
+once through ``logic.mail.MailDispatcher`` (one session for all of them),
+printing messages/sec and SMTP connections opened.
+"""
+import argparse
+import os
+import time
+
+import django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--port', type=int, default=2525)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.settings')
+    django.setup()
+
+    from django.core.mail import EmailMessage, send_mail
+    from django.test import override_settings
+
+    from logic.fakesmtp import SMTPSink
+    from logic.mail import MailDispatcher
+
+    sink = SMTPSink(port=args.port).start()
+    try:
+        with override_settings(**sink.settings()):
+            def per_message():
+                for i in range(args.messages):
+                    send_mail(f'Order #{i}', 'Thanks', 'shop@test.com', ['buyer@test.com'])
+
+            def dispatcher():
+                MailDispatcher().send([
+                    EmailMessage(f'Order #{i}', 'Thanks', 'shop@test.com', ['buyer@test.com'])
+                    for i in range(args.messages)
+                ])
+
+            print(f"{'mode':<14}{'msgs/s':>10}{'connections':>13}")
+            for name, run in [('send_mail', per_message), ('dispatcher', dispatcher)]:
+                before = sink.connections
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                print(f"{name:<14}{args.messages / elapsed:>10.1f}{sink.connections - before:>13}")
+    finally:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
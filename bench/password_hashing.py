@@ -0,0 +1,61 @@
+"""Login throughput per password hasher profile.
+
+    python -m bench.password_hashing [--seconds 3] [--threads N]
+
+For each profile in PASSWORD_HASHER_PROFILES this verifies a password the
+way login does (``verify_password``) for a fixed time, first on one thread
+(logins/sec per core) and then on the hashing pool with N threads, to show
+how far it scales across cores. No database is needed.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+
+def rate(fn, seconds, threads=1):
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+
+    def worker():
+        count = 0
+        while time.perf_counter() < deadline:
+            fn()
+            count += 1
+        return count
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total = sum(executor.map(lambda _: worker(), range(threads)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.settings')
+    django.setup()
+
+    from django.conf import settings
+    from django.contrib.auth.hashers import make_password, verify_password
+    from django.test import override_settings
+
+    print(f"{'profile':<10}{'hash':<34}{'logins/s/core':>14}{f'logins/s x{args.threads}':>16}")
+    for name, hashers in settings.PASSWORD_HASHER_PROFILES.items():
+        with override_settings(PASSWORD_HASHERS=hashers):
+            encoded = make_password('correct horse battery staple')
+
+            def check():
+                return verify_password('correct horse battery staple', encoded)
+
+            single = rate(check, args.seconds)
+            pooled = rate(check, args.seconds, args.threads)
+        print(f"{name:<10}{encoded.rsplit('$', 2)[0][:32]:<34}{single:>14.1f}{pooled:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
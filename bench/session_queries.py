@@ -0,0 +1,74 @@
+"""Database round trips per request with the db and Redis session engines.
+
+    python -m bench.session_queries [--requests 200]
+
+Creates a throwaway test database, logs a user in under each engine and
+replays the pages an authenticated shopper hits, printing the queries per
+request and how many of them touch ``django_session``.
+"""
+import argparse
+import os
+import time
+
+import django
+
+
+PAGES = [
+    ('home', '/', {}),
+    ('orders api', '/api/orders/', {}),
+    ('cart api', '/api/checkout/', {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}),
+]
+
+ENGINES = [
+    ('db (before)', 'django.contrib.sessions.backends.db'),
+    ('redis (after)', 'logic.sessions'),
+]
+
+
+def measure(client, path, headers, requests):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(path, **headers)
+        elapsed = time.perf_counter() - start
+    session = sum('django_session' in q['sql'] for q in ctx.captured_queries)
+    return len(ctx.captured_queries) / requests, session / requests, elapsed / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.settings')
+    django.setup()
+
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from logic.models import User
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(username='bench', password='bench-pass')
+        print(f"{'engine':<16}{'page':<14}{'queries/req':>12}{'session/req':>13}{'ms/req':>9}")
+        for label, engine in ENGINES:
+            with override_settings(SESSION_ENGINE=engine):
+                client = Client()
+                client.force_login(user)
+                for page, path, headers in PAGES:
+                    queries, session, ms = measure(client, path, headers, args.requests)
+                    print(f"{label:<16}{page:<14}{queries:>12.2f}{session:>13.2f}{ms:>9.2f}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Process startup time, checked against a stored budget.
+
+    python -m bench.startup [--runs 5] [--top 10] [--update]
+
+Starts each target ``--runs`` times in a fresh interpreter under
+``python -X importtime`` and keeps the fastest run (the least disturbed by
+other load on the machine):
+
+``check``  ``manage.py check``, which also imports the URLconf and views.
+``wsgi``   loading ``settings.wsgi.application`` and resolving the URLconf,
+           i.e. what a worker has done by the time it serves its first request.
+
+Absolute times swing with the machine and its load by more than a
+regression worth catching, so each target is budgeted as a ratio to a
+reference process (importing Django's management package, which is what
+every target pays before the project's own code), measured alternately with
+the target in the same run. The wall time and total import time ratios are
+compared with bench/startup_budget.json and the command exits with status 1
+if either is over budget, so it can run as a CI step. ``--update`` rewrites
+the budget from this run plus HEADROOM.
+The slowest top-level imports are listed to show where a regression came from.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+BUDGET_FILE = Path(__file__).with_name('startup_budget.json')
+HEADROOM = 0.3
+
+TARGETS = {
+    'check': ['manage.py', 'check'],
+    'wsgi': ['-c', 'from settings.wsgi import application\n'
+                   'from django.urls import get_resolver\n'
+                   'get_resolver().url_patterns'],
+}
+REFERENCE = ['-c', 'import django.core.management']
+
+
+def parse_importtime(stderr):
+    """Return ``[(name, depth, self_us, cumulative_us)]`` from ``-X importtime`` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(own), int(cumulative)))
+    return rows
+
+
+def run(args):
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'settings.settings')}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode:
+        sys.exit(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+    return wall * 1000, parse_importtime(result.stderr)
+
+
+def fastest(runs):
+    wall_ms, rows = min(runs, key=lambda run: run[0])
+    return {
+        'wall_ms': round(wall_ms, 1),
+        'import_ms': round(sum(row[2] for row in rows) / 1000, 1),
+    }, rows
+
+
+def measure(args, runs):
+    """Best-of-``runs`` times for ``args`` and the reference, and their ratios."""
+    target_runs, reference_runs = [], []
+    for _ in range(runs):
+        reference_runs.append(run(REFERENCE))
+        target_runs.append(run(args))
+    result, rows = fastest(target_runs)
+    reference, _ = fastest(reference_runs)
+    result['wall_ratio'] = round(result['wall_ms'] / reference['wall_ms'], 2)
+    result['import_ratio'] = round(result['import_ms'] / reference['import_ms'], 2)
+    return result, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--update', action='store_true', help='store this run as the new budget')
+    args = parser.parse_args()
+
+    budget = json.loads(BUDGET_FILE.read_text()) if BUDGET_FILE.exists() else {}
+    results = {}
+    over = []
+
+    print(f"{'target':<8}{'wall ms':>10}{'ratio':>8}{'budget':>8}{'import ms':>12}{'ratio':>8}{'budget':>8}")
+    for name, target in TARGETS.items():
+        result, rows = measure(target, args.runs)
+        results[name] = result
+        limits = budget.get(name, {})
+        print(f"{name:<8}{result['wall_ms']:>10.1f}{result['wall_ratio']:>8.2f}{limits.get('wall_ratio', '-'):>8}"
+              f"{result['import_ms']:>12.1f}{result['import_ratio']:>8.2f}{limits.get('import_ratio', '-'):>8}")
+        over += [f"{name} {key}" for key, limit in limits.items() if result[key] > limit]
+
+        top = sorted((row for row in rows if row[1] == 0), key=lambda row: -row[3])[:args.top]
+        for module, _, _, cumulative in top:
+            print(f"          {cumulative / 1000:>8.1f} ms  {module}")
+
+    if args.update:
+        BUDGET_FILE.write_text(json.dumps({
+            name: {key: round(result[key] * (1 + HEADROOM), 2) for key in ('wall_ratio', 'import_ratio')}
+            for name, result in results.items()
+        }, indent=2) + '\n')
+        print(f"Budget written to {BUDGET_FILE.name}")
+    elif over:
+        sys.exit(f"Startup over budget: {', '.join(over)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
 from django.contrib import admin
 
-# Register your models here.
+from logic.models import Product
+
+
+admin.site.register(Product)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class LogicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'logic'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from logic import metrics, slowqueries
+
+        connection_created.connect(metrics.install_query_hook, dispatch_uid='metrics_query_hook')
+        connection_created.connect(slowqueries.install_query_hook, dispatch_uid='slow_query_hook')
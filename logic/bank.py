@@ -0,0 +1,363 @@
+"""Client for the bank service (card verification and order history).
+
+One ``BankClient`` is kept per process (and one ``AsyncBankClient`` per
+event loop for the async views under ASGI) so every call reuses pooled
+keep-alive connections. Under WSGI each async view runs on an event loop of
+its own that ends with the request, so ``verify`` sends those through the
+sync client instead. A circuit breaker stops calling the bank for a
+while after repeated failures, so checkouts fail fast instead of each one
+waiting out the timeout. The service JWT is signed once per process and
+reused until shortly before it expires.
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from logic import metrics
+from logic.lazy import lazy_import
+
+httpx = lazy_import('httpx')
+jwt = lazy_import('jwt')
+requests = lazy_import('requests')
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the bank while the circuit is open."""
+
+
+def generate_jwt_token(secret, lifetime=900):
+    payload = {
+        'service': 'ecommerce',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=lifetime)
+    }
+    token = jwt.encode(payload, secret, algorithm='HS256')
+    return token
+
+
+class ServiceToken:
+    """The bank service JWT, minted once and reused until ``refresh_margin``
+    seconds before it expires. Shared by every thread of the process."""
+
+    def __init__(self, secret, lifetime=900, refresh_margin=60):
+        self.secret = secret
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.current = (None, 0)
+        self.mints = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        token, refresh_at = self.current
+        if token is not None and time.monotonic() < refresh_at:
+            return token
+        with self.lock:
+            token, refresh_at = self.current
+            if token is None or time.monotonic() >= refresh_at:
+                token = generate_jwt_token(self.secret, self.lifetime)
+                self.current = (token, time.monotonic() + self.lifetime - self.refresh_margin)
+                self.mints += 1
+                metrics.count('bank_token_mints_total')
+            return token
+
+
+class CircuitBreaker:
+    """Closed -> open after ``threshold`` consecutive failures.
+
+    While open every call is rejected until ``reset_timeout`` seconds have
+    passed, then a single trial call is let through (half-open). Its result
+    closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """End a trial call that was abandoned without an answer from the bank."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+class CallStats:
+    """Per-endpoint ok/error/rejected counts and latency, shared by the clients."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def record(self, path, outcome, elapsed=None):
+        with self.lock:
+            c = self.counters.setdefault(path, {
+                'ok': 0, 'errors': 0, 'rejected': 0,
+                'latency_total': 0.0, 'latency_max': 0.0,
+            })
+            c[outcome] += 1
+            if elapsed is not None:
+                c['latency_total'] += elapsed
+                c['latency_max'] = max(c['latency_max'], elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            return {path: dict(c) for path, c in self.counters.items()}
+
+
+class BaseBankClient:
+    def __init__(self, base_url, connect_timeout=2, read_timeout=5, pool_size=10, breaker=None, stats=None,
+                 token=None):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = stats or CallStats()
+        self.token = token or ServiceToken(getattr(settings, 'BANK_JWT_SECRET', None))
+
+    def _admit(self, path):
+        if not self.breaker.allow():
+            self.calls.record(path, 'rejected')
+            metrics.external_call('bank', 0, error=True)
+            raise CircuitOpenError(f"Bank circuit open, not calling {path}")
+        return time.perf_counter()
+
+    def _failed(self, path, start):
+        elapsed = time.perf_counter() - start
+        self.breaker.record_failure()
+        self.calls.record(path, 'errors', elapsed)
+        metrics.external_call('bank', elapsed, error=True)
+
+    def _abandoned(self, path, start):
+        # Cancelled or interrupted: says nothing about the bank, but a
+        # half-open trial must not stay claimed forever.
+        self.breaker.release_trial()
+        metrics.external_call('bank', time.perf_counter() - start)
+
+    def _finished(self, path, start, response):
+        elapsed = time.perf_counter() - start
+        failed = response.status_code >= 500
+        if failed:
+            self.breaker.record_failure()
+            self.calls.record(path, 'errors', elapsed)
+        else:
+            self.breaker.record_success()
+            self.calls.record(path, 'ok', elapsed)
+        metrics.external_call('bank', elapsed, error=failed)
+        return response
+
+    def _headers(self):
+        return {'Authorization': f'Bearer {self.token.get()}'}
+
+    def stats(self):
+        return {
+            'circuit': self.breaker.state,
+            'endpoints': self.calls.snapshot(),
+            'token_mints': self.token.mints,
+        }
+
+
+def verify_payload(card_number, HoldName, CVV, cart_total):
+    return {
+        'card_number': card_number,
+        'HoldName': HoldName,
+        'CVV': CVV,
+        'cart_total': cart_total,
+    }
+
+
+class BankClient(BaseBankClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, path, payload):
+        # Minted before admission: a bad JWT setup is a local error, not the bank's.
+        headers = self._headers()
+        start = self._admit(path)
+        try:
+            response = self.session.post(
+                self.base_url + path,
+                json=payload,
+                headers=headers,
+                timeout=(self.connect_timeout, self.read_timeout)
+            )
+        except Exception:
+            self._failed(path, start)
+            raise
+        except BaseException:
+            self._abandoned(path, start)
+            raise
+        return self._finished(path, start, response)
+
+    def verify(self, card_number, HoldName, CVV, cart_total):
+        return self.post('/api/verify', verify_payload(card_number, HoldName, CVV, cart_total))
+
+    def send_history(self, orders, batch_id=None):
+        payload = {'orders': orders}
+        if batch_id:
+            payload['batch_id'] = batch_id
+        response = self.post('/api/gethistory', payload)
+        response.raise_for_status()
+        return response.json()
+
+
+class AsyncBankClient(BaseBankClient):
+    """httpx-based client for the async views; one per event loop."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def post(self, path, payload):
+        headers = self._headers()
+        start = self._admit(path)
+        try:
+            response = await self.client.post(path, json=payload, headers=headers)
+        except Exception:
+            self._failed(path, start)
+            raise
+        except BaseException:
+            self._abandoned(path, start)
+            raise
+        return self._finished(path, start, response)
+
+    async def verify(self, card_number, HoldName, CVV, cart_total):
+        return await self.post('/api/verify', verify_payload(card_number, HoldName, CVV, cart_total))
+
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def _client_kwargs():
+    return {
+        'connect_timeout': settings.BANK_CONNECT_TIMEOUT,
+        'read_timeout': settings.BANK_READ_TIMEOUT,
+        'pool_size': settings.BANK_POOL_SIZE,
+    }
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = BankClient(
+                    settings.BANK_URL,
+                    breaker=CircuitBreaker(
+                        threshold=settings.BANK_BREAKER_THRESHOLD,
+                        reset_timeout=settings.BANK_BREAKER_RESET,
+                    ),
+                    **_client_kwargs()
+                )
+    return _client
+
+
+def transport_errors():
+    """Exceptions raised when the bank cannot be reached, by either client."""
+    return (httpx.HTTPError, requests.RequestException)
+
+
+async def verify(request, card_number, HoldName, CVV, cart_total):
+    """Verify a payment from an async view.
+
+    Under ASGI the loop lives as long as the worker, so the pooled async
+    client is used; under WSGI (and the test client) the view's loop is torn
+    down after the request, so the call goes through the sync client.
+    """
+    from django.core.handlers.asgi import ASGIRequest
+
+    if isinstance(request, ASGIRequest):
+        return await get_async_client().verify(card_number, HoldName, CVV, cart_total)
+    return await sync_to_async(get_client().verify)(card_number, HoldName, CVV, cart_total)
+
+
+def get_async_client():
+    """Return the async client for the running event loop.
+
+    It shares the circuit breaker and counters with the sync client, so both
+    paths see the same view of the bank's health.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        sync_client = get_client()
+        client = AsyncBankClient(
+            sync_client.base_url,
+            breaker=sync_client.breaker,
+            stats=sync_client.calls,
+            token=sync_client.token,
+            **_client_kwargs()
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def report_circuit_state(registry):
+    """Metrics collector: the state of this process's circuit breaker."""
+    client = _client
+    if client is None:
+        return
+    current = client.breaker.state
+    for state in ('closed', 'half-open', 'open'):
+        registry.set('bank_circuit_state', (('state', state),), int(state == current))
+
+
+metrics.add_collector(report_circuit_state)
+
+
+def reset_client():
+    global _client
+    _client = None
+    _async_clients.clear()
+
+
+# Pooled sockets must not be shared with forked workers.
+os.register_at_fork(after_in_child=reset_client)
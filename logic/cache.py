@@ -0,0 +1,345 @@
+"""Two-tier cache backend: a per-process LRU in front of Redis.
+
+Reads are served from a bounded in-process LRU (L1) when possible, and
+otherwise from Redis (L2) through Django's own RedisCache. Every write to L2
+also bumps a shared version counter and logs the written key under that
+version. At most once per VERSION_CHECK_INTERVAL seconds each process reads
+the counter and evicts the keys written since it last looked. So an L1
+entry is stale for at most that long after another worker changes it, and
+L1_TTL caps its age in any case.
+
+``get_or_set`` is single-flight: while one caller recomputes a missing value,
+other threads and workers asking for the same key wait for it instead of
+recomputing it too.
+
+If Redis fails the cache degrades to L1 only; errors are counted, not raised.
+The one exception is ``incr``, which has no local fallback: it raises
+ValueError, as it does for a missing key. REDIS_OPTIONS default to one-second
+socket timeouts so an unreachable Redis costs a request at most that long.
+
+    CACHES = {'default': {
+        'BACKEND': 'logic.cache.TwoTierCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'OPTIONS': {'L1_MAX_ENTRIES': 1000, 'L1_TTL': 30, 'VERSION_CHECK_INTERVAL': 1},
+    }}
+"""
+import pickle
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.redis import RedisCache
+
+from logic.lazy import lazy_import
+
+redis = lazy_import('redis')
+
+
+VERSION_KEY = 'cache:l1version'
+LOG_KEY = 'cache:l1log'
+LOG_SIZE = 10000
+CLEAR_ALL = '*'
+
+# Bump the version and log the keys under it in one step.
+PUBLISH = """
+local v = redis.call('INCR', KEYS[1])
+for i = 1, #ARGV do
+    redis.call('ZADD', KEYS[2], v, ARGV[i] .. '@' .. v)
+end
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -%d)
+return v
+""" % (LOG_SIZE + 1)
+
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+DEFAULT_REDIS_OPTIONS = {'socket_connect_timeout': 1, 'socket_timeout': 1}
+
+_missing = object()
+
+
+class LocalLRU:
+    """Thread-safe bounded LRU of pickled values with per-entry expiry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return _missing
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.data[key]
+                return _missing
+            self.data.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            self.delete(key)
+            return
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            return self.data.pop(key, None) is not None
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l1 = LocalLRU(options.get('L1_MAX_ENTRIES', 1000))
+        self.l1_ttl = options.get('L1_TTL', 30)
+        self.check_interval = options.get('VERSION_CHECK_INTERVAL', 1)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 10)
+        redis_options = {**DEFAULT_REDIS_OPTIONS, **options.get('REDIS_OPTIONS', {})}
+        self.l2 = RedisCache(server, {**params, 'OPTIONS': redis_options})
+
+        self.seen_version = None
+        self.checked_at = 0
+        self.generation = 0
+        self.sync_lock = threading.Lock()
+        self.key_locks = weakref.WeakValueDictionary()
+        self.key_locks_lock = threading.Lock()
+
+        self.counters_lock = threading.Lock()
+        self.counters = {
+            'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'sets': 0,
+            'deletes': 0, 'invalidations': 0, 'errors': 0, 'waits': 0,
+        }
+
+    # Helpers
+
+    @property
+    def client(self):
+        return self.l2._cache.get_client(write=True)
+
+    def count(self, name, n=1):
+        with self.counters_lock:
+            self.counters[name] += n
+
+    def l1_timeout(self, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self.l1_ttl if timeout is None else min(self.l1_ttl, timeout)
+
+    def publish(self, *keys):
+        try:
+            self.client.eval(PUBLISH, 2, VERSION_KEY, LOG_KEY, *keys)
+        except redis.RedisError:
+            self.count('errors')
+
+    def sync(self):
+        """Evict L1 entries that other workers changed since the last check."""
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        with self.sync_lock:
+            if now - self.checked_at < self.check_interval:
+                return
+            self.checked_at = now
+            try:
+                version = int(self.client.get(VERSION_KEY) or 0)
+                if self.seen_version is None or version == self.seen_version:
+                    changed = []
+                elif version < self.seen_version:
+                    changed = [CLEAR_ALL]
+                else:
+                    entries = self.client.zrangebyscore(
+                        LOG_KEY, self.seen_version + 1, version, withscores=True
+                    )
+                    changed = [m.decode().rsplit('@', 1)[0] for m, _ in entries]
+                    # The log was trimmed past what we last saw: start over.
+                    if not entries or entries[0][1] > self.seen_version + 1:
+                        changed = [CLEAR_ALL]
+            except redis.RedisError:
+                self.count('errors')
+                return
+
+            if changed:
+                self.generation += 1
+                self.count('invalidations', len(changed))
+                if CLEAR_ALL in changed:
+                    self.l1.clear()
+                else:
+                    for key in changed:
+                        self.l1.delete(key)
+            self.seen_version = version
+
+    def key_lock(self, key):
+        with self.key_locks_lock:
+            lock = self.key_locks.get(key)
+            if lock is None:
+                lock = self.key_locks[key] = threading.Lock()
+            return lock
+
+    # Django cache API
+
+    def get(self, key, default=None, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        self.sync()
+        value = self.l1.get(full_key)
+        if value is not _missing:
+            self.count('l1_hits')
+            return value
+
+        generation = self.generation
+        try:
+            value = self.l2.get(key, _missing, version=version)
+        except redis.RedisError:
+            self.count('errors')
+            value = _missing
+        if value is _missing:
+            self.count('misses')
+            return default
+
+        self.count('l2_hits')
+        # Skip filling L1 if an invalidation ran while we were reading.
+        if generation == self.generation:
+            self.l1.set(full_key, value, self.l1_ttl)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        self.count('sets')
+        try:
+            self.l2.set(key, value, timeout, version=version)
+        except redis.RedisError:
+            self.count('errors')
+        self.l1.set(full_key, value, self.l1_timeout(timeout))
+        self.publish(full_key)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        try:
+            added = self.l2.add(key, value, timeout, version=version)
+        except redis.RedisError:
+            self.count('errors')
+            added = self.l1.get(full_key) is _missing
+        if added:
+            self.count('sets')
+            self.l1.set(full_key, value, self.l1_timeout(timeout))
+            self.publish(full_key)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        try:
+            return self.l2.touch(key, timeout, version=version)
+        except redis.RedisError:
+            self.count('errors')
+            return False
+
+    def delete(self, key, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        self.count('deletes')
+        self.l1.delete(full_key)
+        try:
+            deleted = self.l2.delete(key, version=version)
+        except redis.RedisError:
+            self.count('errors')
+            deleted = False
+        self.publish(full_key)
+        return deleted
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def incr(self, key, delta=1, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        self.l1.delete(full_key)
+        try:
+            value = self.l2.incr(key, delta, version=version)
+        except redis.RedisError as e:
+            self.count('errors')
+            raise ValueError(f"Key '{key}' could not be incremented: {e}") from e
+        self.publish(full_key)
+        return value
+
+    def clear(self):
+        self.l1.clear()
+        try:
+            self.l2.clear()
+        except redis.RedisError:
+            self.count('errors')
+        self.publish(CLEAR_ALL)
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """Return the cached value, computing it once across callers on a miss."""
+        value = self.get(key, _missing, version=version)
+        if value is not _missing:
+            return value
+
+        full_key = self.make_and_validate_key(key, version=version)
+        with self.key_lock(full_key):
+            value = self.get(key, _missing, version=version)
+            if value is not _missing:
+                return value
+
+            lock_key = f"{full_key}:lock"
+            token = uuid.uuid4().hex
+            try:
+                owner = self.client.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000))
+            except redis.RedisError:
+                self.count('errors')
+                owner = True
+
+            if not owner:
+                # Another worker is computing it; wait for its result.
+                self.count('waits')
+                deadline = time.monotonic() + self.lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    try:
+                        value = self.l2.get(key, _missing, version=version)
+                    except redis.RedisError:
+                        break
+                    if value is not _missing:
+                        return value
+
+            try:
+                value = default() if callable(default) else default
+                if value is not None:
+                    self.set(key, value, timeout, version=version)
+                return value
+            finally:
+                if owner:
+                    try:
+                        self.client.eval(RELEASE_LOCK, 1, lock_key, token)
+                    except redis.RedisError:
+                        pass
+
+    def stats(self):
+        with self.counters_lock:
+            counters = dict(self.counters)
+        counters['l1_entries'] = len(self.l1)
+        counters['l1_evictions'] = self.l1.evictions
+        return counters
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
@@ -0,0 +1,268 @@
+"""Per-user cart store: a Redis hash written through over ``CartItem``.
+
+There is one CartItem row per (user, product) carrying a quantity; adding a
+product is a single ``INSERT ... ON CONFLICT DO UPDATE``.
+
+``cart:<user_id>`` maps each CartItem id to its JSON fields, plus a
+``_loaded`` marker saying the hash holds the user's complete cart. Reads on a
+warm hash never touch Postgres; writes go to Postgres first and are then
+mirrored into the hash once the transaction commits. When Redis is missing or
+failing every call falls back to the database.
+
+Every mirrored write also bumps ``cart:<user_id>:v``. A read that misses
+notes the version before loading the cart from Postgres and only stores the
+result if no write has happened since, so a write that commits while the
+cart is being loaded cannot be lost. A write that cannot be mirrored, e.g.
+while Redis is down, leaves the user id in ``CartStore.stale``; those hashes
+are deleted as soon as this process reaches Redis again, before any cart is
+read from it.
+"""
+import json
+import logging
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from logic.lazy import lazy_import
+from logic.models import CartItem
+
+redis = lazy_import('redis')
+
+logger = logging.getLogger(__name__)
+
+
+LOADED = '_loaded'
+
+# KEYS: hash, version. ARGV: loaded marker, ttl, field, value ('' deletes).
+# Bumps the version, then only touches hashes that already hold a complete
+# cart; a cold cart is loaded from the database on the next read instead.
+WRITE = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    if ARGV[4] == '' then
+        redis.call('HDEL', KEYS[1], ARGV[3])
+    else
+        redis.call('HSET', KEYS[1], ARGV[3], ARGV[4])
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+# KEYS: hash, version. ARGV: ttl.
+INVALIDATE = """
+redis.call('DEL', KEYS[1])
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+"""
+
+# KEYS: hash, version. ARGV: version seen before loading, ttl, then field,
+# value pairs. Replaces the hash only if no write happened in between.
+FILL = """
+local current = redis.call('GET', KEYS[2]) or ''
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def cart_key(user_id):
+    return f"cart:{user_id}"
+
+
+def version_key(user_id):
+    return f"cart:{user_id}:v"
+
+
+def _row(values):
+    cart_item_id, item_id, price, quantity = values
+    return {
+        'id': cart_item_id,
+        'name': item_id,
+        'price': Decimal(price),
+        'quantity': quantity,
+    }
+
+
+def _encode(row):
+    return json.dumps({'name': row['name'], 'price': str(row['price']), 'quantity': row['quantity']})
+
+
+def _upsert_sql():
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    return f"""
+        INSERT INTO {table} (user_id, item_id, price, quantity, added_at, status)
+        VALUES (%s, %s, %s, %s, %s, 'Unpaid')
+        ON CONFLICT (user_id, item_id) DO UPDATE
+        SET quantity = {table}.quantity + EXCLUDED.quantity, price = EXCLUDED.price
+        RETURNING id, quantity
+    """
+
+
+def _decrement_sql():
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    return f"""
+        UPDATE {table} SET quantity = quantity - 1
+        WHERE id = %s AND user_id = %s AND quantity > 1
+        RETURNING item_id, price, quantity
+    """
+
+
+class CartStore:
+    def __init__(self, client):
+        self.client = client
+        self.stale = set()
+        self.stale_lock = threading.Lock()
+        if client is not None:
+            self.scripts = {name: client.register_script(source) for name, source in [
+                ('write', WRITE), ('invalidate', INVALIDATE), ('fill', FILL),
+            ]}
+            if hasattr(client, 'on_recovery'):
+                client.on_recovery(self.invalidate_stale)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'CART_CACHE_TTL', 86400)
+
+    def items(self, user):
+        """Return the user's cart as a list of dicts, newest first."""
+        version = None
+        if self.client:
+            try:
+                self.invalidate_stale()
+                cached = self.client.hgetall(cart_key(user.id))
+                if LOADED.encode() in cached:
+                    return self._decode(cached)
+                version = self.client.get(version_key(user.id)) or b''
+            except redis.RedisError:
+                return self._load(user)
+
+        rows = self._load(user)
+        if version is not None:
+            self._fill(user, rows, version)
+        return rows
+
+    def add(self, user, item_id, price, quantity=1):
+        """Add ``quantity`` units of a product in one atomic upsert."""
+        price = Decimal(str(price)).quantize(Decimal('0.01'))
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql(), [
+                user.id,
+                item_id,
+                connection.ops.adapt_decimalfield_value(price, 10, 2),
+                quantity,
+                connection.ops.adapt_datetimefield_value(timezone.now()),
+            ])
+            cart_item_id, total_quantity = cursor.fetchone()
+
+        row = {'id': cart_item_id, 'name': item_id, 'price': price, 'quantity': total_quantity}
+        self._after_commit(user, lambda: self._write(user, cart_item_id, _encode(row)))
+        return row
+
+    def remove(self, user, cart_item_id, all_units=False):
+        """Take one unit (or the whole row) out of the cart.
+
+        Returns the quantity left, or None when the row is not the user's.
+        """
+        if not all_units:
+            with connection.cursor() as cursor:
+                cursor.execute(_decrement_sql(), [cart_item_id, user.id])
+                result = cursor.fetchone()
+            if result:
+                name, price, quantity = result
+                row = {'name': name, 'price': Decimal(str(price)), 'quantity': quantity}
+                self._after_commit(user, lambda: self._write(user, cart_item_id, _encode(row)))
+                return quantity
+
+        deleted, _ = CartItem.objects.filter(id=cart_item_id, user=user).delete()
+        if not deleted:
+            return None
+        self._after_commit(user, lambda: self._write(user, cart_item_id, ''))
+        return 0
+
+    def clear(self, user):
+        count, _ = CartItem.objects.filter(user=user).delete()
+        self._after_commit(user, lambda: self._invalidate(user.id))
+        return count
+
+    def invalidate_stale(self):
+        """Delete the hashes of carts written while Redis was unreachable."""
+        if not self.stale:
+            return
+        with self.stale_lock:
+            user_ids, self.stale = list(self.stale), set()
+        for i, user_id in enumerate(user_ids):
+            try:
+                self._invalidate(user_id)
+            except redis.RedisError:
+                with self.stale_lock:
+                    self.stale.update(user_ids[i:])
+                raise
+        logger.info("Dropped %d cached carts written while Redis was down", len(user_ids))
+
+    def _write(self, user, cart_item_id, value):
+        self.scripts['write'](
+            keys=[cart_key(user.id), version_key(user.id)],
+            args=[LOADED, self.ttl, cart_item_id, value],
+        )
+
+    def _invalidate(self, user_id):
+        self.scripts['invalidate'](keys=[cart_key(user_id), version_key(user_id)], args=[self.ttl])
+
+    def _load(self, user):
+        rows = (
+            CartItem.objects.filter(user=user)
+            .order_by('-added_at')
+            .values_list('id', 'item_id', 'price', 'quantity')
+        )
+        return [_row(values) for values in rows]
+
+    def _fill(self, user, rows, version):
+        args = [version, self.ttl, LOADED, 1]
+        for row in rows:
+            args += [row['id'], _encode(row)]
+        try:
+            self.scripts['fill'](keys=[cart_key(user.id), version_key(user.id)], args=args)
+        except redis.RedisError:
+            pass
+
+    def _decode(self, cached):
+        rows = []
+        for field, value in cached.items():
+            if field == LOADED.encode():
+                continue
+            data = json.loads(value)
+            rows.append({
+                'id': int(field),
+                'name': data['name'],
+                'price': Decimal(data['price']),
+                'quantity': data.get('quantity', 1),
+            })
+        rows.sort(key=lambda row: row['id'], reverse=True)
+        return rows
+
+    def _after_commit(self, user, fn):
+        if self.client is None:
+            return
+
+        def run():
+            try:
+                self.invalidate_stale()
+                fn()
+            except redis.RedisError:
+                # The hash may now be stale; drop it so the next read reloads,
+                # or once Redis is reachable again.
+                try:
+                    self._invalidate(user.id)
+                except redis.RedisError:
+                    with self.stale_lock:
+                        self.stale.add(user.id)
+
+        transaction.on_commit(run)
@@ -0,0 +1,87 @@
+"""Per-process product catalog.
+
+The active products are loaded once into a dict keyed by SKU, so pricing a
+cart line is a dict lookup rather than a query. Every worker compares its
+copy against the ``catalog:version`` key in Redis (at most once per
+CATALOG_VERSION_CHECK_INTERVAL seconds) and reloads when it changed. Saving or
+deleting a Product bumps that key. Without Redis, workers reload after
+CATALOG_LOCAL_TTL seconds instead.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from logic.lazy import lazy_import
+from logic.models import Product
+
+redis = lazy_import('redis')
+
+
+VERSION_KEY = 'catalog:version'
+
+
+class Catalog:
+    def __init__(self, client):
+        self.client = client
+        self.products = {}
+        self.version = None
+        self.loaded_at = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+        post_save.connect(self._changed, sender=Product, dispatch_uid='catalog_changed')
+        post_delete.connect(self._changed, sender=Product, dispatch_uid='catalog_deleted')
+
+    def get(self, sku):
+        """Return the active Product for ``sku`` or None."""
+        return self.index().get(sku)
+
+    def all(self):
+        return sorted(self.index().values(), key=lambda p: p.id)
+
+    def invalidate(self):
+        """Drop this worker's copy and tell the other workers to drop theirs."""
+        self.loaded_at = None
+        if self.client:
+            transaction.on_commit(self._bump)
+
+    def _changed(self, sender, **kwargs):
+        self.invalidate()
+
+    def _bump(self):
+        try:
+            self.client.incr(VERSION_KEY)
+        except redis.RedisError:
+            pass
+
+    def _remote_version(self):
+        if not self.client:
+            return None
+        try:
+            return self.client.get(VERSION_KEY)
+        except redis.RedisError:
+            return None
+
+    def index(self):
+        """Return the ``{sku: Product}`` dict, reloading it first if stale."""
+        now = time.monotonic()
+        interval = getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 1)
+        if self.loaded_at is not None and now - self.checked_at < interval:
+            return self.products
+
+        self.checked_at = now
+        version = self._remote_version()
+        expired = (
+            self.loaded_at is None
+            or version != self.version
+            or (version is None and now - self.loaded_at > getattr(settings, 'CATALOG_LOCAL_TTL', 60))
+        )
+        if expired:
+            with self.lock:
+                self.products = {p.sku: p for p in Product.objects.filter(is_active=True)}
+                self.version = version
+                self.loaded_at = now
+        return self.products
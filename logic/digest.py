@@ -0,0 +1,83 @@
+"""Periodic admin order digest.
+
+Orders below ADMIN_IMMEDIATE_TOTAL are not emailed to the admin one by one.
+Checkout records them as ``order.admin_digest`` outbox messages, which the
+generic drain skips. ``flush`` sends them all as a single EMAILDIGEST.html
+summary once the oldest has waited ADMIN_DIGEST_WINDOW seconds, so the admin
+inbox gets at most about one digest per window however many orders come in.
+Orders at or above the threshold still go out immediately as
+``order.admin_email``. ADMIN_DIGEST_WINDOW = 0 turns the digest off.
+
+Like the history sync (logic/history.py), the messages are leased with
+``outbox.claim_topic``, the email is sent with no transaction open, and only
+then are they marked Done; an order that commits late goes into the next
+digest. The timing depends only on the ADMIN_DIGEST_* settings.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from logic import outbox
+from logic.mail import get_dispatcher
+from logic.models import User
+from logic.tasks import html_email
+
+
+TOPIC = 'order.admin_digest'
+
+
+def topic_for(total):
+    """Return the outbox topic for the admin notification of an order."""
+    window = getattr(settings, 'ADMIN_DIGEST_WINDOW', 900)
+    threshold = Decimal(str(getattr(settings, 'ADMIN_IMMEDIATE_TOTAL', 1000)))
+    if not window or Decimal(str(total)) >= threshold:
+        return 'order.admin_email'
+    return TOPIC
+
+
+def digest_email(payloads, messages):
+    users = User.objects.in_bulk({p['user_id'] for p in payloads})
+    orders = [{**p, 'user': users.get(p['user_id'])} for p in payloads]
+    html_message = render_to_string('EMAILDIGEST.html', {
+        'orders': orders,
+        'revenue': sum(Decimal(p['total']) for p in payloads),
+        'since': min(m.created_at for m in messages),
+        'until': max(m.created_at for m in messages),
+        'threshold': getattr(settings, 'ADMIN_IMMEDIATE_TOTAL', 1000),
+        'site_url': 'https://fwaeh.cloud',
+    })
+    return html_email(
+        f'Order digest: {len(orders)} new order{"s" if len(orders) != 1 else ""}',
+        html_message,
+        ['solaradeveloper@gmail.com'],
+    )
+
+
+def flush(force=False):
+    """Send the digest if its oldest order has waited a full window.
+
+    Returns the number of orders in the digest sent (0 if none was due).
+    """
+    window = getattr(settings, 'ADMIN_DIGEST_WINDOW', 900)
+    limit = getattr(settings, 'ADMIN_DIGEST_MAX_ORDERS', 500)
+    window_start = timezone.now() - timedelta(seconds=window)
+
+    messages = outbox.claim_topic(TOPIC, limit, due=lambda messages: (
+        force or min(m.created_at for m in messages) <= window_start
+    ))
+    if not messages:
+        return 0
+
+    try:
+        error, = get_dispatcher().send([digest_email([m.payload for m in messages], messages)])
+        if error:
+            raise error
+    except Exception:
+        outbox.release(messages)
+        raise
+
+    outbox.complete(messages)
+    return len(messages)
@@ -0,0 +1,123 @@
+"""Local stand-in for the bank service on localhost:8001.
+
+Used by the tests, the load test and for running the shop locally without
+the real bank:
+
+    python -m logic.fakebank --port 8001 [--latency 0.05] [--error-rate 0.01]
+
+``latency`` delays every response; ``error_rate`` is the fraction of requests
+answered with a 503 instead.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeBankHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        bank = self.server.bank
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+
+        with bank.lock:
+            bank.requests.append((self.path, data))
+            bank.connections.add(self.client_address)
+
+        if bank.latency:
+            time.sleep(bank.latency)
+
+        if bank.failed():
+            status, body = 503, {'success': False, 'error': 'Service unavailable'}
+        elif self.path == '/api/verify':
+            status, body = bank.verify(data)
+        elif self.path == '/api/gethistory':
+            status, body = bank.record_history(data.get('orders', []))
+        else:
+            status, body = 404, {'success': False, 'error': 'Not found'}
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBank:
+    def __init__(self, host='127.0.0.1', port=0, balance=1000.0, latency=0.0, error_rate=0.0):
+        self.balance = balance
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = 0
+        self.requests = []
+        self.connections = set()
+        self.history = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), FakeBankHandler)
+        self.server.daemon_threads = True
+        self.server.bank = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def failed(self):
+        if not self.error_rate or random.random() >= self.error_rate:
+            return False
+        with self.lock:
+            self.errors += 1
+        return True
+
+    def verify(self, data):
+        if len(str(data.get('card_number', ''))) != 16:
+            return 404, {'success': False, 'error': 'Invalid card number'}
+        total = float(data.get('cart_total', 0))
+        with self.lock:
+            if total > self.balance:
+                return 400, {'success': False, 'error': 'Insufficient funds', 'balance': self.balance}
+            self.balance -= total
+            return 200, {'success': True, 'balance': self.balance}
+
+    def record_history(self, orders):
+        with self.lock:
+            new = [o for o in orders if o.get('order_id') not in self.history]
+            for order in new:
+                self.history[order.get('order_id')] = order
+        return 200, {'success': True, 'received': len(orders), 'new': len(new)}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--balance', type=float, default=1000000.0)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    bank = FakeBank(args.host, args.port, args.balance, args.latency, args.error_rate)
+    print(f"Fake bank listening on {bank.url}")
+    bank.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
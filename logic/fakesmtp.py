@@ -0,0 +1,85 @@
+"""Local SMTP sink for benchmarks and running the shop without Gmail:
+
+    python -m logic.fakesmtp --port 1025
+
+Accepts every message and keeps count of messages and connections. Needs
+aiosmtpd (``pip install aiosmtpd``).
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import SMTP
+
+
+class SinkHandler:
+    def __init__(self, sink):
+        self.sink = sink
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.sink.lock:
+            self.sink.messages += 1
+            self.sink.recipients += len(envelope.rcpt_tos)
+        if self.sink.delay:
+            await asyncio.sleep(self.sink.delay)
+        return '250 Message accepted for delivery'
+
+
+class CountingSMTP(SMTP):
+    def connection_made(self, transport):
+        with self.event_handler.sink.lock:
+            self.event_handler.sink.connections += 1
+        super().connection_made(transport)
+
+
+class SMTPSink:
+    def __init__(self, host='127.0.0.1', port=1025, delay=0.0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.messages = 0
+        self.recipients = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.controller = Controller(SinkHandler(self), hostname=host, port=port)
+        self.controller.factory = lambda: CountingSMTP(self.controller.handler)
+
+    def start(self):
+        self.controller.start()
+        return self
+
+    def stop(self):
+        self.controller.stop()
+
+    def settings(self):
+        """EMAIL_* settings that point Django at this sink."""
+        return {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': self.host,
+            'EMAIL_PORT': self.port,
+            'EMAIL_USE_TLS': False,
+            'EMAIL_HOST_USER': '',
+            'EMAIL_HOST_PASSWORD': '',
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port).start()
+    print(f"SMTP sink listening on {args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{sink.messages} messages over {sink.connections} connections")
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
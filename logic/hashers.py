@@ -0,0 +1,79 @@
+"""Password hashing profiles and the off-thread hashing pool.
+
+PASSWORD_HASHER_PROFILE picks the PASSWORD_HASHERS list (see settings).
+The first hasher of the profile is used for new hashes; users whose stored
+hash uses another hasher or older parameters are rehashed when they next
+log in.
+
+The async login view hashes on a bounded thread pool. Argon2 and PBKDF2 both
+release the GIL, so the pool spreads logins over every core while the event
+loop keeps serving other requests. When more than PASSWORD_HASH_QUEUE logins
+are already waiting, new ones are turned away with ``PoolBusy`` rather than
+queueing without limit.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, make_password, verify_password
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2id at the OWASP minimum (19 MiB, 2 passes, 1 lane), which costs
+    a few milliseconds per hash instead of Django's 100 MiB x 8 lanes."""
+    time_cost = 2
+    memory_cost = 19456
+    parallelism = 1
+
+
+class PoolBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+class HashPool:
+    def __init__(self, workers, queue_size):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    async def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PoolBusy()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.slots.release()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashPool(
+                    getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1,
+                    getattr(settings, 'PASSWORD_HASH_QUEUE', 64),
+                )
+    return _pool
+
+
+def reset_pool():
+    global _pool
+    _pool = None
+
+
+os.register_at_fork(after_in_child=reset_pool)
+
+
+async def acheck_password(user, raw_password):
+    """Async ``user.check_password``: verify off-thread, rehash if needed."""
+    is_correct, must_update = await get_pool().run(verify_password, raw_password, user.password)
+    if is_correct and must_update:
+        user.password = await get_pool().run(make_password, raw_password)
+        await user.asave(update_fields=['password'])
+    return is_correct
@@ -0,0 +1,76 @@
+"""Batched order history sync to the bank.
+
+Checkout records one ``order.bank_history`` outbox message per order, but the
+generic outbox worker skips that topic. ``flush`` leases the oldest pending
+messages (``outbox.claim_topic``), posts them to ``/api/gethistory`` as one
+batch with no transaction open, and marks them Done. A batch goes out once
+HISTORY_BATCH_SIZE orders are waiting or the oldest one has waited
+HISTORY_MAX_AGE seconds. Each message is tracked by its own status, so a
+checkout that commits late is picked up by the next flush.
+
+If the process dies after the bank accepted a batch but before the messages
+were marked, they are sent again once the lease runs out. Each order carries
+its unique ``order_id`` so the bank can drop the repeats.
+
+The card is identified by ``card_last4``, its last four digits; the full
+``card_number`` the endpoint used to receive is no longer sent or stored.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from logic import outbox
+from logic.bank import get_client
+from logic.models import OutboxMessage
+
+
+TOPIC = 'order.bank_history'
+
+
+def history_row(payload):
+    # Messages queued before card_last4 may still carry the full number.
+    last4 = payload.get('card_last4') or payload.get('card_number', '')[-4:]
+    return {
+        'card_last4': last4,
+        'item': payload['items'],
+        'status': payload['status'],
+        'total': payload['total'],
+        'order_id': payload['order_id'],
+    }
+
+
+def pending():
+    """Return how many history messages are waiting to be sent."""
+    return OutboxMessage.objects.filter(topic=TOPIC, status='Pending').count()
+
+
+def flush(batch_size=None, max_age=None, force=False):
+    """Send the next batch if it is full or old enough (or ``force``).
+
+    Returns the number of orders sent; raises if the bank call fails, leaving
+    the batch pending for the next flush.
+    """
+    batch_size = batch_size or getattr(settings, 'HISTORY_BATCH_SIZE', 500)
+    max_age = getattr(settings, 'HISTORY_MAX_AGE', 30) if max_age is None else max_age
+    oldest_due = timezone.now() - timedelta(seconds=max_age)
+
+    messages = outbox.claim_topic(TOPIC, batch_size, due=lambda messages: (
+        force
+        or len(messages) >= batch_size
+        or min(m.created_at for m in messages) <= oldest_due
+    ))
+    if not messages:
+        return 0
+
+    try:
+        get_client().send_history(
+            [history_row(m.payload) for m in messages],
+            batch_id=f"{messages[0].id}-{messages[-1].id}",
+        )
+    except Exception:
+        outbox.release(messages)
+        raise
+
+    outbox.complete(messages)
+    return len(messages)
@@ -0,0 +1,147 @@
+"""Time-ordered order ids.
+
+An id is a 64-bit Snowflake-style number: milliseconds since EPOCH_MS
+(42 bits), a node number (10 bits) and a per-millisecond sequence (12 bits).
+It is written as 13 Crockford base32 characters after a ``#``. The width is
+fixed, so string order matches numeric order and new orders land at the
+right-hand edge of the ``order_id`` unique index.
+
+Each process generates ids without talking to the database, so every live
+process needs a node number of its own. The node is split into a host part
+(HOST_BITS) and a worker slot (WORKER_BITS). Set ORDER_ID_NODE (0-31) once
+per host; without it the host part is derived from the host name, and the
+order insert retries on the rare collision between hosts. The slot is
+claimed by each process when it mints its first id, by taking an exclusive
+lock on one of 32 files in ORDER_ID_SLOT_DIR; the lock goes away with the
+process, so forked workers sharing one ORDER_ID_NODE never share a node.
+"""
+import fcntl
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+HOST_BITS = 5
+WORKER_BITS = NODE_BITS - HOST_BITS
+MAX_HOST = (1 << HOST_BITS) - 1
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+WIDTH = 13
+PREFIX = '#'
+
+
+def encode(number):
+    chars = []
+    for _ in range(WIDTH):
+        number, digit = divmod(number, 32)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def decode(text):
+    number = 0
+    for char in text.upper():
+        number = number * 32 + ALPHABET.index(char)
+    return number
+
+
+def host_number():
+    configured = getattr(settings, 'ORDER_ID_NODE', None)
+    if configured is None:
+        return zlib.crc32(socket.gethostname().encode()) & MAX_HOST
+    try:
+        host = int(configured)
+    except ValueError:
+        host = -1
+    if not 0 <= host <= MAX_HOST:
+        raise ImproperlyConfigured(f"ORDER_ID_NODE must be an integer between 0 and {MAX_HOST}, got {configured!r}")
+    return host
+
+
+def claim_worker_slot():
+    """Lock a free slot file for the life of this process; return (slot, file)."""
+    directory = getattr(settings, 'ORDER_ID_SLOT_DIR', None) or os.path.join(
+        tempfile.gettempdir(), 'ecommerce-order-id-slots',
+    )
+    os.makedirs(directory, exist_ok=True)
+    for slot in range(MAX_WORKER + 1):
+        f = open(os.path.join(directory, f"{slot}.lock"), 'w')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            continue
+        return slot, f
+    raise RuntimeError(f"All {MAX_WORKER + 1} order id worker slots in {directory} are taken")
+
+
+class IdGenerator:
+    def __init__(self, node, clock=None):
+        if not 0 <= node <= MAX_NODE:
+            raise ValueError(f"node must be between 0 and {MAX_NODE}")
+        self.node = node
+        self.clock = clock or (lambda: time.time_ns() // 1_000_000)
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            # Never go back in time, even if the wall clock does.
+            now = max(self.clock() - EPOCH_MS, self.last_ms)
+            if now == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # 4096 ids this millisecond already; borrow the next one.
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last_ms = now
+            return (now << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | self.sequence
+
+
+_generator = None
+_slot_file = None
+_generator_lock = threading.Lock()
+
+
+def order_id():
+    global _generator, _slot_file
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                host = host_number()
+                slot, _slot_file = claim_worker_slot()
+                _generator = IdGenerator((host << WORKER_BITS) | slot)
+    return PREFIX + encode(_generator.next())
+
+
+def timestamp(value):
+    """Return the creation time (epoch seconds) encoded in an order id."""
+    number = decode(value.lstrip(PREFIX))
+    return (EPOCH_MS + (number >> (NODE_BITS + SEQUENCE_BITS))) / 1000
+
+
+def reset_generator():
+    global _generator, _slot_file
+    _generator = None
+    if _slot_file is not None:
+        # Closing the child's copy leaves the parent's lock in place.
+        _slot_file.close()
+        _slot_file = None
+
+
+# A forked worker must claim a slot of its own, not continue the parent's.
+os.register_at_fork(after_in_child=reset_generator)
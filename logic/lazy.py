@@ -0,0 +1,34 @@
+"""Deferred imports for dependencies that are slow to load.
+
+``redis``, ``requests``, ``httpx`` and ``jwt`` together take longer to import
+than the rest of the project, yet most processes that import the views
+(``manage.py`` commands, the autoreloader, a worker before its first
+request) never use them. A module binds them with ``lazy_import`` instead of
+``import`` and the real import happens on the first attribute access::
+
+    redis = lazy_import('redis')
+    ...
+    except redis.RedisError:    # imports redis only if something is raised
+
+Only use it for names that are reached through attributes at call time; a
+base class or a module-level ``from x import y`` imports ``x`` at once.
+"""
+import importlib
+import sys
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name), attr)
+
+    def __repr__(self):
+        loaded = 'loaded' if self.__name in sys.modules else 'not loaded'
+        return f"<lazy module '{self.__name}' ({loaded})>"
+
+
+def lazy_import(name):
+    """Return the module if it is already imported, else a LazyModule."""
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,115 @@
+"""Outgoing mail over one long-lived SMTP connection per worker.
+
+``send_mail`` opens (and TLS-negotiates) a new SMTP session for every
+message. The dispatcher keeps one connection open between batches instead,
+closes it after MAIL_IDLE_TIMEOUT seconds without use, and reconnects once
+when the server drops it mid-batch. Each message gets its own result, so one
+bad recipient does not fail the rest of the batch.
+"""
+import os
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from logic import metrics
+
+
+# Errors that mean the connection is gone, rather than the message was refused.
+CONNECTION_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    smtplib.SMTPConnectError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class MailDispatcher:
+    def __init__(self, backend=None, idle_timeout=None):
+        self.backend = backend
+        self.idle_timeout = (
+            getattr(settings, 'MAIL_IDLE_TIMEOUT', 30) if idle_timeout is None else idle_timeout
+        )
+        self.connection = None
+        self.last_used = 0
+        self.lock = threading.Lock()
+        self.counters = {'sent': 0, 'failed': 0, 'connects': 0, 'reconnects': 0}
+
+    def _connect(self):
+        if self.connection is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+        if self.connection is None:
+            connection = get_connection(self.backend, fail_silently=False)
+            connection.open()
+            self.connection = connection
+            self.counters['connects'] += 1
+        return self.connection
+
+    def _send_one(self, message):
+        start = time.perf_counter()
+        error = self._deliver(message)
+        metrics.external_call('smtp', time.perf_counter() - start, error=error is not None)
+        return error
+
+    def _deliver(self, message):
+        for attempt in range(2):
+            try:
+                connection = self._connect()
+                message.connection = connection
+                connection.send_messages([message])
+                self.counters['sent'] += 1
+                return None
+            except CONNECTION_ERRORS as e:
+                self.close()
+                if attempt:
+                    self.counters['failed'] += 1
+                    return e
+                self.counters['reconnects'] += 1
+            except Exception as e:
+                self.counters['failed'] += 1
+                return e
+            finally:
+                self.last_used = time.monotonic()
+
+    def send(self, messages):
+        """Send ``messages`` on the shared connection.
+
+        Returns one entry per message: None if it was sent, else the error.
+        """
+        with self.lock:
+            return [self._send_one(message) for message in messages]
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def stats(self):
+        return dict(self.counters)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = MailDispatcher()
+    return _dispatcher
+
+
+def reset_dispatcher():
+    global _dispatcher
+    _dispatcher = None
+
+
+# A forked worker must open its own connection.
+os.register_at_fork(after_in_child=reset_dispatcher)
@@ -0,0 +1,76 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from logic import digest, outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending outbox messages and the admin order digest (bank history goes through sync_history).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true',
+                            help='Drain everything that is due and exit.')
+        parser.add_argument('--digest-interval', type=float, default=30.0,
+                            help='Seconds between checks for a due admin digest.')
+        parser.add_argument('--purge-interval', type=float, default=3600.0,
+                            help='Seconds between deletions of old delivered messages.')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+
+        if workers == 1:
+            self.run(options)
+            return
+
+        # Forked children must not share the parent's database sockets.
+        connections.close_all()
+        procs = [
+            multiprocessing.Process(target=self.run, args=(options,), daemon=True)
+            for _ in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        self.stdout.write(f"Started {workers} outbox workers")
+
+        try:
+            for p in procs:
+                p.join()
+        except KeyboardInterrupt:
+            for p in procs:
+                p.terminate()
+
+    def run(self, options):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+
+        next_digest = 0
+        next_purge = 0
+
+        while not stopping:
+            if time.monotonic() >= next_digest:
+                next_digest = time.monotonic() + options['digest_interval']
+                try:
+                    digest.flush()
+                except Exception as e:
+                    self.stderr.write(f"Admin digest failed ({e}), retrying later")
+
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + options['purge_interval']
+                try:
+                    outbox.purge()
+                except Exception as e:
+                    self.stderr.write(f"Outbox purge failed ({e}), retrying later")
+
+            processed = outbox.drain(options['batch_size'])
+            if processed:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from logic import profiling
+
+
+class Command(BaseCommand):
+    help = 'Print an X-Profile header value that gets a request profiled.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--issuer', default='ops', help='Recorded in the token, e.g. who asked for it.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{profiling.HEADER}: {profiling.make_token(options['issuer'])}")
@@ -0,0 +1,43 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from logic import history, outbox
+
+
+class Command(BaseCommand):
+    help = 'Send order history to the bank in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-age', type=float, default=None,
+                            help='Send a partial batch once its oldest order is this many seconds old.')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true',
+                            help='Send everything that is waiting, full batch or not, and exit.')
+
+    def handle(self, *args, **options):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        failures = 0
+
+        while not stopping:
+            try:
+                sent = history.flush(options['batch_size'], options['max_age'], force=options['once'])
+            except Exception as e:
+                failures += 1
+                delay = outbox.backoff(failures)
+                self.stderr.write(f"History sync failed ({e}), retrying in {delay:.0f}s")
+                if options['once']:
+                    raise
+                time.sleep(delay)
+                continue
+
+            failures = 0
+            if sent:
+                self.stdout.write(f"Sent {sent} orders")
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,433 @@
+"""Request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` records, per view (the URL name from settings/urls.py):
+
+* request count by method and status, and a latency histogram
+* ORM query count and time, and a histogram of queries per request
+* time spent calling the bank, SMTP and Redis, and how many of those failed
+* exceptions that escaped the view
+
+and, per process, how often the bank JWT was minted and which state the
+bank circuit breaker is in (a gauge: summed over the files it is the number
+of workers in each state).
+
+Queries are counted by a wrapper installed on every database connection
+(``connection_created``); the bank client, the mail dispatcher and the Redis
+client report their own calls with ``external_call``; other modules bump
+counters with ``count`` and set gauges from a collector registered with
+``add_collector``, which runs before every snapshot. Calls made outside a
+request (the outbox and history workers) are labelled ``view="-"``.
+
+Each process keeps its numbers in memory and writes them to
+``METRICS_DIR/<pid>-<start ms>.json`` at most every METRICS_FLUSH_INTERVAL
+seconds; the start time keeps a recycled pid from overwriting an exited
+worker's file. ``/metrics`` adds up every file in the directory, so any
+worker answers for all of them. Before that it folds the files of exited
+workers (pid gone, or reused by a newer file) into ``exited.json``, dropping
+their gauges, so counters never go backwards and the directory holds one file
+per live worker plus one. The directory must not be shared between hosts.
+"""
+import contextlib
+import contextvars
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by view, method and status code.', None),
+    'http_request_duration_seconds': ('histogram', 'Request latency by view.', LATENCY_BUCKETS),
+    'http_exceptions_total': ('counter', 'Exceptions raised by views, by type.', None),
+    'db_queries_total': ('counter', 'ORM queries by view.', None),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in ORM queries by view.', None),
+    'db_queries_per_request': ('histogram', 'ORM queries per request by view.', QUERY_BUCKETS),
+    'external_call_duration_seconds': (
+        'histogram', 'Bank, SMTP and Redis call latency by service and view.', LATENCY_BUCKETS,
+    ),
+    'external_call_errors_total': ('counter', 'Failed bank, SMTP and Redis calls by service and view.', None),
+    'bank_token_mints_total': ('counter', 'Bank service JWTs signed.', None),
+    'bank_circuit_state': ('gauge', 'Workers whose bank circuit breaker is in each state.', None),
+}
+
+NO_VIEW = '-'
+EXITED = 'exited.json'
+
+
+class Registry:
+    """This process's counters and histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.flushed_at = 0
+        self.file_name = f"{os.getpid()}-{time.time_ns() // 1_000_000}.json"
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + value
+
+    def set(self, name, labels, value):
+        with self.lock:
+            self.series[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self.lock:
+            # Per-bucket counts (the last one is +Inf), then the sum.
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                i = len(buckets)
+            series[i] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        for collector in _collectors:
+            collector(self)
+        with self.lock:
+            return [
+                [name, list(labels), value[:] if isinstance(value, list) else value]
+                for (name, labels), value in self.series.items()
+            ]
+
+    def flush(self, directory, force=False):
+        """Write the snapshot to ``directory`` if it is due."""
+        now = time.monotonic()
+        if not force and now - self.flushed_at < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1):
+            return
+        self.flushed_at = now
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_json(directory, self.file_name, self.snapshot())
+
+
+def merge(snapshots):
+    """Add up snapshots into ``{(name, labels): value}``."""
+    totals = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            if name not in METRICS:
+                continue
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if isinstance(value, list):
+                current = totals.get(key)
+                totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(totals):
+    """Format merged series in the Prometheus text exposition format."""
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (n, labels), value in totals.items() if n == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind != 'histogram':
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels((*labels, ('le', bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+_registry = Registry()
+_collectors = []
+
+
+def add_collector(callback):
+    """Call ``callback(registry)`` before each snapshot, to set gauges."""
+    _collectors.append(callback)
+
+
+def count(name, labels=(), value=1):
+    """Add to a counter that is not tied to a request."""
+    _registry.inc(name, labels, value)
+
+
+def reset_registry():
+    global _registry
+    _registry = Registry()
+
+
+# A forked worker starts from zero and writes its own file.
+os.register_at_fork(after_in_child=reset_registry)
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _write_json(directory, name, data):
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, directory / name)
+
+
+def _read_json(path, default=None):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return default
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def exited_files(directory):
+    """Worker files whose process is gone, including ``<pid>.json`` from
+    before files carried the start time."""
+    workers = {}
+    exited = []
+    for path in directory.glob('*.json'):
+        if path.name == EXITED:
+            continue
+        try:
+            pid, started = (int(part) for part in path.stem.split('-'))
+        except ValueError:
+            exited.append(path)
+            continue
+        workers.setdefault(pid, []).append((started, path))
+    for pid, files in workers.items():
+        files.sort()
+        # Only the newest file of a pid can belong to a running process.
+        exited += [path for _, path in files[:-1]]
+        if pid != os.getpid() and not _running(pid):
+            exited.append(files[-1][1])
+    return exited
+
+
+def fold_exited(directory):
+    """Add the counters and histograms of exited workers to ``exited.json``
+    and delete their files. Returns without waiting if another process is
+    already at it."""
+    with open(directory / '.lock', 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        previous = _read_json(directory / EXITED, {'series': [], 'folded': []})
+        # Files already in the total whose deletion was interrupted.
+        for name in previous['folded']:
+            (directory / name).unlink(missing_ok=True)
+        paths = exited_files(directory)
+        if not paths:
+            return
+        snapshots = [previous['series']] + [_read_json(path, []) for path in paths]
+        series = [
+            [name, [list(pair) for pair in labels], value]
+            for (name, labels), value in merge(snapshots).items()
+            if METRICS[name][0] != 'gauge'
+        ]
+        _write_json(directory, EXITED, {'series': series, 'folded': [path.name for path in paths]})
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+
+def collect():
+    """Merge this process's numbers with every worker's file."""
+    directory = metrics_dir()
+    if not directory:
+        return merge([_registry.snapshot()])
+    _registry.flush(directory, force=True)
+    directory = Path(directory)
+    fold_exited(directory)
+    with open(directory / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        exited = _read_json(directory / EXITED, {'series': [], 'folded': []})
+        snapshots = [exited['series']]
+        for path in directory.glob('*.json'):
+            if path.name != EXITED and path.name not in exited['folded']:
+                snapshots.append(_read_json(path, []))
+    return merge(snapshots)
+
+
+class RequestStats:
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.query_time = 0.0
+        self.calls = []
+
+
+_current = contextvars.ContextVar('metrics_request', default=None)
+_untracked = contextvars.ContextVar('metrics_untracked', default=False)
+
+
+def current_request():
+    """The request being handled in this context, if any."""
+    stats = _current.get()
+    return stats.request if stats else None
+
+
+@contextlib.contextmanager
+def untracked():
+    """Leave queries run inside out of the current request's numbers, for
+    instrumentation's own queries (the slow query log's EXPLAIN)."""
+    token = _untracked.set(True)
+    try:
+        yield
+    finally:
+        _untracked.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper: time the query against the current request."""
+    stats = _current.get()
+    if stats is None or _untracked.get():
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+
+
+def install_query_hook(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def external_call(service, seconds, error=False):
+    """Record a call to the bank, SMTP or Redis against the current request."""
+    stats = _current.get()
+    if stats is not None:
+        stats.calls.append((service, seconds, error))
+        return
+    _record_call(service, NO_VIEW, seconds, error)
+    directory = metrics_dir()
+    if directory:
+        _registry.flush(directory)
+
+
+def _record_call(service, view, seconds, error):
+    labels = (('service', service), ('view', view))
+    _registry.observe('external_call_duration_seconds', labels, seconds)
+    if error:
+        _registry.inc('external_call_errors_total', labels)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+def record_request(request, status, elapsed, stats):
+    view = view_name(request)
+    registry = _registry
+    registry.inc('http_requests_total', (('view', view), ('method', request.method), ('status', str(status))))
+    registry.observe('http_request_duration_seconds', (('view', view),), elapsed)
+    registry.inc('db_queries_total', (('view', view),), stats.queries)
+    registry.inc('db_query_duration_seconds_total', (('view', view),), stats.query_time)
+    registry.observe('db_queries_per_request', (('view', view),), stats.queries)
+    for service, seconds, error in stats.calls:
+        _record_call(service, view, seconds, error)
+    directory = metrics_dir()
+    if directory:
+        registry.flush(directory)
+
+
+class MetricsMiddleware:
+    """Time every request and attribute its queries and outbound calls to
+    the view. Goes first in MIDDLEWARE so the timing covers the rest."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats(request)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats(request)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def finish(self, request, response, elapsed, stats):
+        if view_name(request) != 'metrics':
+            record_request(request, response.status_code, elapsed, stats)
+
+    def process_exception(self, request, exception):
+        _registry.inc('http_exceptions_total', (
+            ('view', view_name(request)), ('exception', type(exception).__name__),
+        ))
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; needs ``Bearer METRICS_TOKEN``. Without a
+    token it is only served with DEBUG on."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token and not settings.DEBUG:
+        raise Http404
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
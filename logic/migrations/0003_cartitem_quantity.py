@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:17
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    """Collapse the old one-row-per-unit cart into one row per product."""
+    CartItem = apps.get_model('logic', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('user_id', 'item_id')
+        .annotate(units=Count('id'), keep=Max('id'))
+        .filter(units__gt=1)
+    )
+    for group in duplicates:
+        CartItem.objects.filter(id=group['keep']).update(quantity=group['units'])
+        CartItem.objects.filter(
+            user_id=group['user_id'], item_id=group['item_id']
+        ).exclude(id=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0002_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'item_id'), name='unique_cart_item'),
+        ),
+    ]
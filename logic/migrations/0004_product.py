@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:18
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+# The products that used to be hard-coded in index.html.
+INITIAL_PRODUCTS = [
+    ('headphones', 'Premium Headphones', Decimal('299.00')),
+    ('mouse', 'Wireless Mouse', Decimal('79.00')),
+    ('keyboard', 'Mechanical Keyboard', Decimal('149.00')),
+    ('usb', 'USB-C Hub', Decimal('49.00')),
+]
+
+
+def seed_products(apps, schema_editor):
+    Product = apps.get_model('logic', 'Product')
+    for sku, name, price in INITIAL_PRODUCTS:
+        Product.objects.get_or_create(sku=sku, defaults={'name': name, 'price': price})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0003_cartitem_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sku', models.CharField(max_length=100, unique=True)),
+                ('name', models.CharField(max_length=250)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(seed_products, migrations.RunPython.noop),
+    ]
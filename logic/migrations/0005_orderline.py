@@ -0,0 +1,92 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:21
+
+import re
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+LEGACY_ITEM = re.compile(r'^(?P<name>.*?)(?: x(?P<quantity>\d+))?$')
+
+
+def parse_legacy_items(item):
+    """'Wireless Mouse x2, USB-C Hub x1' -> [('Wireless Mouse', 2), ('USB-C Hub', 1)]"""
+    parsed = []
+    for part in item.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = LEGACY_ITEM.match(part)
+        parsed.append((match.group('name'), int(match.group('quantity') or 1)))
+    return parsed
+
+
+def backfill_order_lines(apps, schema_editor):
+    """Create OrderLine rows for orders placed before the table existed.
+
+    Unit prices were never stored. A single-product order gets its exact
+    price from the order total; otherwise the product's current catalog
+    price is used when the name matches one, else 0.
+    """
+    Orders = apps.get_model('logic', 'Orders')
+    OrderLine = apps.get_model('logic', 'OrderLine')
+    Product = apps.get_model('logic', 'Product')
+
+    products = {}
+    for product in Product.objects.all():
+        products[product.name] = product
+        products[product.sku] = product
+
+    batch = []
+    for order in Orders.objects.exclude(item='').iterator(chunk_size=1000):
+        parsed = parse_legacy_items(order.item)
+        for name, quantity in parsed:
+            product = products.get(name)
+            if len(parsed) == 1:
+                unit_price = (order.total / quantity).quantize(Decimal('0.01'))
+            elif product:
+                unit_price = product.price
+            else:
+                unit_price = Decimal('0.00')
+            batch.append(OrderLine(
+                order_id=order.id,
+                product=product,
+                name=product.name if product else name,
+                quantity=quantity,
+                unit_price=unit_price,
+            ))
+        if len(batch) >= 1000:
+            OrderLine.objects.bulk_create(batch)
+            batch = []
+    OrderLine.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0004_product'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orders',
+            name='item',
+            field=models.CharField(blank=True, default='', max_length=250),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=250)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='logic.orders')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='logic.product')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0006_orders_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='orderline',
+            options={},
+        ),
+        migrations.RemoveIndex(
+            model_name='outboxmessage',
+            name='outbox_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['user', '-added_at'], include=('id', 'item_id', 'price', 'quantity'), name='cartitem_user_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'available_at', 'id'], name='outbox_due_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def scrub_card_numbers(apps, schema_editor):
+    """Replace full card numbers in queued bank history with the last four digits."""
+    OutboxMessage = apps.get_model('logic', 'OutboxMessage')
+    batch = []
+    for message in OutboxMessage.objects.filter(topic='order.bank_history').iterator(chunk_size=1000):
+        card_number = message.payload.pop('card_number', None)
+        if card_number is None:
+            continue
+        message.payload['card_last4'] = str(card_number)[-4:]
+        batch.append(message)
+        if len(batch) >= 1000:
+            OutboxMessage.objects.bulk_update(batch, ['payload'])
+            batch = []
+    OutboxMessage.objects.bulk_update(batch, ['payload'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0008_synccursor'),
+    ]
+
+    operations = [
+        migrations.RunPython(scrub_card_numbers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0010_outbox_topic_status_idx'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='SyncCursor',
+        ),
+    ]
@@ -17,13 +17,27 @@ class User(AbstractUser):
         return self.username
 
 
+class Product(models.Model):
+    sku = models.CharField(max_length=100, unique=True)
+    name = models.CharField(max_length=250)
+    price = models.DecimalField(decimal_places=2, max_digits=10)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.name
+
+
 class Orders(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name='orders'
     )
-    item = models.CharField(max_length=250)
+    # Legacy comma-joined summary; new orders store their items in OrderLine.
+    item = models.CharField(max_length=250, default="", blank=True)
     total = models.DecimalField(decimal_places=2, max_digits=10)
     date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=50, default="Paid")
@@ -32,11 +46,40 @@ class Orders(models.Model):
     class Meta:
         ordering = ['-date']
         verbose_name_plural = "Orders"
+        indexes = [
+            models.Index(fields=['user', '-date', '-id'], name='orders_user_date_idx'),
+        ]
 
     def get_items_list(self):
+        # Sorted here rather than with Meta.ordering so the prefetch query
+        # needs no ORDER BY.
+        lines = sorted(self.lines.all(), key=lambda line: line.id)
+        if lines:
+            return [str(line) for line in lines]
         return [item.strip() for item in self.item.split(',') if item.strip()]
 
 
+class OrderLine(models.Model):
+    order = models.ForeignKey(
+        Orders,
+        on_delete=models.CASCADE,
+        related_name='lines'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='order_lines'
+    )
+    name = models.CharField(max_length=250)
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(decimal_places=2, max_digits=10)
+
+    def __str__(self):
+        return f"{self.name} x{self.quantity}"
+
+
 class CartItem(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -45,11 +88,47 @@ class CartItem(models.Model):
     )
     item_id = models.CharField(max_length=100)
     price = models.DecimalField(decimal_places=2, max_digits=10)
+    quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=50, default="Unpaid")
 
     class Meta:
         ordering = ['-added_at']
+        indexes = [
+            # Covers CartStore's cold load: index-only scan in cart order.
+            models.Index(
+                fields=['user', '-added_at'],
+                name='cartitem_user_added_idx',
+                include=['id', 'item_id', 'price', 'quantity'],
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item_id'], name='unique_cart_item'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.item_id}"
+
+
+class OutboxMessage(models.Model):
+    """Side effect recorded in the same transaction as the row that caused it.
+
+    Rows are drained by ``manage.py drain_outbox`` (see logic/outbox.py).
+    """
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=50, default="Pending")
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_error = models.TextField(default="", blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'available_at', 'id'], name='outbox_due_idx'),
+            models.Index(fields=['topic', 'status', 'id'], name='outbox_topic_status_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.item_id}"
\ No newline at end of file
+        return f"{self.topic} #{self.id} ({self.status})"
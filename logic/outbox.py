@@ -0,0 +1,202 @@
+"""Transactional outbox.
+
+Views call ``enqueue`` inside the same ``transaction.atomic()`` block that
+writes the business row, so the side effect is recorded if and only if the
+row commits. ``drain`` is run by the ``drain_outbox`` management command: it
+leases a batch of due messages, runs the registered handler for each one (or
+one batch handler per topic) outside of any transaction and reschedules
+failures with exponential backoff. ``purge`` deletes delivered messages
+after OUTBOX_RETENTION_DAYS.
+"""
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from logic.models import OutboxMessage
+
+
+HANDLERS = {}
+BATCH_HANDLERS = {}
+
+# Topics read in batches by their own consumer instead of one by one here
+# (order history: logic/history.py, admin digest: logic/digest.py).
+BATCHED_TOPICS = ['order.bank_history', 'order.admin_digest']
+
+
+def handler(topic):
+    def register(fn):
+        HANDLERS[topic] = fn
+        return fn
+    return register
+
+
+def batch_handler(topic):
+    """Register ``fn(payloads)`` to handle every due message of ``topic`` in
+    one call. It returns one entry per payload: None on success, else the
+    exception."""
+    def register(fn):
+        BATCH_HANDLERS[topic] = fn
+        return fn
+    return register
+
+
+def enqueue(topic, payload):
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def backoff(attempts):
+    base = getattr(settings, 'OUTBOX_BASE_BACKOFF', 5)
+    cap = getattr(settings, 'OUTBOX_MAX_BACKOFF', 3600)
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(batch_size):
+    """Lease up to ``batch_size`` due messages and return them.
+
+    The lease is taken by pushing ``available_at`` past the lease timeout, so
+    the row lock is only held for this short transaction and concurrent
+    workers skip rows another worker already claimed.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'OUTBOX_LEASE_SECONDS', 60))
+
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='Pending', available_at__lte=now)
+            .exclude(topic__in=BATCHED_TOPICS)
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        if messages:
+            OutboxMessage.objects.filter(id__in=[m.id for m in messages]).update(
+                available_at=now + lease
+            )
+    return messages
+
+
+def claim_topic(topic, limit, due=None):
+    """Lease up to ``limit`` pending ``topic`` messages, oldest first, for a
+    batched consumer.
+
+    ``due(messages)`` may decline the batch, in which case nothing is leased.
+    As in ``claim`` the row locks only last for this transaction, never for
+    the consumer's network call; ``complete`` or ``release`` ends the lease.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=getattr(settings, 'OUTBOX_LEASE_SECONDS', 60))
+
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .filter(topic=topic, status='Pending', available_at__lte=now)
+            .order_by('id')[:limit]
+        )
+        if not messages or (due is not None and not due(messages)):
+            return []
+        OutboxMessage.objects.filter(id__in=[m.id for m in messages]).update(available_at=lease_until)
+    for message in messages:
+        message.available_at = lease_until
+    return messages
+
+
+def complete(messages):
+    """Mark messages leased by ``claim_topic`` Done.
+
+    Rows whose lease ran out and were claimed again are left to the new
+    holder. Returns the number marked.
+    """
+    return OutboxMessage.objects.filter(
+        id__in=[m.id for m in messages], status='Pending', available_at=messages[0].available_at,
+    ).update(status='Done', attempts=F('attempts') + 1)
+
+
+def release(messages):
+    """Give up a lease from ``claim_topic`` so the messages can be claimed again now."""
+    OutboxMessage.objects.filter(
+        id__in=[m.id for m in messages], status='Pending', available_at=messages[0].available_at,
+    ).update(available_at=timezone.now(), attempts=F('attempts') + 1)
+
+
+def process(message):
+    fn = HANDLERS.get(message.topic)
+    try:
+        if fn is None:
+            raise LookupError(f"No outbox handler for topic '{message.topic}'")
+        fn(message.payload)
+    except Exception as e:
+        return finish(message, e)
+    return finish(message, None)
+
+
+def process_batch(topic, messages):
+    try:
+        errors = BATCH_HANDLERS[topic]([m.payload for m in messages])
+    except Exception as e:
+        errors = [e] * len(messages)
+    return [finish(message, error) for message, error in zip(messages, errors)]
+
+
+def finish(message, error):
+    """Mark ``message`` done, or reschedule it after ``error``."""
+    message.attempts += 1
+
+    if error is not None:
+        message.last_error = ''.join(
+            traceback.format_exception(type(error), error, error.__traceback__)
+        )[-2000:]
+        if message.attempts >= getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8):
+            message.status = 'Failed'
+        else:
+            message.available_at = timezone.now() + timedelta(seconds=backoff(message.attempts))
+        message.save(update_fields=['attempts', 'status', 'available_at', 'last_error'])
+        return False
+
+    message.status = 'Done'
+    message.last_error = ''
+    message.save(update_fields=['attempts', 'status', 'last_error'])
+    return True
+
+
+def drain(batch_size=50):
+    """Process one batch of due messages. Returns the number processed."""
+    # Importing the task module registers its handlers.
+    import logic.tasks  # noqa: F401
+
+    messages = claim(batch_size)
+    batches = {}
+    for message in messages:
+        if message.topic in BATCH_HANDLERS:
+            batches.setdefault(message.topic, []).append(message)
+        else:
+            process(message)
+    for topic, group in batches.items():
+        process_batch(topic, group)
+    return len(messages)
+
+
+def purge(days=None, batch_size=1000):
+    """Delete Done messages older than ``days`` (OUTBOX_RETENTION_DAYS).
+
+    Returns the number deleted. Rows go in batches to keep each delete short.
+    """
+    days = getattr(settings, 'OUTBOX_RETENTION_DAYS', 7) if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(
+            OutboxMessage.objects
+            .filter(status='Done', created_at__lt=cutoff)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += OutboxMessage.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,46 @@
+"""Keyset (cursor) pagination over ``(date, id)``.
+
+Each page is fetched with ``WHERE (date, id) < (cursor)`` on the
+``orders_user_date_idx`` index, so page N costs the same as page 1 however
+long the history is. The ``date <= cursor`` half is kept as a separate
+condition so Postgres can use it as the index range start.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj):
+    raw = f"{obj.date.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(date), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def keyset_page(queryset, cursor=None, size=20):
+    """Return ``(rows, next_cursor)`` for the page after ``cursor``.
+
+    ``next_cursor`` is None on the last page.
+    """
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        queryset = queryset.filter(date__lte=date).filter(Q(date__lt=date) | Q(id__lt=pk))
+
+    rows = list(queryset[:size + 1])
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
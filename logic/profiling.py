@@ -0,0 +1,224 @@
+"""Opt-in profiling of single requests.
+
+A request is profiled when it carries a valid ``X-Profile`` header (minted by
+``manage.py profile_token``, signed with SECRET_KEY and good for
+PROFILE_TOKEN_MAX_AGE seconds), or when it is picked at random at
+PROFILE_SAMPLE_RATE among requests under PROFILE_PATHS.
+
+PROFILE_MODE picks the profiler:
+
+``sampling``  every PROFILE_INTERVAL seconds a background thread records the
+              stack of every thread in the process. The output is one
+              ``frame;frame;frame count`` line per stack (collapsed stacks),
+              ready for flamegraph.pl or speedscope. Each stack starts with
+              the thread name, so other threads' work can be told apart.
+``cprofile``  deterministic, current thread only, written as a pstats file
+              (``python -m pstats``, snakeviz). Much slower while it runs.
+
+Files go to PROFILE_DIR, named after the time, view and latency. At most one
+request per process is profiled at a time, and the oldest files are removed
+to stay within PROFILE_MAX_FILES and PROFILE_MAX_BYTES.
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+SALT = 'logic.profiling'
+
+_busy = threading.Lock()
+
+
+def make_token(issuer='ops'):
+    return signing.TimestampSigner(salt=SALT).sign(issuer)
+
+
+def valid_token(value):
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(
+            value, max_age=getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 3600)
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    extension = 'collapsed'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[f"{names.get(ident, ident)};{collapse(frame)}"] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class DeterministicProfiler:
+    extension = 'prof'
+
+    def __init__(self, interval=None):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+PROFILERS = {
+    'sampling': SamplingProfiler,
+    'cprofile': DeterministicProfiler,
+}
+
+
+def prune(directory):
+    """Delete the oldest profiles beyond PROFILE_MAX_FILES / PROFILE_MAX_BYTES."""
+    max_files = getattr(settings, 'PROFILE_MAX_FILES', 200)
+    max_bytes = getattr(settings, 'PROFILE_MAX_BYTES', 50 * 1024 * 1024)
+    files = []
+    for path in directory.iterdir():
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort(reverse=True)
+
+    total = 0
+    for i, (_, size, path) in enumerate(files):
+        total += size
+        if i >= max_files or total > max_bytes:
+            path.unlink(missing_ok=True)
+
+
+def save(profiler, request, elapsed):
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    match = getattr(request, 'resolver_match', None)
+    view = re.sub(r'[^\w.-]', '.', match.view_name if match else 'unmatched')
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{view}-{elapsed * 1000:.0f}ms-{os.getpid()}.{profiler.extension}"
+    profiler.write(directory / name)
+    prune(directory)
+    return name
+
+
+class ProfilerMiddleware:
+    """Profile requests chosen by header or sampling; see the module docstring."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def wanted(self, request):
+        """Return 'header', 'sampled' or None."""
+        token = request.headers.get(HEADER)
+        if token:
+            return 'header' if valid_token(token) else None
+        rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        paths = getattr(settings, 'PROFILE_PATHS', None)
+        if rate and (not paths or any(request.path.startswith(p) for p in paths)):
+            return 'sampled' if random.random() < rate else None
+        return None
+
+    def begin(self, request):
+        reason = self.wanted(request)
+        if reason is None or not _busy.acquire(blocking=False):
+            return None, None
+        mode = getattr(settings, 'PROFILE_MODE', 'sampling')
+        profiler = PROFILERS[mode](getattr(settings, 'PROFILE_INTERVAL', 0.005))
+        profiler.start()
+        return profiler, reason
+
+    def end(self, profiler, request, elapsed):
+        try:
+            profiler.stop()
+            return save(profiler, request, elapsed)
+        except OSError:
+            # A full disk or unwritable PROFILE_DIR must not fail the request.
+            logger.warning("Could not save the request profile", exc_info=True)
+            return None
+        finally:
+            _busy.release()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiler, reason = self.begin(request)
+        if profiler is None:
+            return self.get_response(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            name = self.end(profiler, request, time.perf_counter() - start)
+        if reason == 'header' and name:
+            response['X-Profile-File'] = name
+        return response
+
+    async def __acall__(self, request):
+        profiler, reason = self.begin(request)
+        if profiler is None:
+            return await self.get_response(request)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            name = self.end(profiler, request, time.perf_counter() - start)
+        if reason == 'header' and name:
+            response['X-Profile-File'] = name
+        return response
@@ -0,0 +1,264 @@
+"""Redis rate limiting shared by every worker.
+
+Each check is a single Lua call, so the read, the decision and the write
+happen atomically in one round trip. Two algorithms are available:
+
+``sliding``  a sliding-window log: at most N hits in any ``period`` seconds.
+``bucket``   a token bucket: bursts of up to N, refilled at N per ``period``.
+
+Limits are applied with the ``ratelimit`` decorator on a view, or for whole
+URL prefixes by ``RateLimitMiddleware`` from the RATELIMIT_RULES setting.
+While Redis is down (or when a call fails) requests are let through; limits
+apply again as soon as it is back. RATELIMIT_ENABLED = False turns every
+limit off.
+"""
+import functools
+import itertools
+import logging
+import os
+import re
+import socket
+import threading
+from collections import namedtuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+from logic import redis_client
+from logic.lazy import lazy_import
+
+redis = lazy_import('redis')
+
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] zset of hits; ARGV: limit, period_ms, cost, member prefix.
+# Returns {allowed, remaining, retry_after_ms}. A cost of 0 only reports.
+SLIDING_WINDOW = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - period)
+local count = redis.call('ZCARD', KEYS[1])
+
+if count + cost > limit or (cost == 0 and count >= limit) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    local retry = period
+    if oldest[2] then
+        retry = tonumber(oldest[2]) + period - now
+    end
+    return {0, math.max(limit - count, 0), retry}
+end
+
+for i = 1, cost do
+    redis.call('ZADD', KEYS[1], now, ARGV[4] .. ':' .. i)
+end
+if cost > 0 then
+    redis.call('PEXPIRE', KEYS[1], period)
+end
+return {1, limit - count - cost, 0}
+"""
+
+# KEYS[1] hash {tokens, ts}; same ARGV and return value as above.
+TOKEN_BUCKET = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local rate = limit / period
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or limit
+local ts = tonumber(state[2]) or now
+tokens = math.min(limit, tokens + (now - ts) * rate)
+
+local needed = math.max(cost, 1)
+if tokens < needed then
+    return {0, math.floor(tokens), math.ceil((needed - tokens) / rate)}
+end
+
+tokens = tokens - cost
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], period)
+return {1, math.floor(tokens), 0}
+"""
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+Result = namedtuple('Result', 'allowed remaining retry_after')
+ALLOWED = Result(True, None, 0)
+
+
+def parse_rate(rate):
+    """``'10/m'`` -> ``(10, 60)``; ``'2/5m'`` -> ``(2, 300)``."""
+    match = RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f"Invalid rate '{rate}'")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def user_or_ip(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{client_ip(request)}"
+
+
+KEY_FUNCTIONS = {
+    'ip': client_ip,
+    'user': user_or_ip,
+}
+
+
+class RateLimit:
+    def __init__(self, name, rate, key='ip', algorithm='sliding', methods=None):
+        if algorithm not in ('sliding', 'bucket'):
+            raise ValueError(f"Unknown rate limit algorithm '{algorithm}'")
+        self.name = name
+        self.limit, self.period = parse_rate(rate)
+        self.key = KEY_FUNCTIONS[key] if isinstance(key, str) else key
+        self.algorithm = algorithm
+        self.methods = {m.upper() for m in methods} if methods else None
+
+    def applies(self, request):
+        return self.methods is None or request.method in self.methods
+
+    def redis_key(self, request):
+        return f"rl:{self.name}:{self.key(request)}"
+
+
+class RateLimiter:
+    def __init__(self, client):
+        self.client = client
+        self.scripts = {
+            'sliding': client.register_script(SLIDING_WINDOW),
+            'bucket': client.register_script(TOKEN_BUCKET),
+        } if client is not None else {}
+        self.members = itertools.count()
+        self.member_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def hit(self, request, limit, cost=1):
+        """Count ``cost`` hits against ``limit`` if they fit.
+
+        ``cost=0`` only asks whether the limit is already used up.
+        """
+        if not self.client or not getattr(settings, 'RATELIMIT_ENABLED', True):
+            return ALLOWED
+        member = f"{self.member_prefix}:{next(self.members)}"
+        try:
+            allowed, remaining, retry_ms = self.scripts[limit.algorithm](
+                keys=[limit.redis_key(request)],
+                args=[limit.limit, limit.period * 1000, cost, member],
+            )
+        except redis.RedisError:
+            logger.warning("Rate limit check for %s failed, allowing", limit.name, exc_info=True)
+            return ALLOWED
+        return Result(bool(allowed), remaining, max(retry_ms, 0) / 1000)
+
+    def blocked(self, request, limit):
+        return not self.hit(request, limit, cost=0).allowed
+
+    def reset(self, request, limit):
+        if not self.client:
+            return
+        try:
+            self.client.delete(limit.redis_key(request))
+        except redis.RedisError:
+            pass
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(redis_client.get_client())
+    return _limiter
+
+
+def too_many_requests(result, message='Sent too many requests. Try again later.'):
+    response = JsonResponse({'status': 'error', 'message': message}, status=429)
+    response['Retry-After'] = str(max(int(result.retry_after + 0.999), 1))
+    return response
+
+
+def check(request, limits):
+    """Return a 429 response for the first exceeded limit, else None."""
+    limiter = get_limiter()
+    for limit in limits:
+        if limit.applies(request):
+            result = limiter.hit(request, limit)
+            if not result.allowed:
+                return too_many_requests(result)
+    return None
+
+
+def ratelimit(name, rate, key='ip', algorithm='sliding', methods=None):
+    """Limit a sync or async view; excess requests get a 429."""
+    limit = RateLimit(name, rate, key=key, algorithm=algorithm, methods=methods)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                response = await sync_to_async(check)(request, [limit])
+                return response or await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                return check(request, [limit]) or view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RateLimitMiddleware:
+    """Apply RATELIMIT_RULES to every request whose path starts with a rule's
+    ``path``. Each rule is a dict of ``path``, ``name``, ``rate`` and
+    optionally ``key``, ``algorithm`` and ``methods``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = [
+            (rule['path'], RateLimit(
+                rule['name'], rule['rate'],
+                key=rule.get('key', 'ip'),
+                algorithm=rule.get('algorithm', 'sliding'),
+                methods=rule.get('methods'),
+            ))
+            for rule in getattr(settings, 'RATELIMIT_RULES', [])
+        ]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def limits_for(self, request):
+        return [limit for path, limit in self.rules if request.path.startswith(path)]
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        limits = self.limits_for(request)
+        response = check(request, limits) if limits else None
+        return response or self.get_response(request)
+
+    async def __acall__(self, request):
+        limits = self.limits_for(request)
+        response = await sync_to_async(check)(request, limits) if limits else None
+        return response or await self.get_response(request)
@@ -0,0 +1,173 @@
+"""Shared Redis client for carts, the catalog and rate limiting.
+
+Nothing connects at import time: the connection pool is created on first
+use, and connections are opened as commands need them. A client that cannot
+reach Redis is marked down and is falsy for REDIS_RETRY_INTERVAL seconds, so
+callers take their no-Redis path without waiting on a socket timeout each
+time. The first command after that interval tries Redis again, and a success
+puts the client back in service and runs the ``on_recovery`` callbacks.
+
+Pooled connections idle for longer than REDIS_HEALTH_CHECK_INTERVAL are
+PINGed before reuse, and a command that fails on a stale connection is retried
+once on a fresh one. redis-py's pool notices a fork and opens new connections
+in the child, so the client can be created before workers fork.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from logic import metrics
+from logic.lazy import lazy_import
+
+
+# redis-py is imported when the first command runs (see logic/lazy.py).
+redis = lazy_import('redis')
+
+logger = logging.getLogger(__name__)
+
+
+def connection_errors():
+    return (redis.ConnectionError, redis.TimeoutError)
+
+
+# Return objects that run commands later; errors surface from those instead.
+PASSTHROUGH = {'pipeline', 'pubsub', 'lock', 'get_encoder', 'connection_pool'}
+
+
+class LazyScript:
+    """A ``register_script`` result that is only built on its first call."""
+
+    def __init__(self, client, source):
+        self.client = client
+        self.source = source
+        self.script = None
+
+    def __call__(self, keys=None, args=None, client=None):
+        if self.script is None:
+            from redis.commands.core import Script
+
+            # Bound to the wrapper so script calls update its health state too.
+            self.script = Script(self.client, self.source)
+        return self.script(keys=keys, args=args, client=client)
+
+
+class RedisClient:
+    """Lazily connected ``redis.Redis`` that tracks whether Redis is up."""
+
+    def __init__(self, url, retry_interval=None, **options):
+        self.url = url
+        self.retry_interval = (
+            getattr(settings, 'REDIS_RETRY_INTERVAL', 5) if retry_interval is None else retry_interval
+        )
+        self.options = options
+        self._client = None
+        self.lock = threading.Lock()
+        self.down_until = 0
+        self.counters = {'failures': 0, 'recoveries': 0}
+        self.recovery_callbacks = []
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    from redis.backoff import NoBackoff
+                    from redis.retry import Retry
+
+                    timeout = getattr(settings, 'REDIS_SOCKET_TIMEOUT', 1)
+                    options = {
+                        'socket_connect_timeout': timeout,
+                        'socket_timeout': timeout,
+                        'health_check_interval': getattr(settings, 'REDIS_HEALTH_CHECK_INTERVAL', 30),
+                        'retry': Retry(NoBackoff(), 1),
+                        'retry_on_error': list(connection_errors()),
+                        **self.options,
+                    }
+                    self._client = redis.Redis.from_url(self.url, **options)
+        return self._client
+
+    def available(self):
+        """False while Redis is marked down. Never touches the network."""
+        return time.monotonic() >= self.down_until
+
+    __bool__ = available
+
+    def mark_down(self):
+        if self.available():
+            logger.warning("Redis at %s unavailable, retrying in %ss", self.url, self.retry_interval)
+        self.down_until = time.monotonic() + self.retry_interval
+        self.counters['failures'] += 1
+
+    def mark_up(self):
+        if self.down_until:
+            self.down_until = 0
+            self.counters['recoveries'] += 1
+            logger.info("Redis at %s is back", self.url)
+            for callback in self.recovery_callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.warning("Redis recovery callback %r failed", callback, exc_info=True)
+
+    def on_recovery(self, callback):
+        """Call ``callback()`` whenever Redis is reachable again after being down."""
+        self.recovery_callbacks.append(callback)
+
+    def healthy(self):
+        """PING Redis now, unless it is marked down."""
+        if not self.available():
+            return False
+        try:
+            return bool(self.ping())
+        except redis.RedisError:
+            return False
+
+    def register_script(self, script):
+        return LazyScript(self, script)
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name in PASSTHROUGH or not callable(attr):
+            return attr
+
+        def command(*args, **kwargs):
+            if not self.available():
+                raise redis.ConnectionError(f"Redis at {self.url} is marked down")
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except connection_errors():
+                metrics.external_call('redis', time.perf_counter() - start, error=True)
+                self.mark_down()
+                raise
+            metrics.external_call('redis', time.perf_counter() - start)
+            self.mark_up()
+            return result
+        return command
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def stats(self):
+        return {**self.counters, 'available': self.available()}
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url=None):
+    """Return the process-wide client for ``url`` (default REDIS_URL)."""
+    url = url or settings.REDIS_URL
+    client = _clients.get(url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(url)
+            if client is None:
+                client = _clients[url] = RedisClient(url)
+    return client
+
@@ -0,0 +1,152 @@
+"""Session engine: Redis first, the database only as a fallback.
+
+Sessions are kept in the ``sessions`` cache (plain Redis, no in-process tier,
+so a logout is seen by every worker at once). The ``django_session`` table is
+only used while Redis is unreachable, and for sessions written during such an
+outage, which move back into Redis (and out of the table) the next time they
+are saved. Deleting a session always removes its row too, so a copy left
+behind by an outage cannot bring a logged-out session back.
+
+A failed connection marks the sessions Redis down through the same
+``logic.redis_client`` client the cart uses for that URL, and for the next
+REDIS_RETRY_INTERVAL seconds sessions go straight to the table instead of
+each request waiting out the socket timeouts. Sessions deleted in that time
+are also deleted from Redis before the next call once it is back, so their
+old copy there cannot be loaded again by this process.
+
+A save whose data is byte-for-byte what was loaded is skipped, so views that
+re-assign an unchanged value do not cost a write.
+
+    SESSION_ENGINE = 'logic.sessions'
+    SESSION_CACHE_ALIAS = 'sessions'
+"""
+import pickle
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore as CacheSessionStore
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+
+from logic import redis_client
+from logic.lazy import lazy_import
+
+redis = lazy_import('redis')
+
+# Cache keys of sessions deleted while Redis was marked down.
+_pending_deletes = set()
+_pending_lock = threading.Lock()
+
+
+def _snapshot(data):
+    return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+
+class SessionStore(CacheSessionStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self.in_db = False
+        self.loaded = None
+
+    def db_store(self, session_key=None):
+        return DBSessionStore(session_key or self.session_key)
+
+    @property
+    def health(self):
+        return redis_client.get_client(settings.CACHES[settings.SESSION_CACHE_ALIAS]['LOCATION'])
+
+    def redis_call(self, method, *args, **kwargs):
+        """Run a cache call unless Redis is marked down, marking it down on a
+        connection failure."""
+        health = self.health
+        if not health.available():
+            raise redis.ConnectionError("Session Redis is marked down")
+        try:
+            if _pending_deletes:
+                with _pending_lock:
+                    keys = list(_pending_deletes)
+                    _pending_deletes.difference_update(keys)
+                try:
+                    self._cache.delete_many(keys)
+                except redis.RedisError:
+                    with _pending_lock:
+                        _pending_deletes.update(keys)
+                    raise
+            result = method(*args, **kwargs)
+        except redis_client.connection_errors():
+            health.mark_down()
+            raise
+        health.mark_up()
+        return result
+
+    def load(self):
+        try:
+            data = self.redis_call(self._cache.get, self.cache_key)
+        except redis.RedisError:
+            data = None
+        if data is None:
+            # Not in Redis: it may have been written while Redis was down.
+            store = self.db_store()
+            session = store._get_session_from_db()
+            if session is None:
+                self._session_key = None
+                return {}
+            data = store.decode(session.session_data)
+            self.in_db = True
+        self.loaded = _snapshot(data)
+        return data
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if not must_create and not self.in_db and self.loaded == _snapshot(data):
+            return
+
+        try:
+            if self.in_db and not must_create:
+                self.redis_call(self._cache.set, self.cache_key, data, self.get_expiry_age())
+                self.db_store().delete(self.session_key)
+                self.in_db = False
+            else:
+                self.redis_call(super().save, must_create=must_create)
+        except redis.RedisError:
+            store = self.db_store()
+            store._session_cache = data
+            store.save(must_create=must_create)
+            self.in_db = True
+        self.loaded = _snapshot(data)
+
+    def exists(self, session_key):
+        try:
+            return self.redis_call(super().exists, session_key)
+        except redis.RedisError:
+            return self.db_store(session_key).exists(session_key)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is None:
+            return
+        try:
+            self.redis_call(super().delete, session_key)
+        except redis.RedisError:
+            with _pending_lock:
+                _pending_deletes.add(self.cache_key_prefix + session_key)
+        self.db_store(session_key).delete(session_key)
+        self.in_db = False
+
+    @classmethod
+    def clear_expired(cls):
+        DBSessionStore.clear_expired()
+
+    async def aload(self):
+        return await sync_to_async(self.load)()
+
+    async def asave(self, must_create=False):
+        return await sync_to_async(self.save)(must_create=must_create)
+
+    async def aexists(self, session_key):
+        return await sync_to_async(self.exists)(session_key)
+
+    async def adelete(self, session_key=None):
+        return await sync_to_async(self.delete)(session_key)
@@ -0,0 +1,190 @@
+"""Slow query log.
+
+A wrapper on every database connection (installed from LogicConfig.ready)
+times each query. One that takes longer than SLOW_QUERY_THRESHOLD_MS and
+comes from SLOW_QUERY_MODULES (called from one of them, or run while serving
+one of their views) is written to SLOW_QUERY_LOG as a line of JSON:
+
+    {"ts": ..., "ms": 412.3, "fingerprint": "9f2c...", "view": "buy",
+     "caller": "logic.views.place_order:318", "sql": "SELECT ... WHERE ...",
+     "params": ["int", "str"], "many": false, "seen": 1, "plan": [...]}
+
+``sql`` is the statement with its placeholders; parameter values are not
+logged, only their types. ``plan`` is the planner's estimate from
+``EXPLAIN`` (no ANALYZE, so the statement is not run again).
+
+Queries are grouped by fingerprint (the SQL with literals and IN lists
+normalised). Each fingerprint is logged, and explained, at most once per
+SLOW_QUERY_DEDUP_WINDOW per process; ``seen`` counts the occurrences since
+it was last written. The file rotates at SLOW_QUERY_LOG_MAX_BYTES.
+"""
+import hashlib
+import json
+import logging
+import logging.handlers
+import re
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from logic import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+_lock = threading.Lock()
+_last_logged = {}
+_handler = None
+
+
+def fingerprint(sql):
+    normalised = re.sub(r'\s+', ' ', sql.strip())
+    normalised = re.sub(r"'(?:[^']|'')*'", '?', normalised)
+    normalised = re.sub(r'\b\d+\b', '?', normalised)
+    normalised = re.sub(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)', '(...)', normalised)
+    return hashlib.sha1(normalised.encode()).hexdigest()[:16]
+
+
+def params_shape(params, many):
+    if params is None:
+        return None
+    if many:
+        params = next(iter(params), ())
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def caller(modules):
+    """``module.function:line`` of the innermost frame from ``modules``."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith(modules):
+            return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+
+def view_of(request, modules):
+    match = getattr(request, 'resolver_match', None) if request is not None else None
+    if match is None or not getattr(match.func, '__module__', '').startswith(modules):
+        return None
+    return match.view_name
+
+
+def explain(connection, sql, params):
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN (ANALYZE off) '
+    # Busy keeps this hook off the EXPLAIN and its savepoint; untracked keeps
+    # them out of the view's query count in the metrics.
+    _state.busy = True
+    try:
+        with metrics.untracked():
+            savepoint = connection.savepoint() if connection.in_atomic_block else None
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(prefix + sql, params)
+                    rows = cursor.fetchall()
+                if savepoint:
+                    connection.savepoint_commit(savepoint)
+                return [' '.join(str(col) for col in row) for row in rows]
+            except Exception as e:
+                if savepoint:
+                    connection.savepoint_rollback(savepoint)
+                return [f"EXPLAIN failed: {e}"]
+    finally:
+        _state.busy = False
+
+
+def seen(key):
+    """Return how many times ``key`` was seen if it is due to be logged, else None."""
+    now = time.monotonic()
+    window = getattr(settings, 'SLOW_QUERY_DEDUP_WINDOW', 300)
+    with _lock:
+        logged_at, count = _last_logged.get(key, (None, 0))
+        count += 1
+        if logged_at is not None and now - logged_at < window:
+            _last_logged[key] = (logged_at, count)
+            return None
+        _last_logged[key] = (now, 0)
+        return count
+
+
+def get_handler():
+    global _handler
+    if _handler is None:
+        with _lock:
+            if _handler is None:
+                _handler = logging.handlers.RotatingFileHandler(
+                    settings.SLOW_QUERY_LOG,
+                    maxBytes=getattr(settings, 'SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024),
+                    backupCount=getattr(settings, 'SLOW_QUERY_LOG_BACKUPS', 5),
+                    delay=True,
+                )
+    return _handler
+
+
+def reset():
+    global _handler
+    with _lock:
+        _last_logged.clear()
+        if _handler is not None:
+            _handler.close()
+            _handler = None
+
+
+def write(entry):
+    record = logging.makeLogRecord({'msg': json.dumps(entry, default=str), 'levelno': logging.WARNING})
+    get_handler().handle(record)
+
+
+def record(connection, sql, params, many, elapsed):
+    modules = tuple(getattr(settings, 'SLOW_QUERY_MODULES', ['logic.views']))
+    view = view_of(metrics.current_request(), modules)
+    where = caller(modules)
+    if view is None and where is None:
+        return
+
+    key = fingerprint(sql)
+    count = seen(key)
+    if count is None:
+        return
+    entry = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'ms': round(elapsed * 1000, 1),
+        'fingerprint': key,
+        'view': view,
+        'caller': where,
+        'sql': sql,
+        'params': params_shape(params, many),
+        'many': many,
+        'seen': count,
+        'plan': None,
+    }
+    if getattr(settings, 'SLOW_QUERY_EXPLAIN', True) and not many:
+        entry['plan'] = explain(connection, sql, params)
+    try:
+        write(entry)
+    except OSError:
+        logger.warning("Could not write the slow query log", exc_info=True)
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    """Database execute wrapper; see the module docstring."""
+    threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+    if threshold is None or getattr(_state, 'busy', False):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    elapsed = time.perf_counter() - start
+    if elapsed * 1000 >= threshold:
+        record(context['connection'], sql, params, many, elapsed)
+    return result
+
+
+def install_query_hook(sender, connection, **kwargs):
+    if log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_queries)
@@ -0,0 +1,83 @@
+"""Post-checkout side effects, run by the outbox worker.
+
+Handlers raise (or return the error per message, for batch handlers) on
+failure so the outbox can retry them with backoff. Order emails are sent in
+batches over the worker's shared SMTP connection (logic/mail.py).
+"""
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from logic.mail import get_dispatcher
+from logic.models import User
+from logic.outbox import batch_handler
+
+
+def html_email(subject, html_message, recipient_list):
+    message = EmailMultiAlternatives(
+        subject=subject,
+        body=strip_tags(html_message),
+        from_email='solaradeveloper@gmail.com',
+        to=recipient_list,
+    )
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+def confirmation_email(user, order_id, items, total):
+    html_message = render_to_string('EMAILCONF.html', {
+        'user': user,
+        'order_id': order_id,
+        'items': items,
+        'total': total,
+        'site_url': 'https://fwaeh.cloud'
+    })
+    return html_email('Order Confirmation', html_message, [user.email])
+
+
+def admin_email(user, order_id, items, total):
+    html_message = render_to_string('EMAILADMIN.html', {
+        'user': user,
+        'order_id': order_id,
+        'items': items,
+        'total': total,
+        'customer_name': f"{user.first_name} {user.last_name}",
+        'customer_email': user.email,
+        'customer_phone': user.phone_number,
+        'shipping_address': f"{user.address}, {user.city}, {user.state} {user.zipcode}, {user.country}",
+    })
+    return html_email(f'New Order: {order_id}', html_message, ['solaradeveloper@gmail.com'])
+
+
+def send_batch(payloads, build, needs_email):
+    """Build one message per payload and send them together.
+
+    Payloads whose user is gone (or has no address, if ``needs_email``) are
+    dropped as done.
+    """
+    users = User.objects.in_bulk({p['user_id'] for p in payloads})
+    results = [None] * len(payloads)
+    pending = []
+    for i, payload in enumerate(payloads):
+        user = users.get(payload['user_id'])
+        if user is None or (needs_email and not user.email):
+            continue
+        try:
+            pending.append((i, build(user, payload['order_id'], payload['items'], payload['total'])))
+        except Exception as e:
+            results[i] = e
+
+    errors = get_dispatcher().send([message for _, message in pending])
+    for (i, _), error in zip(pending, errors):
+        results[i] = error
+    return results
+
+
+@batch_handler('order.confirmation_email')
+def handle_confirmation_emails(payloads):
+    return send_batch(payloads, confirmation_email, needs_email=True)
+
+
+@batch_handler('order.admin_email')
+def handle_admin_emails(payloads):
+    return send_batch(payloads, admin_email, needs_email=False)
@@ -0,0 +1,39 @@
+"""Test runner that keeps the tests away from the configured Redis.
+
+The tests flush rate limit keys, cached carts and whole cache databases, so
+they must never run against the Redis a dev box or server is using. Before
+any test module is imported (and so before any Redis client is built),
+REDIS_URL and every cache LOCATION are replaced by their TEST_REDIS entry,
+the way Django swaps in a test database.
+
+    TEST_RUNNER = 'logic.test_runner.RedisTestRunner'
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+def test_redis_settings():
+    """REDIS_URL and CACHES with every Redis location swapped for its TEST_REDIS one."""
+    test_redis = settings.TEST_REDIS
+    configured = {settings.REDIS_URL} | {cache['LOCATION'] for cache in settings.CACHES.values()}
+    clashes = configured & set(test_redis.values())
+    if clashes:
+        raise ImproperlyConfigured(f"TEST_REDIS reuses configured Redis locations: {', '.join(sorted(clashes))}")
+    caches = {
+        alias: {**cache, 'LOCATION': test_redis[alias]} if alias in test_redis else cache
+        for alias, cache in settings.CACHES.items()
+    }
+    return {'REDIS_URL': test_redis['REDIS_URL'], 'CACHES': caches}
+
+
+class RedisTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.redis_override = override_settings(**test_redis_settings())
+        self.redis_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.redis_override.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,14 +1,97 @@
 # logic/tests.py (for ecommerce project)
-from django.test import TestCase, Client
+from django.conf import settings as django_settings
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import Argon2PasswordHasher
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends import locmem
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
+from asgiref.sync import async_to_sync
+import asyncio
+import jwt
+import threading
+import time
+import importlib
 import json
+import os
+import pstats
+import re
+import smtplib
+import subprocess
+import sys
+import tempfile
+from unittest import skipUnless
 from unittest.mock import patch, Mock
-from logic.models import User, CartItem, Orders
+import redis
+import requests
+from pathlib import Path
+from urllib.parse import quote
+from logic.models import User, CartItem, Orders, OrderLine, OutboxMessage, Product
+from logic import (
+    bank, digest, hashers, history, ids, metrics, outbox, profiling, ratelimit, redis_client, slowqueries, views,
+)
+from logic import mail as mail_dispatch
+from logic.cache import TwoTierCache
+from logic.lazy import LazyModule, lazy_import
+from logic.cart import CartStore, cart_key
+from logic.sessions import SessionStore
+from logic.fakebank import FakeBank
 
 User = get_user_model()
 
 
+class CountingBackend(locmem.EmailBackend):
+    """locmem backend that counts connections and can drop or refuse sends"""
+    opened = 0
+    disconnect_next = False
+    refuse = set()
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        if CountingBackend.disconnect_next:
+            CountingBackend.disconnect_next = False
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        for message in messages:
+            if set(message.to) & CountingBackend.refuse:
+                raise smtplib.SMTPRecipientsRefused({r: (550, b'No such user') for r in message.to})
+        return super().send_messages(messages)
+
+
+def require_test_redis(location):
+    """Refuse to flush a Redis the test runner has not swapped for a test one"""
+    if location not in django_settings.TEST_REDIS.values():
+        raise RuntimeError(f"Not flushing {location}: run the tests with logic.test_runner.RedisTestRunner")
+
+
+def flush_rate_limits():
+    """Drop rate limit counters left in Redis by earlier tests"""
+    require_test_redis(views.r.url)
+    if views.r.healthy():
+        for key in views.r.scan_iter('rl:*'):
+            views.r.delete(key)
+
+
+def flush_cart_cache(user):
+    """Drop any cached cart left in Redis by an earlier run for this user id"""
+    require_test_redis(views.r.url)
+    if views.r.healthy():
+        views.r.delete(cart_key(user.id))
+
+
 class CartTestCase(TestCase):
     """Test cart functionality"""
 
@@ -19,14 +102,15 @@ class CartTestCase(TestCase):
             password='testpass123'
         )
         self.client.login(username='testuser', password='testpass123')
+        flush_cart_cache(self.user)
 
     def test_add_to_cart(self):
         """Test adding item to cart"""
         response = self.client.post(
-            '/addcart/',
+            '/api/addcart/',
             data=json.dumps({
-                'product': 'Test Product',
-                'price': '99.99'
+                'product': 'mouse',
+                'price': '0.01'
             }),
             content_type='application/json'
         )
@@ -35,32 +119,32 @@ class CartTestCase(TestCase):
         data = response.json()
         self.assertEqual(data['status'], 'success')
 
-        # Check item was added to database
+        # Check item was added to database at the catalog price
         cart_item = CartItem.objects.filter(user=self.user).first()
         self.assertIsNotNone(cart_item)
-        self.assertEqual(cart_item.item_id, 'Test Product')
-        self.assertEqual(cart_item.price, Decimal('99.99'))
+        self.assertEqual(cart_item.item_id, 'mouse')
+        self.assertEqual(cart_item.price, Decimal('79.00'))
 
-    def test_add_to_cart_invalid_price(self):
-        """Test adding item with invalid price fails"""
+    def test_add_to_cart_unknown_product(self):
+        """Test adding a product that is not in the catalog fails"""
         response = self.client.post(
-            '/addcart/',
+            '/api/addcart/',
             data=json.dumps({
                 'product': 'Test Product',
-                'price': 'invalid'
+                'price': '99.99'
             }),
             content_type='application/json'
         )
 
-        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
 
-    def test_add_to_cart_negative_price(self):
-        """Test adding item with negative price fails"""
+    def test_add_to_cart_missing_product(self):
+        """Test adding without a product id fails"""
         response = self.client.post(
-            '/addcart/',
+            '/api/addcart/',
             data=json.dumps({
-                'product': 'Test Product',
-                'price': '-50.00'
+                'price': '50.00'
             }),
             content_type='application/json'
         )
@@ -116,6 +200,20 @@ class CartTestCase(TestCase):
         self.assertEqual(data['total'], 100.0)
 
 
+CHECKOUT_FORM = {
+    'first_name': 'Test',
+    'last_name': 'Buyer',
+    'email': 'buyer@test.com',
+    'phone_number': '123456789',
+    'address': '123 Test St',
+    'city': 'Warsaw',
+    'state': 'Mazovia',
+    'zipcode': '00-000',
+    'country': 'Poland',
+}
+
+
+@override_settings(BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes')
 class CheckoutTestCase(TestCase):
     """Test checkout and payment flow"""
 
@@ -130,157 +228,79 @@ class CheckoutTestCase(TestCase):
             phone_number='123456789'
         )
         self.client.login(username='buyer', password='pass123')
+        flush_cart_cache(self.user)
+        bank.reset_client()
+        self.addCleanup(bank.reset_client)
 
         # Add items to cart
-        CartItem.objects.create(user=self.user, item_id='Product A', price=Decimal('50.00'))
-        CartItem.objects.create(user=self.user, item_id='Product B', price=Decimal('50.00'))
+        CartItem.objects.create(user=self.user, item_id='mouse', price=Decimal('79.00'))
+        CartItem.objects.create(user=self.user, item_id='keyboard', price=Decimal('149.00'))
 
-    @patch('logic.views.requests.post')
-    def test_successful_checkout(self, mock_post):
-        """Test successful checkout with valid payment"""
-        # Mock bank API response
-        mock_response = Mock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            'success': True,
-            'balance': 900.0,
-            'user_id': 1
-        }
-        mock_post.return_value = mock_response
-
-        response = self.client.post('/buy/', {
-            'first_name': 'Test',
-            'last_name': 'Buyer',
-            'email': 'buyer@test.com',
-            'phone_number': '123456789',
-            'Address': '123 Test St',
-            'city': 'Warsaw',
-            'state': 'Mazovia',
-            'zipcode': '00-000',
-            'country': 'Poland',
-            'Card': '1234567890123456'
-        })
+    def buy(self, fake_bank, **payment):
+        payment = {'Card': '1234567890123456', 'HoldName': 'Test Buyer', 'CVV': '123', **payment}
+        with override_settings(BANK_URL=fake_bank.url):
+            return self.client.post('/buy/', {**CHECKOUT_FORM, **payment})
+
+    def start_bank(self, **options):
+        fake_bank = FakeBank(**options).start()
+        self.addCleanup(fake_bank.stop)
+        return fake_bank
 
-        # Check redirect to confirmation page
+    def assertDeclined(self, response, message):
         self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/checkout/')
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)], [message])
+        self.assertEqual(Orders.objects.filter(user=self.user).count(), 0)
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_successful_checkout(self):
+        """Test successful checkout with valid payment"""
+        fake_bank = self.start_bank(balance=1000.0)
+
+        response = self.buy(fake_bank)
 
-        # Check order was created
-        order = Orders.objects.filter(user=self.user).first()
-        self.assertIsNotNone(order)
-        self.assertEqual(order.total, Decimal('100.00'))
+        order = Orders.objects.get(user=self.user)
+        self.assertRedirects(response, f'/conf/{quote(order.order_id)}/', fetch_redirect_response=False)
+        self.assertEqual(order.total, Decimal('228.00'))
         self.assertEqual(order.status, 'Paid')
+        self.assertEqual(fake_bank.requests[0][1]['cart_total'], 228.0)
+        self.assertEqual(fake_bank.balance, 772.0)
 
         # Check cart was cleared
         self.assertEqual(CartItem.objects.filter(user=self.user).count(), 0)
 
-    @patch('logic.views.requests.post')
-    def test_checkout_insufficient_funds(self, mock_post):
+    def test_checkout_insufficient_funds(self):
         """Test checkout fails with insufficient funds"""
-        # Mock bank API response for insufficient funds
-        mock_response = Mock()
-        mock_response.status_code = 400
-        mock_response.json.return_value = {
-            'success': False,
-            'error': 'Insufficient funds',
-            'balance': 10.0
-        }
-        mock_post.return_value = mock_response
-
-        response = self.client.post('/buy/', {
-            'first_name': 'Test',
-            'last_name': 'Buyer',
-            'email': 'buyer@test.com',
-            'phone_number': '123456789',
-            'Address': '123 Test St',
-            'city': 'Warsaw',
-            'state': 'Mazovia',
-            'zipcode': '00-000',
-            'country': 'Poland',
-            'Card': '1234567890123456'
-        })
+        fake_bank = self.start_bank(balance=10.0)
 
-        # Should redirect back to checkout
-        self.assertEqual(response.status_code, 302)
-
-        # No order should be created
-        self.assertEqual(Orders.objects.filter(user=self.user).count(), 0)
+        self.assertDeclined(self.buy(fake_bank), 'Insufficient funds')
+        self.assertEqual(fake_bank.balance, 10.0)
 
-        # Cart should still have items
-        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
-
-    @patch('logic.views.requests.post')
-    def test_checkout_invalid_card(self, mock_post):
+    def test_checkout_invalid_card(self):
         """Test checkout fails with invalid card"""
-        # Mock bank API response for invalid card
-        mock_response = Mock()
-        mock_response.status_code = 404
-        mock_response.json.return_value = {
-            'success': False,
-            'error': 'Invalid card number'
-        }
-        mock_post.return_value = mock_response
-
-        response = self.client.post('/buy/', {
-            'first_name': 'Test',
-            'last_name': 'Buyer',
-            'email': 'buyer@test.com',
-            'phone_number': '123456789',
-            'Address': '123 Test St',
-            'city': 'Warsaw',
-            'state': 'Mazovia',
-            'zipcode': '00-000',
-            'country': 'Poland',
-            'Card': '9999999999999999'
-        })
+        fake_bank = self.start_bank(balance=1000.0)
 
-        # Should redirect back to checkout
-        self.assertEqual(response.status_code, 302)
+        self.assertDeclined(self.buy(fake_bank, Card='999999999999999'), 'Invalid payment data')
 
-        # No order should be created
-        self.assertEqual(Orders.objects.filter(user=self.user).count(), 0)
+    def test_checkout_bank_error(self):
+        """Test checkout fails when the bank answers with a server error"""
+        fake_bank = self.start_bank(balance=1000.0, error_rate=1.0)
 
-    @patch('logic.views.requests.post')
-    def test_checkout_bank_service_down(self, mock_post):
-        """Test checkout handles bank service being unavailable"""
-        # Mock requests exception
-        mock_post.side_effect = Exception("Connection refused")
-
-        response = self.client.post('/buy/', {
-            'first_name': 'Test',
-            'last_name': 'Buyer',
-            'email': 'buyer@test.com',
-            'phone_number': '123456789',
-            'Address': '123 Test St',
-            'city': 'Warsaw',
-            'state': 'Mazovia',
-            'zipcode': '00-000',
-            'country': 'Poland',
-            'Card': '1234567890123456'
-        })
+        self.assertDeclined(self.buy(fake_bank), 'Bank service unavailable')
 
-        # Should redirect back to checkout
-        self.assertEqual(response.status_code, 302)
+    def test_checkout_bank_service_down(self):
+        """Test checkout handles bank service being unavailable"""
+        fake_bank = self.start_bank(balance=1000.0)
+        fake_bank.stop()
 
-        # No order should be created
-        self.assertEqual(Orders.objects.filter(user=self.user).count(), 0)
+        self.assertDeclined(self.buy(fake_bank), 'Could not connect to bank')
 
     def test_checkout_missing_card_number(self):
         """Test checkout fails without card number"""
-        response = self.client.post('/buy/', {
-            'first_name': 'Test',
-            'last_name': 'Buyer',
-            'email': 'buyer@test.com',
-            'phone_number': '123456789',
-            'Address': '123 Test St',
-            'city': 'Warsaw',
-            'state': 'Mazovia',
-            'zipcode': '00-000',
-            'country': 'Poland'
-            # No Card field
-        })
+        fake_bank = self.start_bank(balance=1000.0)
 
-        self.assertEqual(response.status_code, 302)
-        self.assertEqual(Orders.objects.filter(user=self.user).count(), 0)
+        self.assertDeclined(self.buy(fake_bank, Card=''), 'All payment data is required')
+        self.assertEqual(fake_bank.requests, [])
 
 
 class OrderTestCase(TestCase):
@@ -338,6 +358,7 @@ class AuthTestCase(TestCase):
 
     def setUp(self):
         self.client = Client()
+        flush_rate_limits()
 
     def test_register_user(self):
         """Test user registration"""
@@ -427,6 +448,467 @@ class AuthTestCase(TestCase):
         self.assertEqual(response.status_code, 302)  # Redirects to login
 
 
+class PasswordHashingTestCase(TestCase):
+    """Test the password hasher profile and off-thread login hashing"""
+
+    def setUp(self):
+        flush_rate_limits()
+        hashers.reset_pool()
+
+    def login(self, username, password):
+        return self.client.post(
+            '/login',
+            data=json.dumps({'username': username, 'password': password}),
+            content_type='application/json',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_new_passwords_use_tuned_argon2(self):
+        """Test new users are hashed with the profile's first hasher"""
+        user = User.objects.create_user(username='argonuser', password='pass123')
+
+        self.assertTrue(user.password.startswith('argon2$argon2id$v=19$m=19456,t=2,p=1$'))
+
+    def test_login_rehashes_old_hash(self):
+        """Test a PBKDF2 hash is upgraded on a successful login"""
+        with override_settings(PASSWORD_HASHERS=django_settings.PASSWORD_HASHER_PROFILES['pbkdf2']):
+            user = User.objects.create_user(username='olduser', password='pass123')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+        self.assertEqual(self.login('olduser', 'pass123').status_code, 200)
+
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('argon2$'))
+        self.assertTrue(user.check_password('pass123'))
+
+    def test_login_rehashes_stock_argon2_hash(self):
+        """Test a hash with Django's default Argon2 costs is verified and retuned"""
+        user = User.objects.create_user(username='stockuser')
+        user.password = Argon2PasswordHasher().encode('pass123', Argon2PasswordHasher().salt())
+        user.save()
+        self.assertIn('m=102400', user.password)
+
+        self.assertEqual(self.login('stockuser', 'pass123').status_code, 200)
+
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('argon2$argon2id$v=19$m=19456,t=2,p=1$'))
+
+    def test_pool_rejects_when_full(self):
+        """Test the hashing pool turns work away instead of queueing without limit"""
+        pool = hashers.HashPool(workers=1, queue_size=0)
+
+        async def two_at_once():
+            first = asyncio.ensure_future(pool.run(time.sleep, 0.2))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(hashers.PoolBusy):
+                await pool.run(time.sleep, 0)
+            await first
+
+        async_to_sync(two_at_once)()
+
+    def test_login_when_pool_is_busy(self):
+        """Test login answers 503 when the hashing queue is full"""
+        User.objects.create_user(username='busyuser', password='pass123')
+
+        with patch('logic.hashers.verify_password', side_effect=hashers.PoolBusy):
+            response = self.login('busyuser', 'pass123')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+@skipUnless(views.r.healthy(), 'Redis is required for rate limiting')
+class RateLimitTestCase(TestCase):
+    """Test the shared Redis rate limiter"""
+
+    def setUp(self):
+        flush_rate_limits()
+        self.limiter = ratelimit.RateLimiter(views.r)
+        self.request = RequestFactory().get('/')
+
+    def test_sliding_window(self):
+        """Test a sliding window allows N hits then reports when to retry"""
+        limit = ratelimit.RateLimit('t-sliding', '3/m')
+
+        results = [self.limiter.hit(self.request, limit) for _ in range(4)]
+
+        self.assertEqual([r.allowed for r in results], [True, True, True, False])
+        self.assertEqual(results[2].remaining, 0)
+        self.assertGreater(results[3].retry_after, 50)
+
+    def test_token_bucket(self):
+        """Test a token bucket allows a burst and then blocks"""
+        limit = ratelimit.RateLimit('t-bucket', '2/h', algorithm='bucket')
+
+        results = [self.limiter.hit(self.request, limit).allowed for _ in range(3)]
+
+        self.assertEqual(results, [True, True, False])
+
+    def test_peek_does_not_count(self):
+        """Test checking a limit without hitting it leaves it untouched"""
+        limit = ratelimit.RateLimit('t-peek', '1/m')
+
+        self.assertFalse(self.limiter.blocked(self.request, limit))
+        self.assertFalse(self.limiter.blocked(self.request, limit))
+        self.limiter.hit(self.request, limit)
+        self.assertTrue(self.limiter.blocked(self.request, limit))
+
+    def test_without_redis_allows(self):
+        """Test requests are let through when Redis is unavailable"""
+        limit = ratelimit.RateLimit('t-none', '1/m')
+        limiter = ratelimit.RateLimiter(None)
+
+        self.assertTrue(all(limiter.hit(self.request, limit).allowed for _ in range(3)))
+
+    @override_settings(RATELIMIT_ENABLED=False)
+    def test_disabled_allows(self):
+        """Test every hit is allowed while rate limiting is turned off"""
+        limit = ratelimit.RateLimit('t-off', '1/m')
+
+        self.assertTrue(all(self.limiter.hit(self.request, limit).allowed for _ in range(3)))
+
+    def test_login_failures_block_login(self):
+        """Test two failed logins block the next attempt from the same IP"""
+        User.objects.create_user(username='limited', password='correctpass')
+
+        def attempt(password):
+            return self.client.post(
+                '/login',
+                data=json.dumps({'username': 'limited', 'password': password}),
+                content_type='application/json',
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+
+        self.assertEqual(attempt('wrong').status_code, 401)
+        self.assertEqual(attempt('wrong').status_code, 401)
+        self.assertEqual(attempt('correctpass').status_code, 429)
+
+    @override_settings(RATELIMIT_RULES=[{'path': '/api/checkout/', 'name': 't-mw', 'rate': '2/m'}])
+    def test_middleware_rules(self):
+        """Test the middleware limits paths matching a rule"""
+        client = Client()
+        statuses = [client.get('/api/checkout/').status_code for _ in range(3)]
+
+        self.assertEqual(statuses[2], 429)
+        self.assertNotEqual(statuses[1], 429)
+        self.assertEqual(client.get('/login').status_code, 200)
+
+    def test_decorator_on_async_view(self):
+        """Test the decorator wraps async views"""
+        @ratelimit.ratelimit('t-async', '1/m')
+        async def view(request):
+            return JsonResponse({'status': 'success'})
+
+        self.assertEqual(async_to_sync(view)(self.request).status_code, 200)
+        response = async_to_sync(view)(self.request)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+
+class RedisClientTestCase(TestCase):
+    """Test the lazily connected Redis client"""
+
+    def client_with(self, **commands):
+        client = redis_client.RedisClient(django_settings.REDIS_URL, retry_interval=60)
+        client._client = Mock(**commands)
+        return client
+
+    def test_import_makes_no_connection(self):
+        """Test importing the views does not open a socket"""
+        code = (
+            "import socket\n"
+            "def refuse(*args, **kwargs): raise AssertionError('connected at import')\n"
+            "socket.socket.connect = refuse\n"
+            "socket.create_connection = refuse\n"
+            "import django; django.setup()\n"
+            "import logic.views\n"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=os.environ)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_marked_down_after_connection_error(self):
+        """Test a failed command makes the client falsy without further calls"""
+        client = self.client_with(**{'get.side_effect': redis.ConnectionError})
+
+        with self.assertLogs('logic.redis_client', 'WARNING'), self.assertRaises(redis.ConnectionError):
+            client.get('key')
+        self.assertFalse(client)
+        with self.assertRaises(redis.ConnectionError):
+            client.get('key')
+        self.assertEqual(client._client.get.call_count, 1)
+        self.assertFalse(client.healthy())
+
+    def test_reenabled_after_retry_interval(self):
+        """Test the client tries Redis again once the interval has passed"""
+        client = self.client_with(**{'get.side_effect': [redis.ConnectionError, b'1']})
+        with self.assertLogs('logic.redis_client', 'WARNING'), self.assertRaises(redis.ConnectionError):
+            client.get('key')
+
+        client.down_until = time.monotonic() - 1
+        self.assertTrue(client)
+        self.assertEqual(client.get('key'), b'1')
+        self.assertEqual(client.stats(), {'failures': 1, 'recoveries': 1, 'available': True})
+
+    def test_command_errors_keep_client_up(self):
+        """Test errors other than connection failures do not mark Redis down"""
+        client = self.client_with(**{'incr.side_effect': redis.ResponseError})
+
+        with self.assertRaises(redis.ResponseError):
+            client.incr('key')
+        self.assertTrue(client)
+
+    def test_rate_limiter_allows_while_down(self):
+        """Test rate limits are skipped, not broken, while Redis is down"""
+        client = redis_client.RedisClient(django_settings.REDIS_URL, retry_interval=60)
+        limiter = ratelimit.RateLimiter(client)
+        limit = ratelimit.RateLimit('t-down', '1/m')
+        request = RequestFactory().get('/')
+
+        with patch.object(client.client, 'evalsha', side_effect=redis.ConnectionError) as evalsha, \
+                self.assertLogs('logic', 'WARNING'):
+            self.assertTrue(limiter.hit(request, limit).allowed)
+            self.assertTrue(limiter.hit(request, limit).allowed)
+        self.assertEqual(evalsha.call_count, 1)
+
+
+class LazyImportTestCase(TestCase):
+    """Test slow dependencies are imported on first use"""
+
+    def test_views_import_defers_heavy_modules(self):
+        """Test importing the views loads none of the deferred modules"""
+        code = (
+            "import sys\n"
+            "import django; django.setup()\n"
+            "import logic.views\n"
+            "print(' '.join(m for m in ('redis', 'httpx', 'requests', 'jwt') if m in sys.modules))\n"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=os.environ)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_lazy_module_imports_on_attribute_access(self):
+        """Test a lazy module resolves attributes from the real module"""
+        module = LazyModule('json')
+
+        self.assertIs(module.loads, json.loads)
+        self.assertIs(lazy_import('json'), json)
+
+
+@skipUnless(views.r.healthy(), 'Redis is required for the shared cache tier')
+class TwoTierCacheTestCase(TestCase):
+    """Test the in-process + Redis cache backend"""
+
+    def make_cache(self, location=None, **options):
+        options = {'L1_TTL': 30, 'VERSION_CHECK_INTERVAL': 0, **options}
+        return TwoTierCache(location or django_settings.CACHES['default']['LOCATION'], {
+            'KEY_PREFIX': 'test', 'OPTIONS': options,
+        })
+
+    def setUp(self):
+        self.worker_a = self.make_cache()
+        self.worker_b = self.make_cache()
+        require_test_redis(django_settings.CACHES['default']['LOCATION'])
+        self.worker_a.clear()
+
+    def test_default_cache_is_two_tier(self):
+        """Test the project's default cache is the two-tier backend"""
+        self.assertIsInstance(caches['default'], TwoTierCache)
+
+    def test_second_read_is_served_locally(self):
+        """Test a value read from Redis is then served from the local tier"""
+        self.worker_a.set('greeting', {'hello': 'world'})
+
+        self.assertEqual(self.worker_b.get('greeting'), {'hello': 'world'})
+        self.assertEqual(self.worker_b.get('greeting'), {'hello': 'world'})
+
+        stats = self.worker_b.stats()
+        self.assertEqual(stats['l2_hits'], 1)
+        self.assertEqual(stats['l1_hits'], 1)
+
+    def test_write_invalidates_other_workers(self):
+        """Test a write in one worker evicts the stale copy in another"""
+        self.worker_a.set('price', 1)
+        self.assertEqual(self.worker_b.get('price'), 1)
+
+        self.worker_a.set('price', 2)
+        self.assertEqual(self.worker_b.get('price'), 2)
+
+        self.worker_a.delete('price')
+        self.assertIsNone(self.worker_b.get('price'))
+
+    def test_local_tier_is_bounded(self):
+        """Test the local tier drops the least recently used entries"""
+        cache = self.make_cache(L1_MAX_ENTRIES=2)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+
+        self.assertEqual(cache.stats()['l1_entries'], 2)
+        self.assertEqual(cache.stats()['l1_evictions'], 1)
+        self.assertEqual(cache.get('a'), 'a')
+
+    def test_get_or_set_is_single_flight(self):
+        """Test concurrent misses compute the value once"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'computed'
+
+        workers = [self.make_cache() for _ in range(4)]
+        threads = [
+            threading.Thread(target=lambda c=c: results.append(c.get_or_set('expensive', compute)))
+            for c in workers
+        ]
+        results = []
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, ['computed'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_redis_down_falls_back_to_local(self):
+        """Test the cache keeps working locally when Redis is unreachable"""
+        cache = self.make_cache('redis://127.0.0.1:1/0')
+        cache.set('key', 'value')
+
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertIsNone(cache.get('other'))
+        self.assertGreater(cache.stats()['errors'], 0)
+
+    def test_incr_with_redis_down_is_counted(self):
+        """Test incr drops the local copy and raises ValueError when Redis is unreachable"""
+        cache = self.make_cache('redis://127.0.0.1:1/0')
+        cache.set('hits', 1)
+
+        with self.assertRaises(ValueError):
+            cache.incr('hits')
+        self.assertIsNone(cache.get('hits'))
+        self.assertGreater(cache.stats()['errors'], 1)
+
+    def test_redis_socket_timeouts_default(self):
+        """Test Redis calls time out by default rather than hang"""
+        options = self.make_cache().l2._options
+
+        self.assertEqual(options['socket_connect_timeout'], 1)
+        self.assertEqual(options['socket_timeout'], 1)
+
+
+@skipUnless(views.r.healthy(), 'Redis is required for the session store')
+class SessionStoreTestCase(TestCase):
+    """Test the Redis session engine and its database fallback"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sessionuser', password='pass123')
+
+    def test_requests_do_not_touch_session_table(self):
+        """Test an authenticated request reads its session from Redis"""
+        self.client.login(username='sessionuser', password='pass123')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/orders/')
+
+        self.assertFalse([q for q in ctx.captured_queries if 'django_session' in q['sql']])
+        self.assertFalse(DBSessionStore.get_model_class().objects.exists())
+
+    def test_unchanged_session_is_not_saved(self):
+        """Test re-assigning an unchanged value does not write the session"""
+        store = SessionStore()
+        store['cart_seen'] = True
+        store.save()
+
+        store = SessionStore(store.session_key)
+        store['cart_seen'] = True
+        with patch.object(store._cache, 'set') as cache_set:
+            store.save()
+        cache_set.assert_not_called()
+
+        store['cart_seen'] = False
+        store.save()
+        self.assertFalse(SessionStore(store.session_key)['cart_seen'])
+
+    def test_falls_back_to_database(self):
+        """Test sessions are kept in the database while Redis is down"""
+        down = {**django_settings.CACHES, 'sessions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://127.0.0.1:1/0',
+        }}
+        with override_settings(CACHES=down):
+            store = SessionStore()
+            store['user'] = 'sessionuser'
+            store.save()
+            self.assertTrue(DBSessionStore().exists(store.session_key))
+            self.assertEqual(SessionStore(store.session_key)['user'], 'sessionuser')
+
+        # Back in Redis on the next save.
+        store = SessionStore(store.session_key)
+        store['user'] = 'moved'
+        store.save()
+        self.assertIsNotNone(caches['sessions'].get(store.cache_key))
+        self.assertFalse(DBSessionStore().exists(store.session_key))
+
+    def test_logout_after_outage_stays_logged_out(self):
+        """Test a session written during an outage is gone after recovery and logout"""
+        down = {**django_settings.CACHES, 'sessions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://127.0.0.1:1/0',
+        }}
+        with override_settings(CACHES=down):
+            store = SessionStore()
+            store['user'] = 'sessionuser'
+            store.save()
+        session_key = store.session_key
+
+        # Redis is back: the session moves there, then the user logs out.
+        store = SessionStore(session_key)
+        store['user'] = 'moved'
+        store.save()
+        SessionStore(session_key).delete()
+
+        self.assertEqual(SessionStore(session_key).load(), {})
+        self.assertFalse(DBSessionStore().exists(session_key))
+
+    def test_outage_skips_redis_until_retry(self):
+        """Test only the first request of an outage waits on Redis"""
+        down = {**django_settings.CACHES, 'sessions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://127.0.0.1:1/0',
+        }}
+        with override_settings(CACHES=down, REDIS_RETRY_INTERVAL=60):
+            redis_client.get_client('redis://127.0.0.1:1/0').down_until = 0
+            store = SessionStore()
+            store['user'] = 'sessionuser'
+            store.save()
+
+            store = SessionStore(store.session_key)
+            with patch.object(store._cache, 'get') as cache_get, patch.object(store._cache, 'set') as cache_set:
+                store['user'] = 'changed'
+                store.save()
+                self.assertEqual(SessionStore(store.session_key)['user'], 'changed')
+            cache_get.assert_not_called()
+            cache_set.assert_not_called()
+
+    def test_logout_while_down_removes_redis_copy(self):
+        """Test a session deleted while Redis is marked down is deleted there on recovery"""
+        store = SessionStore()
+        store['user'] = 'sessionuser'
+        store.save()
+        health = store.health
+        self.addCleanup(setattr, health, 'down_until', 0)
+
+        health.down_until = time.monotonic() + 60
+        SessionStore(store.session_key).delete()
+        self.assertIsNotNone(caches['sessions'].get(store.cache_key))
+
+        health.down_until = time.monotonic() - 1
+        self.assertEqual(SessionStore(store.session_key).load(), {})
+        self.assertIsNone(caches['sessions'].get(store.cache_key))
+
+
 class UserSettingsTestCase(TestCase):
     """Test user settings and profile updates"""
 
@@ -463,4 +945,1549 @@ class UserSettingsTestCase(TestCase):
         response = self.client.post('/delacc/')
 
         # User should be deleted
-        self.assertFalse(User.objects.filter(username='settingsuser').exists())
\ No newline at end of file
+        self.assertFalse(User.objects.filter(username='settingsuser').exists())
+
+
+class MetricsTestCase(TestCase):
+    """Test the request metrics and the /metrics endpoint"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        override = override_settings(METRICS_DIR=self.dir, METRICS_TOKEN='scrape-secret')
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.reset_registry()
+        # No breaker in this process unless a test makes one.
+        bank.reset_client()
+        self.addCleanup(bank.reset_client)
+
+    def scrape(self, **headers):
+        return self.client.get('/metrics', **{'HTTP_AUTHORIZATION': 'Bearer scrape-secret', **headers})
+
+    def test_request_recorded_per_view(self):
+        """Test a request is counted under its URL name with its queries"""
+        self.client.get('/')
+
+        body = self.scrape().content.decode()
+        self.assertIn('http_requests_total{view="home",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{view="home"} 1', body)
+        self.assertIn('db_queries_per_request_count{view="home"} 1', body)
+        self.assertNotIn('view="metrics"', body)
+
+    def write_worker(self, pid, started, requests, circuit='closed'):
+        snapshot = [
+            ['http_requests_total', [['view', 'home'], ['method', 'GET'], ['status', '200']], requests],
+            ['bank_circuit_state', [['state', circuit]], 1],
+        ]
+        with open(os.path.join(self.dir, f'{pid}-{started}.json'), 'w') as f:
+            json.dump(snapshot, f)
+
+    def exited_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def test_workers_are_added_up(self):
+        """Test the endpoint sums the files written by every worker"""
+        self.client.get('/')
+        self.write_worker(os.getppid(), 1, 4)
+
+        body = self.scrape().content.decode()
+        self.assertIn('http_requests_total{view="home",method="GET",status="200"} 5', body)
+        self.assertIn('bank_circuit_state{state="closed"} 1', body)
+
+    def test_exited_workers_are_folded(self):
+        """Test an exited worker's counters are kept and its gauges dropped"""
+        self.client.get('/')
+        self.write_worker(self.exited_pid(), 1, 4, circuit='open')
+
+        for _ in range(2):
+            body = self.scrape().content.decode()
+            self.assertIn('http_requests_total{view="home",method="GET",status="200"} 5', body)
+            self.assertNotIn('bank_circuit_state{state="open"}', body)
+        self.assertEqual(
+            sorted(os.listdir(self.dir)), sorted(['.lock', 'exited.json', metrics._registry.file_name]),
+        )
+
+    def test_reused_pid_does_not_overwrite_counts(self):
+        """Test a new worker reusing a pid keeps the old worker's counts"""
+        self.write_worker(os.getppid(), 1, 3, circuit='open')
+        self.write_worker(os.getppid(), 2, 4)
+
+        body = self.scrape().content.decode()
+        self.assertIn('http_requests_total{view="home",method="GET",status="200"} 7', body)
+        self.assertNotIn('bank_circuit_state{state="open"}', body)
+        self.assertIn('bank_circuit_state{state="closed"} 1', body)
+
+    def test_queries_and_external_calls_attributed_to_view(self):
+        """Test queries and outbound calls made by a view are labelled with it"""
+        def view(request):
+            list(User.objects.all())
+            metrics.external_call('bank', 0.2)
+            metrics.external_call('smtp', 0.03, error=True)
+            return JsonResponse({'status': 'success'})
+
+        request = RequestFactory().post('/buy/')
+        request.resolver_match = Mock(view_name='buy')
+        metrics.MetricsMiddleware(view)(request)
+
+        totals = metrics.collect()
+        self.assertEqual(totals[('db_queries_total', (('view', 'buy'),))], 1)
+        bank_latency = totals[('external_call_duration_seconds', (('service', 'bank'), ('view', 'buy')))]
+        self.assertEqual(sum(bank_latency[:-1]), 1)
+        self.assertAlmostEqual(bank_latency[-1], 0.2)
+        self.assertEqual(totals[('external_call_errors_total', (('service', 'smtp'), ('view', 'buy')))], 1)
+
+    def test_histogram_format(self):
+        """Test histogram buckets are cumulative and end with +Inf"""
+        registry = metrics.Registry()
+        for seconds in (0.003, 0.2, 20):
+            registry.observe('http_request_duration_seconds', (('view', 'conf'),), seconds)
+
+        body = metrics.render(metrics.merge([registry.snapshot()]))
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="conf",le="0.005"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="conf",le="0.25"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="conf",le="+Inf"} 3', body)
+        self.assertIn('http_request_duration_seconds_count{view="conf"} 3', body)
+
+    def test_bank_token_and_circuit_exported(self):
+        """Test the bank JWT mints and the circuit breaker state are on /metrics"""
+        with override_settings(BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes', BANK_BREAKER_THRESHOLD=1):
+            client = bank.get_client()
+            client.token.get()
+            client.token.get()
+            client.breaker.record_failure()
+
+        body = self.scrape().content.decode()
+        self.assertIn('# TYPE bank_token_mints_total counter', body)
+        self.assertIn('bank_token_mints_total 1', body)
+        self.assertIn('# TYPE bank_circuit_state gauge', body)
+        self.assertIn('bank_circuit_state{state="open"} 1', body)
+        self.assertIn('bank_circuit_state{state="closed"} 0', body)
+
+    def test_token_required(self):
+        """Test scrapes must send the configured bearer token"""
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.scrape().status_code, 200)
+
+    def test_no_token_hides_endpoint_unless_debug(self):
+        """Test the endpoint fails closed when no token is configured"""
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class ProfilingTestCase(TestCase):
+    """Test the opt-in request profiler"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        override = override_settings(PROFILE_DIR=self.dir, PROFILE_SAMPLE_RATE=0, PROFILE_INTERVAL=0.001)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def profiles(self):
+        return sorted(os.listdir(self.dir))
+
+    def test_signed_header_profiles_request(self):
+        """Test a valid X-Profile header writes a collapsed-stack file"""
+        response = self.client.get('/', HTTP_X_PROFILE=profiling.make_token())
+
+        name = response['X-Profile-File']
+        self.assertEqual(self.profiles(), [name])
+        self.assertRegex(name, r'-home-\d+ms-\d+\.collapsed$')
+        with open(os.path.join(self.dir, name)) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(all(re.match(r'^\S.*;.* \d+$', line) for line in lines))
+
+    def test_bad_token_ignored(self):
+        """Test a forged header does not trigger profiling"""
+        response = self.client.get('/', HTTP_X_PROFILE='ops:forged:signature')
+
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(self.profiles(), [])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_PATHS=['/api/checkout/'])
+    def test_sampling_limited_to_paths(self):
+        """Test sampling only picks requests under PROFILE_PATHS"""
+        self.client.get('/')
+        self.assertEqual(self.profiles(), [])
+
+        response = self.client.get('/api/checkout/')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(len(self.profiles()), 1)
+
+    @override_settings(PROFILE_MODE='cprofile')
+    def test_cprofile_mode(self):
+        """Test the deterministic profiler writes a pstats file"""
+        response = self.client.get('/', HTTP_X_PROFILE=profiling.make_token())
+
+        stats = pstats.Stats(os.path.join(self.dir, response['X-Profile-File']))
+        self.assertTrue(stats.total_calls > 0)
+
+    def test_unwritable_profile_dir_does_not_fail_request(self):
+        """Test a profile that cannot be saved is logged and the response still served"""
+        blocker = os.path.join(self.dir, 'not-a-directory')
+        open(blocker, 'w').close()
+
+        with override_settings(PROFILE_DIR=os.path.join(blocker, 'profiles')), \
+                self.assertLogs('logic.profiling', 'WARNING'):
+            response = self.client.get('/', HTTP_X_PROFILE=profiling.make_token())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-File', response)
+
+    @override_settings(PROFILE_MAX_FILES=2)
+    def test_old_profiles_pruned(self):
+        """Test the oldest files are removed beyond PROFILE_MAX_FILES"""
+        for i in range(3):
+            path = os.path.join(self.dir, f"old-{i}.collapsed")
+            with open(path, 'w') as f:
+                f.write('a;b 1\n')
+            os.utime(path, (i, i))
+
+        profiling.prune(Path(self.dir))
+        self.assertEqual(self.profiles(), ['old-1.collapsed', 'old-2.collapsed'])
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test the slow query log"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.log = os.path.join(tmp.name, 'slow.jsonl')
+        override = override_settings(
+            SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG=self.log, SLOW_QUERY_DEDUP_WINDOW=300,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        slowqueries.reset()
+        self.addCleanup(slowqueries.reset)
+        self.user = User.objects.create_user(username='slowuser', password='pass123', email='slow@test.com')
+        Orders.objects.create(user=self.user, total=Decimal('10.00'))
+
+    def entries(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return [json.loads(line) for line in f]
+
+    def test_view_queries_logged_with_plan(self):
+        """Test queries run for a view are logged with their plan and no values"""
+        self.client.force_login(self.user)
+        self.client.get('/')
+
+        entries = [e for e in self.entries() if e['view'] == 'home']
+        self.assertTrue(entries)
+        orders = next(e for e in entries if 'logic_orders' in e['sql'])
+        self.assertTrue(orders['plan'])
+        self.assertIn('int', orders['params'])
+        self.assertNotIn(str(self.user.id), json.dumps(orders['params']))
+        self.assertRegex(orders['caller'] or '', r'^logic\.views\.')
+
+    def test_repeats_deduplicated(self):
+        """Test a fingerprint is logged once per window"""
+        self.client.force_login(self.user)
+        self.client.get('/')
+        self.client.get('/')
+
+        fingerprints = [e['fingerprint'] for e in self.entries()]
+        self.assertTrue(fingerprints)
+        self.assertEqual(len(fingerprints), len(set(fingerprints)))
+
+    def test_queries_outside_views_ignored(self):
+        """Test queries not made by the views are not logged"""
+        list(Orders.objects.filter(user=self.user))
+
+        self.assertEqual(self.entries(), [])
+
+    @override_settings(METRICS_DIR=None)
+    def test_explain_not_counted_as_view_query(self):
+        """Test the EXPLAIN run for the log is not counted as one of the view's queries"""
+        self.client.force_login(self.user)
+        self.client.get('/')
+
+        def home_queries(threshold):
+            metrics.reset_registry()
+            slowqueries.reset()
+            with override_settings(SLOW_QUERY_THRESHOLD_MS=threshold):
+                self.client.get('/')
+            return metrics.collect()[('db_queries_total', (('view', 'home'),))]
+
+        self.assertEqual(home_queries(0), home_queries(None))
+        self.assertTrue([e for e in self.entries() if e['view'] == 'home' and e['plan']])
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=None)
+    def test_no_threshold_turns_log_off(self):
+        """Test nothing is logged when the threshold is unset"""
+        self.client.force_login(self.user)
+        self.client.get('/')
+
+        self.assertEqual(self.entries(), [])
+
+    def test_fingerprint_ignores_literals_and_list_length(self):
+        """Test queries differing only in literals share a fingerprint"""
+        self.assertEqual(
+            slowqueries.fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND n = 5"),
+            slowqueries.fingerprint("SELECT *  FROM t WHERE id IN (%s, %s, %s) AND n = 7"),
+        )
+        self.assertNotEqual(
+            slowqueries.fingerprint("SELECT * FROM t WHERE id = %s"),
+            slowqueries.fingerprint("SELECT * FROM u WHERE id = %s"),
+        )
+
+
+class OutboxTestCase(TestCase):
+    """Test post-checkout side effects go through the outbox"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='outboxuser',
+            password='pass123',
+            email='outbox@test.com'
+        )
+        self.client.login(username='outboxuser', password='pass123')
+        flush_cart_cache(self.user)
+        bank.reset_client()
+        CartItem.objects.create(user=self.user, item_id='mouse', price=Decimal('79.00'))
+
+    @patch('logic.bank.generate_jwt_token', return_value='token')
+    def test_checkout_enqueues_side_effects(self, mock_token):
+        """Test checkout records emails and history sync instead of sending them"""
+        fake_bank = FakeBank().start()
+        self.addCleanup(fake_bank.stop)
+
+        with override_settings(BANK_URL=fake_bank.url):
+            response = self.client.post('/buy/', {
+                'first_name': 'Test',
+                'last_name': 'Buyer',
+                'email': 'outbox@test.com',
+                'phone_number': '123456789',
+                'address': '123 Test St',
+                'city': 'Warsaw',
+                'state': 'Mazovia',
+                'zipcode': '00-000',
+                'country': 'Poland',
+                'Card': '1234567890123456',
+                'HoldName': 'Test Buyer',
+                'CVV': '123'
+            })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(fake_bank.requests), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+        topics = sorted(OutboxMessage.objects.values_list('topic', flat=True))
+        self.assertEqual(topics, [
+            'order.admin_digest', 'order.bank_history', 'order.confirmation_email'
+        ])
+        history_payload = OutboxMessage.objects.get(topic='order.bank_history').payload
+        self.assertEqual(history_payload['card_last4'], '3456')
+        self.assertNotIn('1234567890123456', json.dumps(history_payload))
+
+    @patch('logic.bank.requests.Session.post')
+    def test_drain_delivers_messages(self, mock_post):
+        """Test the worker sends queued emails and leaves history to the batch sender"""
+        payload = {'user_id': self.user.id, 'order_id': '#ABC', 'items': 'Wireless Mouse x1', 'total': '79.00'}
+        outbox.enqueue('order.confirmation_email', payload)
+        outbox.enqueue('order.admin_email', payload)
+        outbox.enqueue('order.bank_history', {**payload, 'status': 'Paid', 'card_last4': '1234'})
+
+        self.assertEqual(outbox.drain(), 2)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mock_post.call_count, 0)
+        self.assertEqual(OutboxMessage.objects.filter(status='Done').count(), 2)
+
+    def test_purge_deletes_old_delivered_messages(self):
+        """Test only delivered messages past the retention period are deleted"""
+        old_done = outbox.enqueue('order.confirmation_email', {})
+        old_pending = outbox.enqueue('order.confirmation_email', {})
+        recent_done = outbox.enqueue('order.confirmation_email', {})
+        OutboxMessage.objects.filter(id__in=[old_done.id, recent_done.id]).update(status='Done')
+        OutboxMessage.objects.filter(id__in=[old_done.id, old_pending.id]).update(
+            created_at=timezone.now() - timedelta(days=8)
+        )
+
+        with self.settings(OUTBOX_RETENTION_DAYS=7):
+            self.assertEqual(outbox.purge(batch_size=1), 1)
+
+        self.assertEqual(
+            sorted(OutboxMessage.objects.values_list('id', flat=True)), [old_pending.id, recent_done.id]
+        )
+
+    def test_failed_message_is_retried_with_backoff(self):
+        """Test a failing handler is rescheduled and eventually marked failed"""
+        message = outbox.enqueue('unknown.topic', {})
+
+        outbox.drain()
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'Pending')
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.available_at, timezone.now())
+        self.assertEqual(outbox.drain(), 0)
+
+        with self.settings(OUTBOX_MAX_ATTEMPTS=2):
+            OutboxMessage.objects.filter(id=message.id).update(available_at=timezone.now())
+            outbox.drain()
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'Failed')
+
+
+@override_settings(EMAIL_BACKEND='logic.tests.CountingBackend')
+class MailDispatcherTestCase(TestCase):
+    """Test order emails share one SMTP connection and are sent in batches"""
+
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.disconnect_next = False
+        CountingBackend.refuse = set()
+        mail_dispatch.reset_dispatcher()
+        self.addCleanup(mail_dispatch.reset_dispatcher)
+
+    def message(self, to='buyer@test.com'):
+        return EmailMessage('Order', 'Thanks', 'shop@test.com', [to])
+
+    def test_batch_uses_one_connection(self):
+        """Test consecutive sends reuse the open connection"""
+        dispatcher = mail_dispatch.MailDispatcher()
+
+        self.assertEqual(dispatcher.send([self.message() for _ in range(5)]), [None] * 5)
+        dispatcher.send([self.message()])
+
+        self.assertEqual(len(mail.outbox), 6)
+        self.assertEqual(CountingBackend.opened, 1)
+
+    def test_idle_connection_is_reopened(self):
+        """Test a connection idle past the timeout is replaced"""
+        dispatcher = mail_dispatch.MailDispatcher(idle_timeout=0)
+        dispatcher.send([self.message()])
+        time.sleep(0.01)
+        dispatcher.send([self.message()])
+
+        self.assertEqual(CountingBackend.opened, 2)
+
+    def test_reconnects_after_disconnect(self):
+        """Test a dropped connection is reopened and the message resent"""
+        dispatcher = mail_dispatch.MailDispatcher()
+        CountingBackend.disconnect_next = True
+
+        self.assertEqual(dispatcher.send([self.message()]), [None])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(dispatcher.stats()['reconnects'], 1)
+
+    def test_refused_message_does_not_fail_batch(self):
+        """Test one refused recipient only fails its own message"""
+        dispatcher = mail_dispatch.MailDispatcher()
+        CountingBackend.refuse = {'bad@test.com'}
+
+        results = dispatcher.send([self.message(), self.message('bad@test.com'), self.message()])
+
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], smtplib.SMTPRecipientsRefused)
+        self.assertIsNone(results[2])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_drain_sends_order_emails_on_one_connection(self):
+        """Test the outbox sends a batch of order emails over one connection"""
+        user = User.objects.create_user(username='mailuser', password='pass123', email='mail@test.com')
+        for i in range(3):
+            payload = {'user_id': user.id, 'order_id': f'#M{i}', 'items': 'Wireless Mouse x1', 'total': '79.00'}
+            outbox.enqueue('order.confirmation_email', payload)
+            outbox.enqueue('order.admin_email', payload)
+
+        self.assertEqual(outbox.drain(), 6)
+
+        self.assertEqual(len(mail.outbox), 6)
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(OutboxMessage.objects.filter(status='Done').count(), 6)
+
+    def test_drain_retries_only_failed_emails(self):
+        """Test a refused email is rescheduled while the rest are done"""
+        good = User.objects.create_user(username='gooduser', password='pass123', email='good@test.com')
+        bad = User.objects.create_user(username='baduser', password='pass123', email='bad@test.com')
+        CountingBackend.refuse = {'bad@test.com'}
+        for user in (good, bad):
+            outbox.enqueue('order.confirmation_email', {
+                'user_id': user.id, 'order_id': f'#{user.username}', 'items': 'Wireless Mouse x1', 'total': '79.00',
+            })
+
+        outbox.drain()
+
+        statuses = dict(OutboxMessage.objects.values_list('payload__user_id', 'status'))
+        self.assertEqual(statuses, {good.id: 'Done', bad.id: 'Pending'})
+
+
+@override_settings(ADMIN_DIGEST_WINDOW=900, ADMIN_IMMEDIATE_TOTAL=1000, HISTORY_SETTLE_SECONDS=5)
+class AdminDigestTestCase(TestCase):
+    """Test admin order emails are grouped into a periodic digest"""
+
+    def setUp(self):
+        mail_dispatch.reset_dispatcher()
+        self.addCleanup(mail_dispatch.reset_dispatcher)
+        self.user = User.objects.create_user(
+            username='digestuser', password='pass123', email='digest@test.com',
+            first_name='Dana', city='Warsaw', country='Poland'
+        )
+
+    def enqueue(self, count, age):
+        messages = [
+            outbox.enqueue(digest.TOPIC, {
+                'user_id': self.user.id, 'order_id': f'#D{i}', 'items': 'Wireless Mouse x1', 'total': '79.00',
+            })
+            for i in range(count)
+        ]
+        OutboxMessage.objects.filter(id__in=[m.id for m in messages]).update(
+            created_at=timezone.now() - timedelta(seconds=age)
+        )
+
+    def test_topic_for(self):
+        """Test only orders under the threshold go to the digest"""
+        self.assertEqual(digest.topic_for(Decimal('79.00')), digest.TOPIC)
+        self.assertEqual(digest.topic_for(Decimal('1000.00')), 'order.admin_email')
+        with self.settings(ADMIN_DIGEST_WINDOW=0):
+            self.assertEqual(digest.topic_for(Decimal('79.00')), 'order.admin_email')
+
+    def test_digest_waits_for_window(self):
+        """Test no digest is sent before the oldest order has waited a window"""
+        self.enqueue(3, age=60)
+
+        self.assertEqual(digest.flush(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_digest_summarises_orders_in_one_email(self):
+        """Test every waiting order goes into a single email"""
+        self.enqueue(25, age=1000)
+
+        self.assertEqual(digest.flush(), 25)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Order digest: 25 new orders')
+        html = mail.outbox[0].alternatives[0][0]
+        self.assertIn('#D24', html)
+        self.assertIn('$1975.00', html)
+        self.assertEqual(OutboxMessage.objects.filter(status='Done').count(), 25)
+        self.assertEqual(digest.flush(force=True), 0)
+
+    def test_late_order_goes_into_next_digest(self):
+        """Test an order committed after the digest went out is not skipped"""
+        self.enqueue(2, age=1000)
+        late = OutboxMessage.objects.filter(topic=digest.TOPIC).first()
+        late_id = late.id
+        late.delete()
+        self.assertEqual(digest.flush(), 1)
+
+        OutboxMessage.objects.create(id=late_id, topic=late.topic, payload=late.payload)
+        OutboxMessage.objects.filter(id=late_id).update(created_at=timezone.now() - timedelta(seconds=1000))
+
+        self.assertEqual(digest.flush(), 1)
+        self.assertIn('#D0', mail.outbox[1].alternatives[0][0])
+
+    def test_failed_send_keeps_orders_pending(self):
+        """Test a digest that could not be sent is retried with the same orders"""
+        self.enqueue(2, age=1000)
+
+        with patch.object(mail_dispatch.MailDispatcher, 'send', return_value=[smtplib.SMTPServerDisconnected()]):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                digest.flush()
+
+        self.assertEqual(digest.flush(), 2)
+
+    def test_drain_skips_digest_messages(self):
+        """Test the per-message worker leaves digest orders alone"""
+        self.enqueue(2, age=1000)
+
+        self.assertEqual(outbox.drain(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes')
+    def test_high_value_order_is_sent_immediately(self):
+        """Test a checkout over the threshold still emails the admin right away"""
+        fake_bank = FakeBank(balance=10000.0).start()
+        self.addCleanup(fake_bank.stop)
+        bank.reset_client()
+        self.addCleanup(bank.reset_client)
+        flush_cart_cache(self.user)
+        CartItem.objects.create(user=self.user, item_id='headphones', price=Decimal('299.00'), quantity=4)
+        self.client.login(username='digestuser', password='pass123')
+
+        with override_settings(BANK_URL=fake_bank.url):
+            self.client.post('/buy/', {
+                'first_name': 'Dana', 'last_name': 'Buyer', 'email': 'digest@test.com',
+                'phone_number': '123456789', 'address': '123 Test St', 'city': 'Warsaw',
+                'state': 'Mazovia', 'zipcode': '00-000', 'country': 'Poland',
+                'Card': '1234567890123456', 'HoldName': 'Dana Buyer', 'CVV': '123'
+            })
+
+        self.assertTrue(OutboxMessage.objects.filter(topic='order.admin_email').exists())
+        self.assertFalse(OutboxMessage.objects.filter(topic=digest.TOPIC).exists())
+
+
+@override_settings(BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes')
+class HistorySyncTestCase(TestCase):
+    """Test order history is sent to the bank in batches"""
+
+    def setUp(self):
+        self.bank = FakeBank().start()
+        self.addCleanup(self.bank.stop)
+        bank.reset_client()
+        self.addCleanup(bank.reset_client)
+        override = override_settings(BANK_URL=self.bank.url, HISTORY_MAX_AGE=30)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def enqueue(self, count, age=10):
+        messages = [
+            outbox.enqueue('order.bank_history', {
+                'user_id': 1, 'order_id': f'#H{i}', 'items': 'Wireless Mouse x1',
+                'total': '79.00', 'status': 'Paid', 'card_last4': '3456',
+            })
+            for i in range(count)
+        ]
+        OutboxMessage.objects.filter(id__in=[m.id for m in messages]).update(
+            created_at=timezone.now() - timedelta(seconds=age)
+        )
+        return messages
+
+    def test_rows_identify_the_card_by_last4(self):
+        """Test history rows carry card_last4 and no card_number"""
+        self.enqueue(1)
+        self.assertEqual(history.flush(force=True), 1)
+
+        row = self.bank.history['#H0']
+        self.assertEqual(row['card_last4'], '3456')
+        self.assertNotIn('card_number', row)
+
+    def test_partial_batch_waits_for_max_age(self):
+        """Test a partial batch is held until its oldest order is old enough"""
+        self.enqueue(3, age=10)
+        self.assertEqual(history.flush(batch_size=10), 0)
+        self.assertEqual(self.bank.requests, [])
+
+        OutboxMessage.objects.update(created_at=timezone.now() - timedelta(seconds=60))
+        self.assertEqual(history.flush(batch_size=10), 3)
+        self.assertEqual(len(self.bank.requests), 1)
+        self.assertEqual(len(self.bank.requests[0][1]['orders']), 3)
+        self.assertEqual(history.pending(), 0)
+
+    def test_full_batches_go_out_at_once(self):
+        """Test full batches are sent without waiting and marked done"""
+        self.enqueue(5)
+
+        self.assertEqual(history.flush(batch_size=2), 2)
+        self.assertEqual(history.flush(batch_size=2), 2)
+        self.assertEqual(history.flush(batch_size=2), 0)
+        self.assertEqual(history.flush(batch_size=2, force=True), 1)
+
+        self.assertEqual(len(self.bank.requests), 3)
+        self.assertEqual(OutboxMessage.objects.filter(status='Done').count(), 5)
+
+    def test_late_commit_is_sent(self):
+        """Test an order committed after a later one was sent still goes out"""
+        late, sent = self.enqueue(2)
+        late_id = late.id
+        late.delete()
+        self.assertEqual(history.flush(force=True), 1)
+
+        # The earlier id only becomes visible now, as a slow checkout would.
+        OutboxMessage.objects.create(id=late_id, topic=late.topic, payload=late.payload)
+
+        self.assertEqual(history.flush(force=True), 1)
+        self.assertEqual(set(self.bank.history), {'#H0', '#H1'})
+
+    def test_batch_in_flight_is_not_sent_twice(self):
+        """Test a second sender skips the batch while the first is posting it"""
+        self.enqueue(2)
+        client = bank.get_client()
+        send_history = client.send_history
+        concurrent = []
+
+        def send_and_flush_again(*args, **kwargs):
+            concurrent.append(history.flush(force=True))
+            return send_history(*args, **kwargs)
+
+        with patch.object(client, 'send_history', side_effect=send_and_flush_again):
+            self.assertEqual(history.flush(force=True), 2)
+
+        self.assertEqual(concurrent, [0])
+        self.assertEqual(len(self.bank.requests), 1)
+
+    def test_failed_flush_releases_the_batch(self):
+        """Test a failed send leaves the batch pending for an immediate retry"""
+        self.enqueue(2)
+        self.bank.stop()
+
+        with self.assertRaises(requests.ConnectionError):
+            history.flush(force=True)
+        self.assertEqual(history.pending(), 2)
+        self.assertFalse(OutboxMessage.objects.filter(available_at__gt=timezone.now()).exists())
+
+    def test_resent_orders_are_ignored_by_the_bank(self):
+        """Test replaying a batch after a crash does not duplicate orders"""
+        self.enqueue(2)
+        history.flush(force=True)
+        # As if the sender died before marking the batch and its lease ran out.
+        OutboxMessage.objects.update(status='Pending', available_at=timezone.now())
+
+        self.assertEqual(history.flush(force=True), 2)
+        self.assertEqual(len(self.bank.history), 2)
+
+
+class OrderIdTestCase(TestCase):
+    """Test time-ordered order ids"""
+
+    def test_ids_sort_in_creation_order(self):
+        """Test ids are unique, fixed-width and increase as strings"""
+        generated = [ids.order_id() for _ in range(5000)]
+
+        self.assertEqual(len(set(generated)), 5000)
+        self.assertEqual(generated, sorted(generated))
+        self.assertTrue(all(len(i) == 14 and i.startswith('#') for i in generated))
+
+    def test_clock_going_backwards(self):
+        """Test ids keep increasing when the wall clock steps back"""
+        now = [ids.EPOCH_MS + 10_000]
+        generator = ids.IdGenerator(node=1, clock=lambda: now[0])
+
+        first = generator.next()
+        now[0] -= 5_000
+        self.assertGreater(generator.next(), first)
+
+    def test_sequence_overflow_moves_to_next_millisecond(self):
+        """Test more than 4096 ids in one millisecond stay unique"""
+        generator = ids.IdGenerator(node=1, clock=lambda: ids.EPOCH_MS)
+        values = [generator.next() for _ in range(ids.MAX_SEQUENCE + 10)]
+
+        self.assertEqual(len(set(values)), len(values))
+        self.assertEqual(values, sorted(values))
+
+    def test_nodes_do_not_collide(self):
+        """Test two nodes in the same millisecond produce different ids"""
+        def clock():
+            return ids.EPOCH_MS + 1
+
+        self.assertNotEqual(ids.IdGenerator(1, clock).next(), ids.IdGenerator(2, clock).next())
+
+    def test_processes_on_one_host_get_their_own_slot(self):
+        """Test each process claims a free worker slot, freed when it lets go"""
+        with tempfile.TemporaryDirectory() as directory, override_settings(ORDER_ID_SLOT_DIR=directory):
+            first, first_file = ids.claim_worker_slot()
+            second, second_file = ids.claim_worker_slot()
+            self.assertEqual((first, second), (0, 1))
+
+            first_file.close()
+            again, again_file = ids.claim_worker_slot()
+            self.assertEqual(again, 0)
+            second_file.close()
+            again_file.close()
+
+    def test_out_of_range_node_rejected(self):
+        """Test an ORDER_ID_NODE outside the host range is an error, not wrapped"""
+        for value in ('32', '-1', 'web-1'):
+            with override_settings(ORDER_ID_NODE=value), self.assertRaises(ImproperlyConfigured):
+                ids.host_number()
+        with override_settings(ORDER_ID_NODE='31'):
+            self.assertEqual(ids.host_number(), 31)
+
+    def test_timestamp_round_trip(self):
+        """Test the creation time can be read back from an id"""
+        self.assertAlmostEqual(ids.timestamp(ids.order_id()), timezone.now().timestamp(), delta=1)
+
+    def test_create_order_retries_collision(self):
+        """Test an order insert retries with a new id when the first is taken"""
+        user = User.objects.create_user(username='iduser', password='pass123')
+        taken = Orders.objects.create(user=user, total=Decimal('1.00'), order_id=ids.order_id())
+
+        with patch('logic.ids.order_id', side_effect=[taken.order_id, '#FRESH']):
+            order = views.create_order(user, Decimal('2.00'))
+
+        self.assertEqual(order.order_id, '#FRESH')
+        self.assertEqual(Orders.objects.filter(user=user).count(), 2)
+
+
+@override_settings(BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes')
+class BankClientTestCase(TestCase):
+    """Test the pooled bank client against a local fake bank"""
+
+    def setUp(self):
+        self.bank = FakeBank(balance=500.0).start()
+        self.addCleanup(self.bank.stop)
+        bank.reset_client()
+        self.addCleanup(bank.reset_client)
+
+    def test_verify_reuses_connection(self):
+        """Test consecutive calls share one keep-alive connection"""
+        client = bank.BankClient(self.bank.url)
+
+        for _ in range(3):
+            response = client.verify('1234567890123456', 'Test', '123', 10.0)
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(self.bank.connections), 1)
+        self.assertEqual(client.stats()['endpoints']['/api/verify']['ok'], 3)
+
+    def test_circuit_opens_when_bank_is_down(self):
+        """Test the client fails fast once the bank keeps failing"""
+        client = bank.BankClient(self.bank.url, breaker=bank.CircuitBreaker(threshold=2, reset_timeout=60))
+        self.bank.stop()
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                client.verify('1234567890123456', 'Test', '123', 10.0)
+
+        with self.assertRaises(bank.CircuitOpenError):
+            client.verify('1234567890123456', 'Test', '123', 10.0)
+
+        stats = client.stats()
+        self.assertEqual(stats['circuit'], 'open')
+        self.assertEqual(stats['endpoints']['/api/verify']['errors'], 2)
+        self.assertEqual(stats['endpoints']['/api/verify']['rejected'], 1)
+
+    def test_async_client_shares_breaker(self):
+        """Test the async client runs concurrent calls and shares the sync client's health"""
+        async def verify_many():
+            client = bank.get_async_client()
+            responses = await asyncio.gather(*[
+                client.verify('1234567890123456', 'Test', '123', 10.0) for _ in range(5)
+            ])
+            return client, [r.status_code for r in responses]
+
+        with override_settings(BANK_URL=self.bank.url):
+            client, statuses = async_to_sync(verify_many)()
+
+        self.assertEqual(statuses, [200] * 5)
+        self.assertIs(client.breaker, bank.get_client().breaker)
+        self.assertEqual(bank.get_client().stats()['endpoints']['/api/verify']['ok'], 5)
+        self.assertEqual(self.bank.balance, 450.0)
+
+    def test_cancelled_trial_releases_the_circuit(self):
+        """Test a half-open trial call that is cancelled lets the next call through"""
+        breaker = bank.CircuitBreaker(threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        async def cancelled_trial():
+            client = bank.AsyncBankClient(self.bank.url, breaker=breaker)
+            with patch.object(client.client, 'post', side_effect=asyncio.CancelledError):
+                with self.assertRaises(asyncio.CancelledError):
+                    await client.verify('1234567890123456', 'Test', '123', 10.0)
+            await client.client.aclose()
+
+        async_to_sync(cancelled_trial)()
+
+        self.assertTrue(breaker.allow())
+
+    def test_token_error_is_not_a_bank_failure(self):
+        """Test a JWT that cannot be signed is raised as is and leaves the circuit alone"""
+        client = bank.BankClient(self.bank.url, breaker=bank.CircuitBreaker(threshold=1))
+        with patch('logic.bank.generate_jwt_token', side_effect=jwt.InvalidKeyError('no secret')):
+            with self.assertRaises(jwt.InvalidKeyError):
+                client.verify('1234567890123456', 'Test', '123', 10.0)
+
+        self.assertEqual(client.breaker.state, 'closed')
+        self.assertEqual(client.stats()['endpoints'], {})
+
+    def test_wsgi_checkout_uses_sync_client(self):
+        """Test an async view served over WSGI does not leave an async client per request"""
+        user = User.objects.create_user(username='wsgibuyer', password='pass123')
+        flush_cart_cache(user)
+        CartItem.objects.create(user=user, item_id='mouse', price=Decimal('79.00'))
+        self.client.force_login(user)
+
+        with override_settings(BANK_URL=self.bank.url, BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes'):
+            response = self.client.post('/buy/', {
+                **CHECKOUT_FORM, 'Card': '1234567890123456', 'HoldName': 'Test Buyer', 'CVV': '123',
+            })
+
+        self.assertTrue(response['Location'].startswith('/conf/'))
+        self.assertEqual(len(bank._async_clients), 0)
+        self.assertEqual(bank.get_client().stats()['endpoints']['/api/verify']['ok'], 1)
+
+    def test_token_is_reused_until_near_expiry(self):
+        """Test the service JWT is minted once and refreshed shortly before it expires"""
+        token = bank.ServiceToken('test-secret-at-least-thirty-two-bytes', lifetime=900, refresh_margin=60)
+
+        first = token.get()
+        self.assertEqual(token.get(), first)
+        self.assertEqual(token.mints, 1)
+        self.assertEqual(jwt.decode(first, 'test-secret-at-least-thirty-two-bytes', algorithms=['HS256'])['service'], 'ecommerce')
+
+        token.current = (first, time.monotonic() - 1)
+        token.get()
+        self.assertEqual(token.mints, 2)
+
+    def test_token_refresh_is_thread_safe(self):
+        """Test concurrent callers of an expired token mint it once"""
+        token = bank.ServiceToken('test-secret-at-least-thirty-two-bytes')
+        with patch('logic.bank.generate_jwt_token', side_effect=lambda *a: time.sleep(0.05) or 'minted') as mint:
+            threads = [threading.Thread(target=token.get) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(mint.call_count, 1)
+
+    def test_bank_calls_share_one_token(self):
+        """Test many bank calls mint a single token and report it"""
+        client = bank.BankClient(self.bank.url)
+        for _ in range(5):
+            client.verify('1234567890123456', 'Test', '123', 1.0)
+
+        self.assertEqual(client.stats()['token_mints'], 1)
+
+    def test_checkout_against_fake_bank(self):
+        """Test a full checkout charges the fake bank"""
+        user = User.objects.create_user(username='bankuser', password='pass123')
+        self.client.login(username='bankuser', password='pass123')
+        flush_cart_cache(user)
+        CartItem.objects.create(user=user, item_id='headphones', price=Decimal('299.00'))
+
+        with override_settings(BANK_URL=self.bank.url):
+            response = self.client.post('/buy/', {
+                'first_name': 'Test',
+                'last_name': 'Buyer',
+                'email': 'bank@test.com',
+                'phone_number': '123456789',
+                'address': '123 Test St',
+                'city': 'Warsaw',
+                'state': 'Mazovia',
+                'zipcode': '00-000',
+                'country': 'Poland',
+                'Card': '1234567890123456',
+                'HoldName': 'Test Buyer',
+                'CVV': '123'
+            })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Orders.objects.filter(user=user).count(), 1)
+        self.assertEqual(self.bank.balance, 201.0)
+
+
+class CartStoreTestCase(TestCase):
+    """Test the Redis write-through cart store"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cartuser', password='pass123')
+        flush_cart_cache(self.user)
+
+    def test_database_fallback_without_redis(self):
+        """Test the store works from Postgres alone when Redis is unavailable"""
+        store = CartStore(None)
+        item = store.add(self.user, 'Product A', Decimal('10.00'))
+        store.add(self.user, 'Product B', Decimal('20.00'))
+
+        self.assertEqual([c['name'] for c in store.items(self.user)], ['Product B', 'Product A'])
+        self.assertEqual(store.remove(self.user, item['id']), 0)
+        self.assertIsNone(store.remove(self.user, item['id']))
+        self.assertEqual(store.clear(self.user), 1)
+
+    def test_database_fallback_on_redis_error(self):
+        """Test reads fall back to Postgres when Redis calls fail"""
+        client = Mock()
+        client.hgetall.side_effect = redis.ConnectionError()
+        CartItem.objects.create(user=self.user, item_id='Product A', price=Decimal('10.00'))
+
+        items = CartStore(client).items(self.user)
+
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['price'], Decimal('10.00'))
+
+    def test_warm_cart_reads_take_no_queries(self):
+        """Test reading a cached cart does not hit the database"""
+        if not views.r.healthy():
+            self.skipTest('Redis not available')
+        store = CartStore(views.r)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.add(self.user, 'Product A', Decimal('10.00'))
+        store.items(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            item = store.add(self.user, 'Product B', Decimal('20.00'))
+
+        with self.assertNumQueries(0):
+            items = store.items(self.user)
+        self.assertEqual([c['name'] for c in items], ['Product B', 'Product A'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.add(self.user, 'Product B', Decimal('20.00'))
+        with self.assertNumQueries(0):
+            self.assertEqual(store.items(self.user)[0]['quantity'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.remove(self.user, item['id'], all_units=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(store.items(self.user)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            store.clear(self.user)
+        self.assertEqual(store.items(self.user), [])
+
+    def test_write_while_down_reloads_after_recovery(self):
+        """Test a cart changed while Redis was down is not served stale afterwards"""
+        if not views.r.healthy():
+            self.skipTest('Redis not available')
+        client = redis_client.RedisClient(django_settings.REDIS_URL, retry_interval=60)
+        self.addCleanup(client.close)
+        store = CartStore(client)
+        with self.captureOnCommitCallbacks(execute=True):
+            store.add(self.user, 'mouse', Decimal('79.00'))
+        store.items(self.user)
+
+        with self.assertLogs('logic.redis_client', 'WARNING'):
+            client.mark_down()
+        with self.captureOnCommitCallbacks(execute=True):
+            store.add(self.user, 'mouse', Decimal('79.00'))
+        self.assertEqual(store.stale, {self.user.id})
+
+        client.down_until = time.monotonic() - 1
+        self.assertEqual(store.items(self.user)[0]['quantity'], 2)
+        self.assertEqual(store.stale, set())
+
+    def test_write_during_load_is_not_lost(self):
+        """Test an add committed while a cold cart is loaded is not overwritten"""
+        if not views.r.healthy():
+            self.skipTest('Redis not available')
+        store = CartStore(views.r)
+        with self.captureOnCommitCallbacks(execute=True):
+            store.add(self.user, 'mouse', Decimal('79.00'))
+        views.r.delete(cart_key(self.user.id))
+
+        load = store._load
+
+        def load_then_add(user):
+            rows = load(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                store.add(user, 'keyboard', Decimal('149.00'))
+            return rows
+
+        with patch.object(store, '_load', side_effect=load_then_add):
+            self.assertEqual(len(store.items(self.user)), 1)
+
+        self.assertEqual({c['name'] for c in store.items(self.user)}, {'mouse', 'keyboard'})
+        with self.assertNumQueries(0):
+            self.assertEqual(len(store.items(self.user)), 2)
+
+
+class CartQuantityTestCase(TestCase):
+    """Test one cart row per product with a quantity"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='qtyuser', password='pass123')
+        self.client.login(username='qtyuser', password='pass123')
+        flush_cart_cache(self.user)
+
+    def add(self, product):
+        return self.client.post(
+            '/api/addcart/',
+            data=json.dumps({'product': product}),
+            content_type='application/json'
+        )
+
+    def test_adding_same_product_increments_quantity(self):
+        """Test repeated adds upsert a single row"""
+        for _ in range(3):
+            self.assertEqual(self.add('mouse').status_code, 200)
+        response = self.add('keyboard')
+        self.assertEqual(response.json()['quantity'], 1)
+
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(CartItem.objects.get(user=self.user, item_id='mouse').quantity, 3)
+
+        data = self.client.get('/api/checkout/', HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        quantities = {item['product']: item['quantity'] for item in data['items']}
+        self.assertEqual(quantities, {'mouse': 3, 'keyboard': 1})
+        self.assertEqual(data['total'], 386.0)
+
+    def test_delone_decrements_then_deletes(self):
+        """Test removing one unit at a time and the whole row"""
+        self.add('mouse')
+        self.add('mouse')
+        item = CartItem.objects.get(user=self.user, item_id='mouse')
+
+        response = self.client.post(f'/api/delone/{item.id}/')
+        self.assertEqual(response.json()['quantity'], 1)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 1)
+
+        self.add('mouse')
+        response = self.client.post(f'/api/delone/{item.id}/?all=1')
+        self.assertEqual(response.json()['quantity'], 0)
+        self.assertFalse(CartItem.objects.filter(id=item.id).exists())
+
+
+class CatalogTestCase(TestCase):
+    """Test the server-side product catalog"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='cataloguser', password='pass123')
+        self.client.login(username='cataloguser', password='pass123')
+        flush_cart_cache(self.user)
+        views.catalog.invalidate()
+        self.addCleanup(views.catalog.invalidate)
+
+    def test_lookups_are_served_from_memory(self):
+        """Test repeated price lookups do not query the database"""
+        views.catalog.get('mouse')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(views.catalog.get('mouse').price, Decimal('79.00'))
+            self.assertIsNone(views.catalog.get('missing'))
+
+    def test_saving_a_product_refreshes_the_index(self):
+        """Test price changes are picked up without a restart"""
+        views.catalog.get('mouse')
+        Product.objects.filter(sku='mouse').update(price=Decimal('89.00'))
+        Product.objects.get(sku='mouse').save()
+
+        self.assertEqual(views.catalog.get('mouse').price, Decimal('89.00'))
+
+    def test_home_renders_catalog(self):
+        """Test the product grid comes from the catalog"""
+        Product.objects.create(sku='webcam', name='HD Webcam', price=Decimal('59.00'))
+
+        response = self.client.get('/')
+
+        self.assertContains(response, 'HD Webcam')
+        self.assertContains(response, 'id="webcam"')
+        self.assertContains(response, 'Wireless Mouse')
+
+    @override_settings(BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes')
+    def test_checkout_uses_catalog_prices(self):
+        """Test the bank is charged the catalog price, not the stored cart price"""
+        fake_bank = FakeBank(balance=1000.0).start()
+        self.addCleanup(fake_bank.stop)
+        bank.reset_client()
+        self.addCleanup(bank.reset_client)
+        CartItem.objects.create(user=self.user, item_id='usb', price=Decimal('0.01'), quantity=2)
+
+        with override_settings(BANK_URL=fake_bank.url):
+            self.client.post('/buy/', {
+                'first_name': 'Test',
+                'last_name': 'Buyer',
+                'email': 'catalog@test.com',
+                'phone_number': '123456789',
+                'address': '123 Test St',
+                'city': 'Warsaw',
+                'state': 'Mazovia',
+                'zipcode': '00-000',
+                'country': 'Poland',
+                'Card': '1234567890123456',
+                'HoldName': 'Test Buyer',
+                'CVV': '123'
+            })
+
+        order = Orders.objects.get(user=self.user)
+        self.assertEqual(order.total, Decimal('98.00'))
+        self.assertEqual(order.get_items_list(), ['USB-C Hub x2'])
+        self.assertEqual(fake_bank.requests[0][1]['cart_total'], 98.0)
+
+
+class OrderLineTestCase(TestCase):
+    """Test orders store their items as OrderLine rows"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lineuser', password='pass123')
+
+    def test_items_list_reads_lines(self):
+        """Test the confirmation list comes from order lines"""
+        order = Orders.objects.create(user=self.user, total=Decimal('207.00'), order_id='#LINES')
+        mouse = Product.objects.get(sku='mouse')
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product=mouse, name=mouse.name, quantity=2, unit_price=mouse.price),
+            OrderLine(order=order, name='USB-C Hub', quantity=1, unit_price=Decimal('49.00')),
+        ])
+
+        order = Orders.objects.prefetch_related('lines').get(id=order.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(order.get_items_list(), ['Wireless Mouse x2', 'USB-C Hub x1'])
+
+    def test_legacy_item_string_parsing(self):
+        """Test the backfill parser understands the old comma-joined format"""
+        migration = importlib.import_module('logic.migrations.0005_orderline')
+
+        self.assertEqual(
+            migration.parse_legacy_items('Wireless Mouse x2, Product, with x sign x10,  '),
+            [('Wireless Mouse', 2), ('Product', 1), ('with x sign', 10)]
+        )
+
+
+@override_settings(ORDERS_PAGE_SIZE=20)
+class OrderHistoryPaginationTestCase(TestCase):
+    """Test keyset pagination of the order history"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='historyuser', password='pass123')
+        self.client.login(username='historyuser', password='pass123')
+
+        Orders.objects.bulk_create([
+            Orders(user=self.user, total=Decimal('10.00'), order_id=f'#H{i:03d}')
+            for i in range(45)
+        ])
+        # Several orders share a timestamp, so the id tie-break matters.
+        same_time = timezone.now()
+        Orders.objects.filter(order_id__in=['#H010', '#H011', '#H012', '#H013']).update(date=same_time)
+
+    def test_pages_cover_history_exactly_once(self):
+        """Test following next cursors returns every order once, newest first"""
+        seen = []
+        cursor = None
+        while True:
+            url = '/api/orders/' + (f'?cursor={cursor}' if cursor else '')
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['orders']), 20)
+            seen.extend(o['order_id'] for o in data['orders'])
+            cursor = data['next']
+            if not cursor:
+                break
+
+        expected = list(
+            Orders.objects.filter(user=self.user).order_by('-date', '-id').values_list('order_id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_page_query_count_is_constant(self):
+        """Test a deep page costs the same queries as the first one"""
+        first = self.client.get('/api/orders/').json()
+        second = self.client.get(f"/api/orders/?cursor={first['next']}").json()
+
+        # user, orders, order lines (the session is read from Redis)
+        with self.assertNumQueries(3):
+            self.client.get(f"/api/orders/?cursor={second['next']}")
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get('/api/orders/?cursor=not-a-cursor')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_home_renders_first_page(self):
+        """Test the home page only renders one page plus a load-more cursor"""
+        response = self.client.get('/')
+
+        self.assertEqual(len(response.context['orders']), 20)
+        self.assertEqual(response.context['orders_count'], 45)
+        self.assertContains(response, 'load-more-orders')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are checked against PostgreSQL')
+class QueryPlanTestCase(TestCase):
+    """Test the hot queries in logic.views are answered from indexes
+
+    Every statement a view runs is re-run under EXPLAIN with sequential scans
+    disabled, so a missing index shows up as a Seq Scan node however small
+    the seeded tables are.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='planuser', password='pass123')
+        others = User.objects.bulk_create([
+            User(username=f'planother{i}', password='!') for i in range(50)
+        ])
+        products = list(Product.objects.all())
+
+        orders = []
+        for user in [cls.user] + others:
+            orders += [
+                Orders(user=user, total=Decimal('79.00'), order_id=f'#P{user.username}{i}')
+                for i in range(40)
+            ]
+        orders = Orders.objects.bulk_create(orders)
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product=products[0], name=products[0].name, quantity=1,
+                      unit_price=products[0].price)
+            for order in orders
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(user=user, item_id=product.sku, price=product.price)
+            for user in [cls.user] + others
+            for product in products
+        ])
+        cls.order_id = Orders.objects.filter(user=cls.user).values_list('order_id', flat=True)[0]
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.login(username='planuser', password='pass123')
+        # Force the cold, database-backed cart path.
+        patcher = patch.object(views, 'carts', CartStore(None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def capture(self, fn):
+        with CaptureQueriesContext(connection) as ctx:
+            fn()
+        return [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].lstrip().split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE')
+        ]
+
+    def plan_problems(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+            cursor.execute('RESET enable_seqscan')
+
+        problems = []
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] in ('Seq Scan', 'Sort', 'Incremental Sort'):
+                problems.append(f"{node['Node Type']} on {node.get('Relation Name', '?')}")
+            nodes.extend(node.get('Plans', []))
+        return problems
+
+    def assertIndexed(self, fn):
+        statements = self.capture(fn)
+        self.assertTrue(statements)
+        for sql in statements:
+            problems = self.plan_problems(sql)
+            self.assertEqual(problems, [], sql)
+
+    def test_home(self):
+        """Test the order history and catalog queries on the home page"""
+        self.assertIndexed(lambda: self.client.get('/'))
+
+    def test_orders_page(self):
+        """Test a keyset page after the first one"""
+        cursor = self.client.get('/api/orders/').json()['next']
+        self.assertIndexed(lambda: self.client.get(f'/api/orders/?cursor={cursor}'))
+
+    def test_conf(self):
+        """Test the (order_id, user) lookup and its order lines"""
+        self.assertIndexed(lambda: self.client.get(f'/conf/{quote(self.order_id)}/'))
+
+    def test_cart_reads(self):
+        """Test loading a cold cart"""
+        self.assertIndexed(lambda: self.client.get('/api/checkout/', HTTP_X_REQUESTED_WITH='XMLHttpRequest'))
+        self.assertIndexed(lambda: self.client.get('/buy/', HTTP_X_REQUESTED_WITH='XMLHttpRequest'))
+
+    def test_cart_writes(self):
+        """Test removing one cart row and clearing the cart"""
+        item = CartItem.objects.filter(user=self.user).first()
+        self.assertIndexed(lambda: self.client.post(f'/api/delone/{item.id}/'))
+        self.assertIndexed(lambda: self.client.post('/api/cleancart/'))
+
+    def test_outbox_claim(self):
+        """Test the outbox worker's due-message query"""
+        self.assertIndexed(lambda: outbox.claim(50))
+
+    def test_history_batch(self):
+        """Test the history sender's read after the high-water mark"""
+        statements = self.capture(lambda: list(
+            OutboxMessage.objects
+            .filter(topic=history.TOPIC, id__gt=0, created_at__lte=timezone.now())
+            .order_by('id')[:500]
+        ))
+        for sql in statements:
+            self.assertEqual(self.plan_problems(sql), [], sql)
+
+
+# Most SQL queries and total DB milliseconds each URL may cost, measured by
+# QueryBudgetTestCase under its fixtures: a 50-item cart and 1,000 past
+# orders, with the catalog loaded, the cart not yet cached in Redis and the
+# session in Redis. Savepoints count as queries. Raise a budget only together
+# with the change that needs it.
+QUERY_BUDGETS = {
+    'home': (4, 50),                # user, orders page, its lines, order count
+    'reg': (0, 50),
+    'login': (0, 50),
+    'checkout': (1, 50),
+    'conf': (3, 50),
+    'settings': (1, 50),
+    'delacc': (23, 250),            # deletes 1,000 orders in batches
+    'register': (4, 50),            # logging in drops any database copy of the session
+    'logout': (2, 50),
+    'addcart': (3, 50),
+    'cleancart': (2, 50),
+    'delete_cart_item': (3, 50),
+    'checkout_data': (3, 50),
+    'orders_page': (3, 50),
+    'buy': (13, 100),               # one INSERT for all 50 order lines
+    'validate_checkout': (2, 50),
+    'metrics': (0, 50),
+}
+
+
+@skipUnless(views.r.healthy(), 'Redis is required: the budgets assume sessions and carts in Redis')
+@override_settings(BANK_JWT_SECRET='test-secret-at-least-thirty-two-bytes', METRICS_TOKEN='scrape-secret')
+class QueryBudgetTestCase(TestCase):
+    """Test every view stays within its query budget"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='budgetuser', password='pass123', email='budget@test.com')
+        products = Product.objects.bulk_create([
+            Product(sku=f'budget-{i}', name=f'Budget product {i}', price=Decimal('1.00'))
+            for i in range(50)
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(user=cls.user, item_id=product.sku, price=product.price) for product in products
+        ])
+        orders = Orders.objects.bulk_create([
+            Orders(user=cls.user, total=Decimal('2.00'), order_id=f'#B{i:04d}') for i in range(1000)
+        ])
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product=products[i % 50], name=products[i % 50].name,
+                      quantity=2, unit_price=Decimal('1.00'))
+            for i, order in enumerate(orders)
+        ])
+        cls.cart_item = CartItem.objects.filter(user=cls.user).first()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.bank = FakeBank(balance=10 ** 9).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.bank.stop()
+        super().tearDownClass()
+
+    def requests(self):
+        """(url name, method, path, client kwargs, check) for a realistic request to
+        each view. ``check(response)`` asserts the view did its work, so a view
+        that fails early cannot pass its budget by skipping it."""
+        json_post = {'content_type': 'application/json', 'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        return [
+            ('home', 'get', '/', {}, self.check_home),
+            ('reg', 'get', '/reg', {}, self.check_ok),
+            ('login', 'get', '/login', {}, self.check_ok),
+            ('checkout', 'get', '/checkout/', {}, self.check_ok),
+            ('conf', 'get', '/conf/%23B0500/', {}, lambda response: self.assertContains(response, '#B0500')),
+            ('settings', 'get', '/settings', {}, lambda response: self.assertContains(response, 'budgetuser')),
+            ('delacc', 'post', '/delacc', {}, self.check_delacc),
+            ('register', 'post', '/register', {
+                'data': json.dumps({'username': 'budgetnew', 'password': 'pass123'}),
+                **json_post,
+            }, self.check_register),
+            ('logout', 'post', '/logout', {}, self.check_logout),
+            ('addcart', 'post', '/api/addcart/', {'data': json.dumps({'product': 'budget-7'}), **json_post},
+             lambda response: self.assertEqual(response.json()['quantity'], 2)),
+            ('cleancart', 'post', '/api/cleancart/', {},
+             lambda response: self.assertEqual(response.json()['deleted_count'], 50)),
+            ('delete_cart_item', 'post', f'/api/delone/{self.cart_item.id}/', {}, self.check_delete_cart_item),
+            ('checkout_data', 'get', '/api/checkout/', {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'},
+             lambda response: self.assertEqual(len(response.json()['items']), 50)),
+            ('orders_page', 'get', '/api/orders/', {},
+             lambda response: self.assertEqual(len(response.json()['orders']), django_settings.ORDERS_PAGE_SIZE)),
+            ('buy', 'post', '/buy/', {
+                'data': {**CHECKOUT_FORM, 'Card': '1234567890123456', 'HoldName': 'Test Buyer', 'CVV': '123'},
+            }, self.check_buy),
+            ('validate_checkout', 'post', '/api/validate-checkout/', {
+                'data': json.dumps({**CHECKOUT_FORM, 'form_type': 'contact'}), **json_post,
+            }, lambda response: self.assertEqual(response.json()['status'], 'success')),
+            ('metrics', 'get', '/metrics', {'HTTP_AUTHORIZATION': 'Bearer scrape-secret'},
+             lambda response: self.assertContains(response, '# TYPE')),
+        ]
+
+    def check_ok(self, response):
+        self.assertEqual(response.status_code, 200)
+
+    def check_home(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['orders']), django_settings.ORDERS_PAGE_SIZE)
+        self.assertEqual(response.context['orders_count'], 1000)
+
+    def check_delacc(self, response):
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(Orders.objects.exists())
+
+    def check_register(self, response):
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertTrue(User.objects.filter(username='budgetnew').exists())
+
+    def check_logout(self, response):
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def check_delete_cart_item(self, response):
+        self.assertEqual(response.json()['quantity'], 0)
+        self.assertFalse(CartItem.objects.filter(id=self.cart_item.id).exists())
+
+    def check_buy(self, response):
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith('/conf/'), response['Location'])
+        self.assertEqual(Orders.objects.filter(user=self.user).count(), 1001)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def measure(self, method, path, kwargs, check):
+        """Run one request against fresh caches and ``check`` it before rolling
+        back; return (queries, DB ms)."""
+        flush_cart_cache(self.user)
+        flush_rate_limits()
+        # The fixtures are bulk-created, which sends no signal to reload it.
+        views.catalog.invalidate()
+        views.catalog.index()
+        self.client.force_login(self.user)
+
+        timings = []
+
+        def timed(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings.append(time.perf_counter() - start)
+
+        with transaction.atomic():
+            with connection.execute_wrapper(timed):
+                response = getattr(self.client, method)(path, **kwargs)
+            try:
+                check(response)
+            finally:
+                transaction.set_rollback(True)
+        return len(timings), sum(timings) * 1000
+
+    def test_every_view_has_a_budget(self):
+        """Test each named URL in settings/urls.py declares a budget and a request"""
+        names = {p.name for p in get_resolver().url_patterns if getattr(p, 'name', None)}
+
+        self.assertEqual(names, set(QUERY_BUDGETS))
+        self.assertEqual({name for name, *_ in self.requests()}, set(QUERY_BUDGETS))
+
+    def test_views_within_budget(self):
+        """Test no view exceeds its query count or DB time budget"""
+        with override_settings(BANK_URL=self.bank.url):
+            bank.reset_client()
+            for name, method, path, kwargs, check in self.requests():
+                with self.subTest(view=name):
+                    queries, db_ms = self.measure(method, path, kwargs, check)
+                    max_queries, max_ms = QUERY_BUDGETS[name]
+
+                    self.assertLessEqual(queries, max_queries, f"{name} ran {queries} queries")
+                    self.assertLessEqual(db_ms, max_ms, f"{name} spent {db_ms:.1f} ms in the database")
+        bank.reset_client()
+
+
+class FakeBankTestCase(TestCase):
+    """Test the fake bank's injected latency and failures"""
+
+    def test_latency_and_errors(self):
+        """Test responses are delayed and failed at the configured rate"""
+        fake_bank = FakeBank(balance=1000.0, latency=0.05, error_rate=1.0).start()
+        self.addCleanup(fake_bank.stop)
+
+        start = time.perf_counter()
+        response = requests.post(f"{fake_bank.url}/api/verify", json={'card_number': '1234567890123456'})
+
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(fake_bank.errors, 1)
+        self.assertEqual(fake_bank.balance, 1000.0)
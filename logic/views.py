@@ -1,46 +1,54 @@
+from django.conf import settings as django_settings
 from django.contrib import messages, auth
 from django.contrib.auth.decorators import login_required
 from django.contrib.messages.storage import session
 from django.shortcuts import render, redirect
 import traceback
-import requests
-import traceback
-import os
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
-from django_ratelimit.decorators import ratelimit
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from django.db import transaction
-import secrets
+from django.db import IntegrityError, transaction
 import json
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
-import random
-import string
-from collections import Counter
-import jwt
-from datetime import datetime, timedelta
 from logic.forms import RegisterForm, LoginForm, CheckContactForm, CheckShipping, UpdateDataForm
-from logic.models import User, CartItem, Orders
-import redis
-
-
-try:
-    r = redis.Redis(host='127.0.0.1', port=6379, db=0)
-    r.ping()
-except redis.ConnectionError:
-    print("WARNING: Redis not available, rate limiting disabled")
-    r = None
-
+from logic.models import User, Orders, OrderLine
+from logic import bank, digest, hashers, ids, outbox, redis_client
+from logic.cart import CartStore
+from logic.catalog import Catalog
+from logic.pagination import InvalidCursor, keyset_page
+from logic.ratelimit import RateLimit, get_limiter, ratelimit
+
+
+# Connects on first use; falsy while Redis is down (see logic/redis_client.py).
+r = redis_client.get_client()
+
+carts = CartStore(r)
+catalog = Catalog(r)
+
+LOGIN_FAILURES = RateLimit('loginfail', '2/5m')
+
+
+def cart_summary(cart):
+    """Price cart rows from the catalog for the cart JSON APIs."""
+    items = []
+    total = 0
+
+    for c in cart:
+        product = catalog.get(c['name'])
+        price = float(product.price if product else c['price'])
+        total += price * c['quantity']
+        items.append({
+            'id': c['id'],
+            'product': c['name'],
+            'name': product.name if product else c['name'],
+            'price': price,
+            'quantity': c['quantity'],
+        })
 
-def generate_jwt_token():
-    payload = {
-        'service': 'ecommerce',
-        'exp': datetime.utcnow() + timedelta(minutes=15)
+    return {
+        'items': items,
+        'total': round(total, 2)
     }
-    token = jwt.encode(payload, os.getenv('JWT_SECRET'), algorithm='HS256')
-    return token
 
 
 @login_required(login_url='login')
@@ -75,18 +83,51 @@ def settings(request):
 
 def home(request):
     if request.user.is_authenticated:
-        orders = Orders.objects.filter(user_id=str(request.user.id)).order_by('-date')
+        orders, next_cursor = keyset_page(
+            Orders.objects.filter(user=request.user).prefetch_related('lines'),
+            size=django_settings.ORDERS_PAGE_SIZE
+        )
         return render(request, 'index.html', {
             'user': request.user,
             'orders': orders,
+            'orders_count': request.user.orders.count(),
+            'next_cursor': next_cursor,
+            'products': catalog.all(),
         })
     else:
         return render(request, 'index.html', {
             'orders': [],
-            'user': request.user
+            'user': request.user,
+            'products': catalog.all(),
         })
 
 
+@login_required(login_url='login')
+def orders_page(request):
+    try:
+        orders, next_cursor = keyset_page(
+            Orders.objects.filter(user=request.user).prefetch_related('lines'),
+            cursor=request.GET.get('cursor'),
+            size=django_settings.ORDERS_PAGE_SIZE
+        )
+    except InvalidCursor:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid cursor'
+        }, status=400)
+
+    return JsonResponse({
+        'orders': [{
+            'order_id': order.order_id,
+            'items': order.get_items_list(),
+            'total': str(order.total),
+            'status': order.status,
+            'date': order.date.isoformat(),
+        } for order in orders],
+        'next': next_cursor
+    })
+
+
 def reg(request):
     return render(request, 'reg.html', {
         'reg_form': RegisterForm(),
@@ -105,17 +146,17 @@ def checkout(request):
 @require_POST
 def delone(request, id):
     try:
-        item = CartItem.objects.get(id=id, user=request.user)
-        item.delete()
+        quantity = carts.remove(request.user, id, all_units=request.GET.get('all') == '1')
+        if quantity is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Item not found'
+            }, status=404)
         return JsonResponse({
             'status': 'success',
-            'message': 'Item deleted'
+            'message': 'Item deleted',
+            'quantity': quantity
         })
-    except CartItem.DoesNotExist:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Item not found'
-        }, status=404)
     except Exception as e:
         return JsonResponse({
             'status': 'error',
@@ -123,27 +164,80 @@ def delone(request, id):
         }, status=500)
 
 
+def create_order(user, total, attempts=3):
+    """Insert an order under a fresh time-ordered id, retrying if it is taken."""
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                return Orders.objects.create(
+                    user=user,
+                    total=total,
+                    order_id=ids.order_id(),
+                    status='Paid'
+                )
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def place_order(user, contact_data, shipping_data, lines, card_number):
+    """Save the customer details, the order and its outbox messages, and
+    empty the cart in one transaction. Returns the new order id."""
+    with transaction.atomic():
+        user.first_name = contact_data['first_name']
+        user.last_name = contact_data['last_name']
+        user.email = contact_data['email']
+        user.phone_number = contact_data['phone_number']
+        user.address = shipping_data['address']
+        user.city = shipping_data['city']
+        user.state = shipping_data['state']
+        user.zipcode = shipping_data['zipcode']
+        user.country = shipping_data['country']
+        user.save()
+
+        total = sum(float(product.price) * c['quantity'] for c, product in lines)
+        items_formatted = ', '.join([f"{product.name} x{c['quantity']}" for c, product in lines])
+
+        order = create_order(user, total)
+        OrderLine.objects.bulk_create([
+            OrderLine(
+                order=order,
+                product=product,
+                name=product.name,
+                quantity=c['quantity'],
+                unit_price=product.price,
+            )
+            for c, product in lines
+        ])
+
+        payload = {
+            'user_id': user.id,
+            'order_id': order.order_id,
+            'items': items_formatted,
+            'total': f"{total:.2f}",
+        }
+        outbox.enqueue('order.confirmation_email', payload)
+        outbox.enqueue(digest.topic_for(total), payload)
+        # Only the last four digits are stored; outbox rows outlive the order.
+        outbox.enqueue('order.bank_history', {
+            **payload,
+            'status': order.status,
+            'card_last4': card_number[-4:],
+        })
+
+        carts.clear(user)
+
+    return order.order_id
+
+
 @csrf_exempt
 @login_required(login_url='login')
-def buy(request):
-    cart = CartItem.objects.filter(user=request.user).select_related('user')
+async def buy(request):
+    user = await request.auser()
+    cart = await sync_to_async(carts.items)(user)
 
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        items = []
-        total = 0
-
-        for c in cart:
-            total += float(c.price)
-            items.append({
-                'id': c.id,
-                'name': c.item_id,
-                'price': float(c.price),
-            })
-
-        return JsonResponse({
-            'items': items,
-            'total': round(total, 2)
-        })
+        return JsonResponse(await sync_to_async(cart_summary)(cart))
 
     if request.method == 'POST':
         contact_form = CheckContactForm(request.POST)
@@ -157,20 +251,20 @@ def buy(request):
             return redirect('checkout')
 
         if contact_form.is_valid() and shipping_form.is_valid():
+            products = await sync_to_async(catalog.index)()
+            lines = [(c, products.get(c['name'])) for c in cart]
+            if not lines or any(product is None for c, product in lines):
+                messages.error(request, 'Some items in your cart are no longer available')
+                return redirect('checkout')
+            cart_total = sum(float(product.price) * c['quantity'] for c, product in lines)
+
             try:
-                token = generate_jwt_token()
-                cart_total = sum(float(c.price) for c in cart)
-
-                bank_response = requests.post(
-                    'http://localhost:8001/api/verify',
-                    json={
-                        'card_number': card_number,
-                        'HoldName': HoldName,
-                        'CVV': CVV,
-                        'cart_total': cart_total,
-                    },
-                    headers={'Authorization': f'Bearer {token}'},
-                    timeout=5
+                bank_response = await bank.verify(
+                    request,
+                    card_number=card_number,
+                    HoldName=HoldName,
+                    CVV=CVV,
+                    cart_total=cart_total,
                 )
 
                 if bank_response.status_code == 200:
@@ -178,7 +272,6 @@ def buy(request):
                     if not bank_data.get('success'):
                         messages.error(request, bank_data.get('error', 'Payment failed'))
                         return redirect('checkout')
-                    request.session['last_card_used'] = card_number
 
                 elif bank_response.status_code == 400:
                     bank_data = bank_response.json()
@@ -191,64 +284,24 @@ def buy(request):
                     messages.error(request, 'Bank service unavailable')
                     return redirect('checkout')
 
-            except requests.RequestException as e:
+            except bank.CircuitOpenError:
+                messages.error(request, 'Bank service unavailable')
+                return redirect('checkout')
+            except bank.transport_errors():
                 messages.error(request, 'Could not connect to bank')
                 return redirect('checkout')
             except Exception as e:
                 return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
             try:
-                with transaction.atomic():
-                    contact_data = contact_form.cleaned_data
-                    shipping_data = shipping_form.cleaned_data
-
-                    user = request.user
-                    user.first_name = contact_data['first_name']
-                    user.last_name = contact_data['last_name']
-                    user.email = contact_data['email']
-                    user.phone_number = contact_data['phone_number']
-                    user.address = shipping_data['address']
-                    user.city = shipping_data['city']
-                    user.state = shipping_data['state']
-                    user.zipcode = shipping_data['zipcode']
-                    user.country = shipping_data['country']
-                    user.save()
-
-                    random_id = '#' + ''.join(random.choices(string.ascii_letters + string.digits, k=11))
-                    total = sum(float(c.price) for c in cart)
-
-                    item_counts = Counter([c.item_id for c in cart])
-                    items_formatted = ', '.join([f"{item} x{count}" for item, count in item_counts.items()])
-
-                    order = Orders.objects.create(
-                        user=user,
-                        item=items_formatted,
-                        total=total,
-                        order_id=random_id,
-                        status='Paid'
-                    )
-
-                    send_order_confirmation(
-                        user=request.user,
-                        order_id=random_id,
-                        items=items_formatted,
-                        total=total
-                    )
-                    orderadmin(
-                        user=request.user,
-                        order_id=random_id,
-                        items=items_formatted,
-                        total=total
-                    )
-
-                    cart.delete()
-
-                    try:
-                        sendhistory(request, random_id)
-                    except Exception as e:
-                        print(f"Failed to send history: {e}")
-
-                return redirect('conf', order_id=random_id)
+                order_id = await sync_to_async(place_order)(
+                    user,
+                    contact_form.cleaned_data,
+                    shipping_form.cleaned_data,
+                    lines,
+                    card_number
+                )
+                return redirect('conf', order_id=order_id)
             except Exception as e:
                 traceback.print_exc()
                 messages.error(request, f'Order failed: {str(e)}')
@@ -261,7 +314,7 @@ def buy(request):
                 errors['shipping'] = shipping_form.errors
 
             messages.error(request, 'Please fix the errors in your form')
-            return render(request, 'checkout.html', {
+            return await sync_to_async(render)(request, 'checkout.html', {
                 'check_form': contact_form,
                 'checkship_form': shipping_form,
                 'errors': errors
@@ -270,40 +323,10 @@ def buy(request):
     return redirect('checkout')
 
 
-def sendhistory(request, order_id):
-    try:
-        order = Orders.objects.get(order_id=order_id, user=request.user)
-        card_number = request.session.get('last_card_used')
-
-        token = generate_jwt_token()
-
-        orders = [{
-            'card_number': card_number,
-            'item': order.item,
-            'status': order.status,
-            'total': str(order.total),
-            'order_id': order.order_id
-        }]
-
-        response = requests.post(
-            'http://localhost:8001/api/gethistory',
-            json={'orders': orders},
-            headers={'Authorization': f'Bearer {token}'},
-            timeout=5
-        )
-
-        return JsonResponse(response.json())
-    except Orders.DoesNotExist:
-        return JsonResponse({'error': 'Order not found'}, status=404)
-    except requests.RequestException as e:
-        print(f"Failed to send history: {e}")
-        return JsonResponse({'error': 'Failed to sync with bank'}, status=500)
-
-
 @login_required(login_url='login')
 def conf(request, order_id):
     try:
-        order = Orders.objects.get(order_id=order_id, user=request.user)
+        order = Orders.objects.prefetch_related('lines').get(order_id=order_id, user=request.user)
         items_list = order.get_items_list()
 
         return render(request, 'conf.html', {
@@ -318,25 +341,11 @@ def conf(request, order_id):
 
 
 @login_required(login_url='login')
-def checkout_data(request):
-    cart = CartItem.objects.filter(user=request.user).select_related('user')
-
+async def checkout_data(request):
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        items = []
-        total = 0
-
-        for c in cart:
-            total += float(c.price)
-            items.append({
-                'id': c.id,
-                'name': c.item_id,
-                'price': float(c.price),
-            })
-
-        return JsonResponse({
-            'items': items,
-            'total': round(total, 2)
-        })
+        user = await request.auser()
+        cart = await sync_to_async(carts.items)(user)
+        return JsonResponse(await sync_to_async(cart_summary)(cart))
 
     return JsonResponse({
         'status': 'error',
@@ -350,7 +359,7 @@ def loginn(request):
     })
 
 
-@ratelimit(key='ip', rate='10/m', block=True)
+@ratelimit('register', '10/m')
 def register(request):
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         if request.method == 'POST':
@@ -363,17 +372,6 @@ def register(request):
                     username = cd['username']
                     password = cd['password']
 
-                    if r:
-                        ip = request.META.get("REMOTE_ADDR", "")
-                        redis_key = f"loginfail:{ip}"
-
-                        fails = r.get(redis_key)
-                        if fails and int(fails) >= 200:
-                            return JsonResponse({
-                                'status': 'error',
-                                "message": "Sent too many requests. Try again later."
-                            }, status=429)
-
                     if User.objects.filter(username=username).exists():
                         return JsonResponse({
                             'status': 'error',
@@ -384,11 +382,6 @@ def register(request):
                     user = User.objects.create_user(username=username, password=password)
                     auth.login(request, user)
 
-                    if r:
-                        r.delete(redis_key)
-
-                    request.session['username'] = username
-
                     return JsonResponse({
                         'status': 'success',
                         'message': 'Registration successful',
@@ -425,14 +418,13 @@ def register(request):
 
         user = User.objects.create_user(username=username, password=password)
         auth.login(request, user)
-        request.session['username'] = username
         return redirect('home')
 
     return render(request, 'reg.html', {'reg_form': form})
 
 
-@ratelimit(key='ip', rate='250/m', block=True)
-def login(request):
+@ratelimit('login', '250/m')
+async def login(request):
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         if request.method == 'POST':
             try:
@@ -444,24 +436,18 @@ def login(request):
                     username = cd['username']
                     password = cd['password']
 
-                    if r:
-                        ip = request.META.get("REMOTE_ADDR", "")
-                        redis_key = f"loginfail:{ip}"
-
-                        fails = r.get(redis_key)
-                        if fails and int(fails) >= 2:
-                            return JsonResponse({
-                                'status': 'error',
-                                "message": "Too many failed attempts. Try again in 5 minutes."
-                            }, status=429)
-
-                    user = User.objects.filter(username=username).first()
+                    limiter = get_limiter()
+                    if await sync_to_async(limiter.blocked)(request, LOGIN_FAILURES):
+                        return JsonResponse({
+                            'status': 'error',
+                            "message": "Too many failed attempts. Try again in 5 minutes."
+                        }, status=429)
 
-                    if user and user.check_password(password):
-                        auth.login(request, user)
+                    user = await User.objects.filter(username=username).afirst()
 
-                        if r:
-                            r.delete(redis_key)
+                    if user and await hashers.acheck_password(user, password):
+                        await auth.alogin(request, user)
+                        await sync_to_async(limiter.reset)(request, LOGIN_FAILURES)
 
                         return JsonResponse({
                             'status': 'success',
@@ -469,9 +455,7 @@ def login(request):
                             'redirect': '/'
                         })
                     else:
-                        if r:
-                            r.incr(redis_key)
-                            r.expire(redis_key, 300)
+                        await sync_to_async(limiter.hit)(request, LOGIN_FAILURES)
 
                         return JsonResponse({
                             'status': 'error',
@@ -492,6 +476,14 @@ def login(request):
                     'message': 'Invalid JSON data'
                 }, status=400)
 
+            except hashers.PoolBusy:
+                response = JsonResponse({
+                    'status': 'error',
+                    'message': 'Too many logins in progress. Try again shortly.'
+                }, status=503)
+                response['Retry-After'] = '1'
+                return response
+
             except Exception as e:
                 return JsonResponse({
                     'status': 'error',
@@ -499,7 +491,7 @@ def login(request):
                 }, status=500)
 
     form = LoginForm()
-    return render(request, "login.html", {
+    return await sync_to_async(render)(request, "login.html", {
         "login_form": form,
     })
 
@@ -507,8 +499,6 @@ def login(request):
 def logout_view(request):
     if request.method == 'POST':
         auth.logout(request)
-        request.session.pop('username', None)
-        request.session.flush()
         messages.success(request, 'Logged out successfully')
         return redirect('home')
     return redirect('home')
@@ -516,11 +506,10 @@ def logout_view(request):
 
 @login_required(login_url='login')
 @require_POST
-def addcart(request):
+async def addcart(request):
     try:
         data = json.loads(request.body)
         product_id = data.get('product')
-        price = data.get('price')
 
         if not product_id:
             return JsonResponse({
@@ -528,34 +517,21 @@ def addcart(request):
                 'message': 'Product ID is required'
             }, status=400)
 
-        if not price:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Price is required'
-            }, status=400)
-
-        try:
-            price = float(price)
-            if price <= 0:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': 'Price must be greater than 0'
-                }, status=400)
-        except (ValueError, TypeError):
+        products = await sync_to_async(catalog.index)()
+        product = products.get(product_id)
+        if product is None:
             return JsonResponse({
                 'status': 'error',
-                'message': 'Invalid price format'
-            }, status=400)
+                'message': 'Product not found'
+            }, status=404)
 
-        CartItem.objects.create(
-            user=request.user,
-            item_id=product_id,
-            price=price
-        )
+        user = await request.auser()
+        item = await sync_to_async(carts.add)(user, product.sku, product.price)
 
         return JsonResponse({
             'status': 'success',
-            'message': 'Product added to cart'
+            'message': 'Product added to cart',
+            'quantity': item['quantity']
         })
 
     except json.JSONDecodeError:
@@ -575,7 +551,7 @@ def addcart(request):
 @require_POST
 def cleancart(request):
     try:
-        count, _ = CartItem.objects.filter(user=request.user).delete()
+        count = carts.clear(request.user)
         return JsonResponse({
             'status': 'success',
             'message': 'Cart cleared',
@@ -607,7 +583,7 @@ def delacc(request):
 
 @login_required(login_url='login')
 @require_POST
-def validate_checkout(request):
+async def validate_checkout(request):
     try:
         data = json.loads(request.body)
         form_type = data.get('form_type')
@@ -654,60 +630,3 @@ def validate_checkout(request):
             'status': 'error',
             'message': 'Validation failed'
         }, status=500)
-
-
-def send_order_confirmation(user, order_id, items, total):
-    try:
-        html_message = render_to_string('EMAILCONF.html', {
-            'user': user,
-            'order_id': order_id,
-            'items': items,
-            'total': total,
-            'site_url': 'https://fwaeh.cloud'
-        })
-
-        plain_message = strip_tags(html_message)
-
-        send_mail(
-            subject='Order Confirmation',
-            message=plain_message,
-            from_email='solaradeveloper@gmail.com',
-            recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Failed to send order confirmation email'
-        })
-
-
-def orderadmin(user, order_id, items, total):
-    try:
-        html_message = render_to_string('EMAILADMIN.html', {
-            'user': user,
-            'order_id': order_id,
-            'items': items,
-            'total': total,
-            'customer_name': f"{user.first_name} {user.last_name}",
-            'customer_email': user.email,
-            'customer_phone': user.phone_number,
-            'shipping_address': f"{user.address}, {user.city}, {user.state} {user.zipcode}, {user.country}",
-        })
-
-        plain_message = strip_tags(html_message)
-
-        send_mail(
-            subject=f'New Order: {order_id}',
-            message=plain_message,
-            from_email='solaradeveloper@gmail.com',
-            recipient_list=['solaradeveloper@gmail.com'],
-            html_message=html_message,
-            fail_silently=False,
-        )
-    except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Failed to send order confirmation email'
-        })
\ No newline at end of file
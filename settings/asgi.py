@@ -3,6 +3,11 @@ ASGI config for settings project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The checkout views are async, so serve them through ASGI to let a worker keep
+many checkouts waiting on the bank at once:
+
+    gunicorn settings.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
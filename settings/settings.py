@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dotenv
 from dotenv import load_dotenv
 
@@ -46,11 +47,14 @@ INSTALLED_APPS = [
 ]
 SESSION_COOKIE_NAME = 'ecommerce_sessionid'
 MIDDLEWARE = [
+    'logic.metrics.MetricsMiddleware',
+    'logic.profiling.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'logic.ratelimit.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,12 +78,136 @@ TEMPLATES = [
 
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+# Overridable so a local sink (logic/fakesmtp.py) can stand in for Gmail.
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', '1') == '1'
+
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', 'solaradeveloper@gmail.com')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', 'gagblwstndqrvpcm')
+# Close the worker's shared SMTP connection after this long unused (logic/mail.py)
+MAIL_IDLE_TIMEOUT = 30
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+# Carts, catalog and rate limits (logic/redis_client.py): after a failure the
+# client skips Redis for REDIS_RETRY_INTERVAL seconds, then tries again.
+REDIS_SOCKET_TIMEOUT = 1
+REDIS_RETRY_INTERVAL = 5
+REDIS_HEALTH_CHECK_INTERVAL = 30
+
+# In-process LRU in front of Redis (logic/cache.py). Kept in its own Redis
+# database so cache.clear() cannot touch carts or rate limits.
+CACHES = {
+    'default': {
+        'BACKEND': 'logic.cache.TwoTierCache',
+        'LOCATION': os.getenv('CACHE_URL', 'redis://127.0.0.1:6379/1'),
+        'KEY_PREFIX': 'ecommerce',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TTL': 30,
+            'VERSION_CHECK_INTERVAL': 1,
+            'LOCK_TIMEOUT': 10,
+            'REDIS_OPTIONS': {'socket_connect_timeout': 1, 'socket_timeout': 1},
+        },
+    },
+    # Plain Redis for sessions: an in-process copy could outlive a logout.
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('SESSION_REDIS_URL', 'redis://127.0.0.1:6379/2'),
+        'KEY_PREFIX': 'ecommerce',
+        'OPTIONS': {'socket_connect_timeout': 1, 'socket_timeout': 1},
+    },
+}
 
-EMAIL_HOST_USER = 'solaradeveloper@gmail.com'
-EMAIL_HOST_PASSWORD = 'gagblwstndqrvpcm'
+# The tests flush Redis, so they run against these databases instead of the
+# ones above (logic/test_runner.py). Keys are REDIS_URL and cache aliases.
+TEST_REDIS = {
+    'REDIS_URL': os.getenv('TEST_REDIS_URL', 'redis://127.0.0.1:6379/13'),
+    'default': os.getenv('TEST_CACHE_URL', 'redis://127.0.0.1:6379/14'),
+    'sessions': os.getenv('TEST_SESSION_REDIS_URL', 'redis://127.0.0.1:6379/15'),
+}
+TEST_RUNNER = 'logic.test_runner.RedisTestRunner'
+
+# Sessions in Redis, falling back to django_session (logic/sessions.py).
+SESSION_ENGINE = 'logic.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+
+# RATELIMIT_ENABLED=0 lets every request through, e.g. for a load test whose
+# virtual users all come from one address (bench/loadtest.py).
+RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', '1') == '1'
+# Rate limits applied by logic.ratelimit.RateLimitMiddleware, by path prefix.
+# Per-view limits use the @ratelimit decorator instead.
+RATELIMIT_RULES = [
+    {'path': '/api/', 'name': 'api', 'rate': '600/m', 'key': 'user', 'algorithm': 'bucket'},
+]
+
+# Request metrics served on /metrics (logic/metrics.py). Every worker writes
+# its numbers to METRICS_DIR and the endpoint adds them up, folding exited
+# workers' files into one. Use a directory per host. Scrapes must send
+# METRICS_TOKEN as a bearer token; with no token set the endpoint is a 404
+# unless DEBUG is on.
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'ecommerce-metrics'))
+METRICS_FLUSH_INTERVAL = 1
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Opt-in request profiling (logic/profiling.py): requests with an X-Profile
+# header from `manage.py profile_token`, plus a random PROFILE_SAMPLE_RATE of
+# the requests under PROFILE_PATHS (all paths if empty).
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_PATHS = ['/buy/', '/api/checkout/']
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'sampling')
+PROFILE_INTERVAL = 0.005
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'ecommerce-profiles'))
+PROFILE_MAX_FILES = 200
+PROFILE_MAX_BYTES = 50 * 1024 * 1024
+PROFILE_TOKEN_MAX_AGE = 3600
+
+# Slow query log (logic/slowqueries.py): queries from the views slower than
+# the threshold are written with their EXPLAIN plan, once per fingerprint per
+# dedup window. SLOW_QUERY_THRESHOLD_MS=off (or empty) in the environment
+# turns it off.
+_slow_query_threshold = os.getenv('SLOW_QUERY_THRESHOLD_MS', '100').strip().lower()
+SLOW_QUERY_THRESHOLD_MS = None if _slow_query_threshold in ('', 'off', 'none') else float(_slow_query_threshold)
+SLOW_QUERY_MODULES = ['logic.views']
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', os.path.join(tempfile.gettempdir(), 'ecommerce-slow-queries.jsonl'))
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+SLOW_QUERY_DEDUP_WINDOW = 300
+SLOW_QUERY_EXPLAIN = True
+
+# Bank service (logic/bank.py)
+BANK_URL = os.getenv('BANK_URL', 'http://localhost:8001')
+BANK_CONNECT_TIMEOUT = 2
+BANK_READ_TIMEOUT = 5
+BANK_POOL_SIZE = 10
+BANK_BREAKER_THRESHOLD = 5
+BANK_BREAKER_RESET = 30
+# Read once here; the client caches the signed token until shortly before expiry.
+BANK_JWT_SECRET = os.getenv('JWT_SECRET')
+
+# Outbox worker (python manage.py drain_outbox)
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BASE_BACKOFF = 5
+OUTBOX_MAX_BACKOFF = 3600
+OUTBOX_LEASE_SECONDS = 60
+# Delivered messages are deleted after this many days by drain_outbox.
+OUTBOX_RETENTION_DAYS = 7
+
+# Batched bank history sync (python manage.py sync_history)
+HISTORY_BATCH_SIZE = 500
+HISTORY_MAX_AGE = 30
+
+# Admin order emails (logic/digest.py): orders below ADMIN_IMMEDIATE_TOTAL are
+# summarised in one digest per ADMIN_DIGEST_WINDOW seconds; 0 disables it.
+ADMIN_DIGEST_WINDOW = 900
+ADMIN_IMMEDIATE_TOTAL = 1000
+ADMIN_DIGEST_MAX_ORDERS = 500
+
+# Order ids (logic/ids.py): ORDER_ID_NODE is this host's number (0-31),
+# unique per host; each process on it claims one of 32 worker slots by
+# locking a file in ORDER_ID_SLOT_DIR.
+ORDER_ID_NODE = os.getenv('ORDER_ID_NODE')
+ORDER_ID_SLOT_DIR = os.getenv('ORDER_ID_SLOT_DIR', os.path.join(tempfile.gettempdir(), 'ecommerce-order-id-slots'))
 WSGI_APPLICATION = 'settings.wsgi.application'
 
 
@@ -136,6 +264,27 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing (logic/hashers.py). The first hasher hashes new passwords;
+# the rest still verify older hashes, which are upgraded on the next login.
+# Hashers are looked up by algorithm and the tuned one is 'argon2' too, so it
+# also verifies (and upgrades) hashes made with Django's stock Argon2 costs.
+PASSWORD_HASHER_PROFILES = {
+    'argon2': [
+        'logic.hashers.TunedArgon2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    ],
+    'pbkdf2': [
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'logic.hashers.TunedArgon2PasswordHasher',
+    ],
+}
+PASSWORD_HASHER_PROFILE = os.getenv('PASSWORD_HASHER_PROFILE', 'argon2')
+PASSWORD_HASHERS = PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]
+PASSWORD_HASH_WORKERS = None  # default: one per core
+PASSWORD_HASH_QUEUE = 64
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -162,3 +311,10 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Product catalog (logic/catalog.py)
+CATALOG_VERSION_CHECK_INTERVAL = 1
+CATALOG_LOCAL_TTL = 60
+
+# Order history page size (home page and /api/orders/)
+ORDERS_PAGE_SIZE = 20
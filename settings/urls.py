@@ -3,7 +3,7 @@ URL configuration for settings project.
 """
 from django.contrib import admin
 from django.urls import path
-from logic import views
+from logic import metrics, views
 
 urlpatterns = [
     # Admin
@@ -28,8 +28,12 @@ urlpatterns = [
     path('api/cleancart/', views.cleancart, name='cleancart'),
     path('api/delone/<int:id>/', views.delone, name='delete_cart_item'),
     path('api/checkout/', views.checkout_data, name='checkout_data'),
+    path('api/orders/', views.orders_page, name='orders_page'),
 
     # Checkout & Purchase
     path('buy/', views.buy, name='buy'),
     path('api/validate-checkout/', views.validate_checkout, name='validate_checkout'),
+
+    # Monitoring
+    path('metrics', metrics.metrics_view, name='metrics'),
 ]
\ No newline at end of file